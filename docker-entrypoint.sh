@@ -26,4 +26,9 @@ if [ -n "$MANAGE_MIGRATE" ]; then
   python manage.py migrate
 fi
 
+# compiled theme stylesheets live in STATIC_ROOT too
+if [ -n "$MANAGE_COLLECTCLEAR" ] || [ -n "$MANAGE_COLLECTSTATIC" ]; then
+  python manage.py compile_themes
+fi
+
 exec "$@"
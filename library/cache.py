@@ -0,0 +1,118 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+VERSION_KEY = 'storkive:version:{}'
+PAGE_KEY = 'storkive:page:{}:{}'
+
+# stamp for the slants and themes every page shows; see site_processor
+SITE = 'site'
+# stamp for every story listing; see library.signals._bump_tags
+CATALOG = 'catalog'
+# stamp for a reader's lists and profile; see library.signals._bump_readers
+READER = 'user:{}'
+# stamp for a year of What Was New, or 'years' for which ones there are;
+# see WeeklyDigest.refresh
+DIGEST = 'wwn:{}'
+
+
+def get_version(name):
+    """Return the current stamp for `name`, shared by every worker through
+    the default cache. That has to be a backend every worker sees, not
+    LocMemCache; see settings.common."""
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        # a fresh stamp, so nothing cached before an eviction matches it
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(names):
+    """Like get_version(), for many stamps at once."""
+    keys = {VERSION_KEY.format(name): name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_version(name, *names):
+    """Invalidate everything stamped with `name` (and `names`), once the
+    current transaction commits; any sooner and another worker could cache
+    the old rows under the new stamp."""
+    keys = {VERSION_KEY.format(n) for n in (name,) + names}
+
+    def bump():
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+    transaction.on_commit(bump)
+
+
+def local_cached(name):
+    """Keep the result of a no-argument function in this process until the
+    `name` stamp changes. Every process checks the stamp in the default
+    cache, so it must be a shared one for a bump to reach them all."""
+    def decorator(func):
+        entry = {}
+
+        @wraps(func)
+        def wrapper():
+            version = get_version(name)
+            if entry.get('version') != version:
+                entry['value'] = func()
+                entry['version'] = version
+            return entry['value']
+
+        wrapper.cache_name = name
+        return wrapper
+    return decorator
+
+
+def is_tagging(request):
+    """Whether the page being rendered is cached by cache_tagged(), and so
+    has any use for tag_request()."""
+    return hasattr(request, '_cache_tags')
+
+
+def tag_request(request, *tags):
+    """Record that the page being rendered depends on `tags`. Call it
+    before reading what a tag covers, so a change that lands in between
+    invalidates the page rather than being cached under the new stamp."""
+    if is_tagging(request):
+        request._cache_tags.update(get_versions(tags))
+
+
+def cache_tagged(timeout, key_prefix=''):
+    """Cache a view's anonymous GET responses until `timeout` passes or
+    one of the stamps it tagged with tag_request() is bumped. Every page
+    also depends on `site`, which covers the slants and themes.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+
+            path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+            key = PAGE_KEY.format(key_prefix, path)
+            entry = cache.get(key)
+            if entry is not None:
+                tags, content_type, content = entry
+                if get_versions(tags) == tags:
+                    return HttpResponse(content, content_type=content_type)
+
+            request._cache_tags = {}
+            tag_request(request, SITE)
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                entry = (request._cache_tags, response['Content-Type'], response.content)
+                cache.set(key, entry, timeout)
+            return response
+        return wrapper
+    return decorator
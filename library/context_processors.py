@@ -1,33 +1,61 @@
+from functools import lru_cache
+
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
-from library.models import Slant, Theme
+from library.cache import SITE, local_cached
+from library.models import List, Slant, Theme
 
 
-def site_processor(request):
-    # figure out which theme to use
-    try:
-        current_theme = request.user.profile.theme
-    except AttributeError:
-        current_theme = Theme.objects.filter(active=True).first()
+@local_cached(SITE)
+def _site_globals():
+    # NOTE: bumped from library.signals whenever a Slant or Theme changes
+    return {
+        'active_theme': Theme.objects.filter(active=True).defer('css').first(),
+        'slants': list(Slant.objects.all()),
+    }
 
-    # compute the nav links to show
-    url_name = request.resolver_match.url_name
-    site_links = [
+
+@lru_cache(maxsize=None)
+def _site_links(authenticated):
+    links = [
         {'name': 'whats_new', 'href': reverse('whats_new'), 'label': "What's New"},
         {'name': 'titles', 'href': reverse('titles'), 'label': 'Titles'},
         {'name': 'sagas', 'href': reverse('sagas'), 'label': 'Sagas'},
         {'name': 'authors', 'href': reverse('authors'), 'label': 'Authors'},
         {'name': 'codes', 'href': reverse('codes'), 'label': 'Codes'},
+        {'name': 'search', 'href': reverse('search'), 'label': 'Search'},
     ]
-    if request.user.is_authenticated:
-        site_links.extend([
+    if authenticated:
+        links.extend([
             {'name': 'lists', 'href': reverse('lists'), 'label': 'My Lists'},
             {'name': 'profile', 'href': reverse('user_profile'), 'label': 'Profile'},
         ])
-    site_links = [sl for sl in site_links if sl['name'] != url_name]
+    return tuple(links)
+
+
+def site_processor(request):
+    cached = _site_globals()
+
+    # figure out which theme to use
+    try:
+        current_theme = request.user.profile.theme
+    except AttributeError:
+        current_theme = cached['active_theme']
+
+    # compute the nav links to show
+    url_name = request.resolver_match.url_name
+    site_links = [sl for sl in _site_links(request.user.is_authenticated)
+                  if sl['name'] != url_name]
+
+    # the lists each story is on, for the stars next to them
+    memberships = {}
+    if request.user.is_authenticated:
+        memberships = SimpleLazyObject(lambda: List.memberships(request.user)[1])
 
     return {
         'current_theme': current_theme,
+        'memberships': memberships,
         'site_links': site_links,
-        'slants': Slant.objects.all(),
+        'slants': cached['slants'],
     }
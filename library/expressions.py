@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models import Subquery, CharField, Func
+from django.db.models import Subquery, CharField, Func, JSONField
 
 # NOTE: not EVERYTHING needs to be an Aggregate, yo
 #       https://docs.djangoproject.com/en/2.0/ref/models/expressions/#func-expressions
@@ -34,6 +34,46 @@ class Concat(Func):
         return self.as_sql(compiler, connection, function='string_agg')
 
 
+# noinspection PyAbstractClass
+class JSONArray(Subquery):
+    """Collect the rows of a queryset into a JSON array, sorted in SQL by
+    the lowercased `ordering` field. A single field gives an array of its
+    values; several give an array of objects keyed by field name.
+    """
+    output_field = JSONField()
+
+    def __init__(self, queryset, fields, ordering=None, **extra):
+        self.fields = tuple(fields)
+        self.ordering = ordering or self.fields[0]
+        super().__init__(queryset.order_by().values(*self.fields), **extra)
+
+    def _element(self, connection, build_object):
+        columns = ['_rows.' + connection.ops.quote_name(f) for f in self.fields]
+        if len(columns) == 1:
+            return columns[0]
+        pairs = ("'%s', %s" % (f, c) for f, c in zip(self.fields, columns))
+        return '%s(%s)' % (build_object, ', '.join(pairs))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # aggregate inputs are ordered by the enclosing derived table
+        template = "(SELECT json_group_array(%(element)s) " \
+                   "FROM (SELECT * FROM (%(subquery)s) ORDER BY lower(%(ordering)s)) _rows)"
+        return super().as_sql(compiler, connection,
+                              template=template,
+                              element=self._element(connection, 'json_object'),
+                              ordering=connection.ops.quote_name(self.ordering),
+                              **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        template = "(SELECT COALESCE(jsonb_agg(%(element)s ORDER BY lower(%(ordering)s)), '[]') " \
+                   "FROM (%(subquery)s) _rows)"
+        return super().as_sql(compiler, connection,
+                              template=template,
+                              element=self._element(connection, 'jsonb_build_object'),
+                              ordering='_rows.' + connection.ops.quote_name(self.ordering),
+                              **extra_context)
+
+
 # noinspection PyAbstractClass
 class SQCount(Subquery):
     template = "(SELECT count(*) FROM (%(subquery)s) _count)"
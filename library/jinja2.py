@@ -4,7 +4,8 @@ from django.contrib.staticfiles.storage import staticfiles_storage
 from django.urls import reverse
 from jinja2 import Environment
 
-from library.templatetags.library_extras import story_count, long_fmt, up_count, short_fmt, index_cell, classes
+from library.templatetags.library_extras import story_count, long_fmt, up_count, short_fmt, index_cell, classes, \
+    length_fmt
 from storkive.__version__ import __url__ as storkive_url
 from storkive.__version__ import __version__ as storkive_version
 
@@ -22,6 +23,7 @@ def environment(**options):
         'classes': classes,
         'index_cell': index_cell,
         'intcomma': intcomma,
+        'length_fmt': length_fmt,
         'long_fmt': long_fmt,
         'short_fmt': short_fmt,
         'story_count': story_count,
@@ -0,0 +1,38 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.models import ActivityEvent, Installment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the ActivityEvent rollup by replaying every installment.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of events to insert per query.',
+        )
+
+    def handle(self, *args, batch_size=1000, **options):
+        rows = Installment.objects \
+            .order_by('story_id', 'published_on', 'ordinal') \
+            .values_list('pk', 'story_id', 'ordinal', 'published_on') \
+            .iterator()
+
+        added = 0
+        with transaction.atomic():
+            # kinds depend on everything published before, so nothing is kept
+            ActivityEvent.objects.all().delete()
+            events = ActivityEvent.replay(rows)
+            while True:
+                batch = list(islice(events, batch_size))
+                if not batch:
+                    break
+                ActivityEvent.objects.bulk_create(batch)
+                added += len(batch)
+
+        self.stdout.write(self.style.SUCCESS('Recorded {:d} events.'.format(added)))
@@ -0,0 +1,36 @@
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand
+
+from library.cache import SITE, bump_version
+from library.models import Theme
+
+
+class Command(BaseCommand):
+    help = 'Compile every theme stylesheet into static storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Delete compiled stylesheets no theme refers to anymore.',
+        )
+
+    def handle(self, *args, prune=False, **options):
+        themes = list(Theme.objects.all())
+        for theme in themes:
+            theme.compile_css()
+        # no save(); that would touch updated_at and re-run the signals
+        Theme.objects.bulk_update(themes, ['css_path'])
+        bump_version(SITE)
+
+        pruned = 0
+        if prune and staticfiles_storage.exists(Theme.THEMES_DIR):
+            keep = {t.css_path.rsplit('/', 1)[-1] for t in themes}
+            _, files = staticfiles_storage.listdir(Theme.THEMES_DIR)
+            for name in files:
+                if name.rsplit('.css', 1)[0] + '.css' not in keep:
+                    staticfiles_storage.delete('{}/{}'.format(Theme.THEMES_DIR, name))
+                    pruned += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            'Compiled {:d} themes, pruned {:d} files.'.format(len(themes), pruned)))
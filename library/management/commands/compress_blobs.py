@@ -0,0 +1,53 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from library.models import Blob
+
+
+def _compress(name):
+    """Runs in the worker processes."""
+    with default_storage.open(name, 'rb') as f:
+        return Blob.store_variants(name, f.read())
+
+
+class Command(BaseCommand):
+    help = 'Write the compressed variants of the stored blobs missing some.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of processes compressing files.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of blobs to update at once.',
+        )
+
+    def handle(self, *args, workers=None, batch_size=500, **options):
+        # e.g. blobs from before variants, or before brotli was installed
+        blobs = list(Blob.objects
+                     .exclude(encodings=','.join(Blob.CODINGS))
+                     .order_by('pk')
+                     .values_list('pk', 'file'))
+
+        compressed = 0
+        with ProcessPoolExecutor(workers) as pool:
+            encodings = pool.map(_compress, [name for _, name in blobs], chunksize=8)
+            blobs = iter(blobs)
+            while True:
+                batch = [Blob(pk=pk, encodings=codings)
+                         for (pk, _), codings in zip(islice(blobs, batch_size), encodings)]
+                if not batch:
+                    break
+                Blob.objects.bulk_update(batch, ['encodings'])
+                compressed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS('Compressed {:d} blobs.'.format(compressed)))
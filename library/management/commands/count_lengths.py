@@ -0,0 +1,73 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.cache import CATALOG, bump_version
+from library.models import Installment, StoryStats
+from library.util import count_text
+
+
+def _count(name, unit):
+    """Runs in the worker processes."""
+    with default_storage.open(name, 'rb') as f:
+        return count_text(f.chunks(), unit)
+
+
+class Command(BaseCommand):
+    help = 'Count the words (or chars) of stored installments into Installment.length.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='recount',
+            help='Recount every installment, not only those without a length.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of processes reading files.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of files to count per transaction.',
+        )
+
+    def handle(self, *args, recount=False, workers=None, batch_size=500, **options):
+        qs = Installment.objects.exclude(file='')
+        if not recount:
+            qs = qs.filter(length=0)
+
+        # installments sharing a blob are only read once
+        installments = defaultdict(list)
+        for pk, name, unit, story_id in qs.order_by('pk').values_list('pk', 'file', 'length_unit', 'story_id'):
+            installments[name, unit].append((pk, story_id))
+        files = list(installments)
+
+        counted = 0
+        with ProcessPoolExecutor(workers) as pool:
+            lengths = pool.map(_count, *zip(*files), chunksize=8) if files else iter(())
+            files = iter(files)
+            while True:
+                batch = list(zip(islice(files, batch_size), lengths))
+                if not batch:
+                    break
+                updates = [Installment(pk=pk, length=length)
+                           for key, length in batch
+                           for pk, _ in installments[key]]
+                story_ids = {story_id for key, _ in batch for _, story_id in installments[key]}
+                with transaction.atomic():
+                    Installment.objects.bulk_update(updates, ['length'])
+                    StoryStats.refresh(story_ids)
+                    bump_version(CATALOG, *('story:{}'.format(pk) for pk in story_ids))
+                counted += len(updates)
+
+        self.stdout.write(self.style.SUCCESS('Counted {:d} installments.'.format(counted)))
@@ -0,0 +1,26 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from library.storage import LocalCacheStorage
+
+
+class Command(BaseCommand):
+    help = 'Evict the least recently read copies from the local media cache, and report on it.'
+
+    def handle(self, *args, **options):
+        # a LazyObject, but isinstance() sees through it
+        if not isinstance(default_storage, LocalCacheStorage):
+            self.stdout.write('The default storage has no local cache.')
+            return
+
+        evicted, size = default_storage.cull()
+        if size is None:
+            self.stdout.write('Another process is culling already.')
+        else:
+            self.stdout.write('Evicted {:d} copies, {:d} of {:d} bytes in use.'.format(
+                evicted, size, default_storage.max_size))
+        stats = default_storage.stats()
+        reads = stats['hits'] + stats['misses']
+        self.stdout.write(self.style.SUCCESS(
+            '{:d} hits, {:d} misses ({:.1%} hit), {:d} evictions.'.format(
+                stats['hits'], stats['misses'], stats['hits'] / reads if reads else 0, stats['evictions'])))
@@ -0,0 +1,291 @@
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import NoReverseMatch, resolve, reverse
+
+from library.models import ActivityEvent, Author, CatalogCount, Code, Installment, Saga, SagaEntry, Slant, \
+    Story, Theme, WeeklyDigest
+from storkive.__version__ import __version__ as storkive_version
+
+MANIFEST = '.export-manifest.json'
+
+# see _nav-pages.html and whats-new.html
+re_page_link = re.compile(rb'<a class="(prev|next) arrow" href="\?([^"]+)"')
+
+
+def _fingerprint(*parts):
+    data = json.dumps(parts, default=str, separators=(',', ':'))
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def _file_path(url):
+    path = url.lstrip('/')
+    return path + 'index.html' if not path or path.endswith('/') else path
+
+
+def _page_path(path, query):
+    """Where a later page of a listing goes: next to its first page, named
+    after the query string that leads to it, which Django never routes."""
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, hashlib.md5(query.encode('utf-8')).hexdigest()[:12], ext)
+
+
+def _close_connections():
+    # forked workers must not share the parent's connections
+    connections.close_all()
+
+
+def _get(url, query):
+    match = resolve(url)
+    request = RequestFactory().get(url + ('?' + query if query else ''))
+    request.user = AnonymousUser()
+    request.resolver_match = match
+    response = match.func(request, *match.args, **match.kwargs)
+    if response.status_code != 200:
+        return response.status_code, None
+    if response.streaming:
+        return 200, b''.join(response.streaming_content)
+    return 200, response.content
+
+
+def _write(out_dir, path, content):
+    path = os.path.join(out_dir, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+
+
+def _render(out_dir, url):
+    """Render an anonymous GET of `url` into `out_dir`, and then every page
+    after it, following the next links; the page links are pointed at the
+    files. Return `(url, status, paths of the later pages)`. Runs in the
+    worker processes."""
+    path, query, previous = _file_path(url), '', None
+    later = []
+    while True:
+        status, content = _get(url, query)
+        if status != 200:
+            return url, status, later
+
+        following = None
+
+        def relink(m):
+            nonlocal following
+            kind, target = m.group(1), m.group(2).decode('utf-8')
+            if kind == b'next':
+                following = target
+                name = _page_path(_file_path(url), target)
+            elif previous:
+                name = previous
+            else:
+                return m.group(0)
+            return b'<a class="%s arrow" href="%s"' % (kind, os.path.basename(name).encode('utf-8'))
+
+        _write(out_dir, path, re_page_link.sub(relink, content))
+        if following is None:
+            return url, 200, later
+        previous, query, path = path, following, _page_path(_file_path(url), following)
+        if path in later:
+            return url, 200, later
+        later.append(path)
+
+
+class Command(BaseCommand):
+    help = 'Export every public page to a directory tree, re-rendering only what changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'out_dir',
+            help='Where to write the pages.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of processes rendering pages; 1 renders in this one.',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='everything',
+            help='Re-render every page, changed or not.',
+        )
+
+    def handle(self, *args, out_dir, workers=None, everything=False, **options):
+        manifest_path = os.path.join(out_dir, MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        # {url: fingerprint}, and {url: the later pages written for it}
+        rendered = manifest.get('pages', {})
+        later = manifest.get('later', {})
+
+        pages = self.pages()
+        stale = [url for url, fp in pages.items() if everything or rendered.get(url) != fp]
+
+        failed = set()
+        gone = []
+        if stale:
+            os.makedirs(out_dir, exist_ok=True)
+            if workers == 1:
+                results = (_render(out_dir, url) for url in stale)
+            else:
+                pool = ProcessPoolExecutor(workers, initializer=_close_connections)
+                results = pool.map(_render, [out_dir] * len(stale), stale, chunksize=32)
+            for url, status, paths in results:
+                if status != 200:
+                    failed.add(url)
+                    self.stderr.write('{} {:d}'.format(url, status))
+                # e.g. a listing that got shorter
+                gone.extend(set(later.get(url, ())) - set(paths))
+                later[url] = paths
+            if workers != 1:
+                pool.shutdown()
+
+        for url in rendered.keys() - pages.keys():
+            gone.append(_file_path(url))
+            gone.extend(later.pop(url, ()))
+        removed = 0
+        for path in gone:
+            try:
+                os.remove(os.path.join(out_dir, path))
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+        manifest = {
+            'pages': {url: fp for url, fp in pages.items() if url not in failed},
+            'later': {url: paths for url, paths in later.items() if url in pages and paths},
+        }
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, separators=(',', ':'), sort_keys=True)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rendered {:d} of {:d} pages, removed {:d}, {:d} failed.'.format(
+                len(stale) - len(failed), len(pages), removed, len(failed))))
+
+    def pages(self):
+        """Return `{url: fingerprint}` for every public page. A page is only
+        re-rendered when its fingerprint changes, so each one covers
+        everything the page shows; for a paginated listing, that's every
+        page of it, as they're all rendered with the first. Installment
+        pages and bodies need a login, so they're left to Django."""
+        theme = Theme.objects.filter(active=True).values_list('css_path', flat=True).first()
+        slants = list(Slant.objects.values_list('abbr', 'description', 'affinity_id', 'display_order'))
+        site = (storkive_version, theme, slants)
+
+        story_fps = self.story_fingerprints()
+        saga_fps = {}
+        saga_entries = defaultdict(list)
+        for saga_id, order, story_id in SagaEntry.objects \
+                .order_by('saga_id', 'order') \
+                .values_list('saga_id', 'order', 'story_id'):
+            saga_entries[saga_id].append((order, story_fps.get(story_id)))
+        for row in Saga.objects.values_list(
+                'slug', 'name', 'synopsis', 'stats__authors', 'stats__codes', 'stats__updated_on'):
+            saga_fps[row[0]] = (row[0], _fingerprint(row, saga_entries[row[0]]))
+
+        pages = {}
+
+        def add(name, args, *parts):
+            try:
+                pages[reverse(name, args=args)] = _fingerprint(site, *parts)
+            except NoReverseMatch:
+                # e.g. unicode author slugs; left to Django
+                pass
+
+        add('index', [], CatalogCount.counts(CatalogCount.KIND_TOTAL))
+
+        # stories and sagas
+        slugs = dict(Story.objects.values_list('pk', 'slug'))
+        for pk, fp in story_fps.items():
+            add('story', [slugs[pk]], fp)
+        add('sagas', [], sorted(saga_fps.values()))
+        for saga_id, (saga_slug, saga_fp) in saga_fps.items():
+            add('saga', [saga_slug], saga_fp)
+        for saga_id, story_id in SagaEntry.objects.values_list('saga_id', 'story_id'):
+            saga_slug, saga_fp = saga_fps[saga_id]
+            add('saga_story', [saga_slug, slugs[story_id]], story_fps[story_id], saga_fp)
+
+        # catalog listings
+        by_letter = defaultdict(list)
+        for pk, letter in Story.objects.values_list('pk', 'sort_letter'):
+            by_letter[letter].append(story_fps[pk])
+        add('titles', [], CatalogCount.counts(CatalogCount.KIND_LETTER))
+        for letter, fps in by_letter.items():
+            if letter:
+                add('letter', [letter], sorted(fps))
+
+        by_author = defaultdict(list)
+        for story_id, author_id in Story.authors.through.objects.values_list('story_id', 'author_id'):
+            by_author[author_id].append(story_fps[story_id])
+        authors = list(Author.objects.values_list('pk', 'slug', 'name', 'email', 'homepage'))
+        add('authors', [], authors, CatalogCount.counts(CatalogCount.KIND_AUTHOR))
+        for author in authors:
+            add('author', [author[1]], author, sorted(by_author[author[0]]))
+
+        by_code = defaultdict(list)
+        for story_id, code_id in Story.codes.through.objects.values_list('story_id', 'code_id'):
+            by_code[code_id].append(story_fps[story_id])
+        codes = list(Code.objects.values_list('abbr', 'name'))
+        add('codes', [], codes, CatalogCount.counts(CatalogCount.KIND_CODE))
+        for code in codes:
+            add('code', [code[0]], code, sorted(by_code[code[0]]))
+
+        # what's new, all the way back
+        events = ActivityEvent.objects \
+            .order_by('date', 'story_id', 'ordinal') \
+            .values_list('date', 'story_id', 'ordinal', 'kind') \
+            .iterator()
+        add('whats_new', [], [(e, story_fps.get(e[1])) for e in events])
+
+        this_year = dt.date.today().year
+        digests = defaultdict(list)
+        for row in WeeklyDigest.objects.order_by('year', 'week', 'story_id').values_list(
+                'year', 'week', 'story_id', 'is_update', 'up_count', 'published_on'):
+            digests[row[0]].append((row, story_fps.get(row[2])))
+        years = sorted(digests)
+        for year in years:
+            # the title depends on whether it's this year
+            add('wwn_year', [year], digests[year], years, year == this_year)
+        if years:
+            add('what_was_new', [], digests[years[-1]], years, years[-1] == this_year)
+
+        return pages
+
+    def story_fingerprints(self):
+        """Everything a story page shows: the story, its stats, sagas and
+        installments, by checksum."""
+        installments = defaultdict(list)
+        rows = Installment.objects \
+            .order_by('story_id', 'ordinal', 'published_on') \
+            .values_list('story_id', 'ordinal', 'published_on', 'is_current', 'title', 'checksum',
+                         'length', 'length_unit')
+        for row in rows.iterator():
+            installments[row[0]].append(row[1:])
+
+        sagas = defaultdict(list)
+        for story_id, slug, name in SagaEntry.objects \
+                .order_by('story_id', 'saga__slug') \
+                .values_list('story_id', 'saga__slug', 'saga__name'):
+            sagas[story_id].append((slug, name))
+
+        rows = Story.objects.values_list(
+            'pk', 'slug', 'title', 'synopsis', 'slant_id', 'published_on', 'updated_on',
+            'stats__authors', 'stats__codes', 'stats__installment_count', 'stats__missing_count',
+            'stats__first_ordinal', 'stats__last_ordinal', 'stats__word_count')
+        return {row[0]: _fingerprint(row, installments[row[0]], sagas[row[0]])
+                for row in rows.iterator()}
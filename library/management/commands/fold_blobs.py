@@ -0,0 +1,82 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.models import Blob, Installment
+from library.util import blob_path
+
+
+def _fold(name):
+    """Copy a file from before blobs to where its blob goes; see Blob.store.
+    Runs in the worker processes."""
+    if not default_storage.exists(name):
+        return None
+    with default_storage.open(name, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    path = blob_path(digest)
+    if not default_storage.exists(path):
+        # an unlucky race writes the same bytes twice, nothing worse
+        path = default_storage.save(path, ContentFile(content))
+    return digest, path, len(content), Blob.store_variants(path, content)
+
+
+class Command(BaseCommand):
+    help = 'Move the installments from before blobs onto blobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of processes copying files.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of installments to update per transaction.',
+        )
+
+    def handle(self, *args, workers=None, batch_size=500, **options):
+        # NOTE: every batch commits on its own, so an interrupted run resumes
+        #       by running again; the old files stay put until
+        #       `manage.py prune_blobs --legacy`
+        installments = list(Installment.objects
+                            .filter(blob__isnull=True)
+                            .exclude(file='')
+                            .order_by('pk')
+                            .values_list('pk', 'file'))
+
+        folded = missing = 0
+        with ProcessPoolExecutor(workers) as pool:
+            blobs = pool.map(_fold, [name for _, name in installments], chunksize=8)
+            installments = iter(installments)
+            while True:
+                batch = [(pk, blob) for (pk, _), blob in zip(islice(installments, batch_size), blobs)]
+                if not batch:
+                    break
+                found = {blob[0]: blob for _, blob in batch if blob}
+                missing += len(batch) - sum(1 for _, blob in batch if blob)
+                with transaction.atomic():
+                    Blob.objects.bulk_create([Blob(digest=digest, file=path, size=size, encodings=encodings)
+                                              for digest, path, size, encodings in found.values()],
+                                             ignore_conflicts=True)
+                    stored = {digest: (pk, name) for digest, pk, name in
+                              Blob.objects
+                              .filter(digest__in=found.keys())
+                              .values_list('digest', 'pk', 'file')}
+                    updates = [Installment(pk=pk, blob_id=stored[blob[0]][0], file=stored[blob[0]][1])
+                               for pk, blob in batch if blob]
+                    Installment.objects.bulk_update(updates, ['blob', 'file'])
+                    Blob.recount(pk for pk, _ in stored.values())
+                folded += len(updates)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Folded {:d} installments into blobs, {:d} files missing.'.format(folded, missing)))
@@ -0,0 +1,311 @@
+import base64
+import datetime as dt
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from library.cache import CATALOG, bump_version
+from library.models import ActivityEvent, Author, Blob, CatalogCount, Code, Installment, SagaEntry, \
+    SagaStats, Story, StoryStats, WeeklyDigest
+from library.search import get_backend
+from library.util import TextExtractor, blob_path, feed_html, get_author_slug, get_sort_letter, get_sort_name
+
+MANIFEST = 'manifest.jsonl'
+REQUIRED = ('story', 'ordinal', 'title', 'published_on', 'file')
+
+
+def _digest(path):
+    """Hash, count and extract a file for Blob.digest, Installment.checksum,
+    Installment.length and library.search in one pass. Runs in the worker
+    processes."""
+    sha, md5, size = hashlib.sha256(), hashlib.md5(), 0
+
+    def chunks(f):
+        nonlocal size
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha.update(chunk)
+            md5.update(chunk)
+            size += len(chunk)
+            yield chunk
+
+    with open(path, 'rb') as f:
+        text = feed_html(TextExtractor(), chunks(f))
+    return sha.hexdigest(), base64.b64encode(md5.digest()).decode('utf-8'), size, text.words, text.text
+
+
+def _upload(path, digest):
+    """Store a file and its compressed variants; see Blob.store."""
+    name = blob_path(digest)
+    with open(path, 'rb') as f:
+        if not default_storage.exists(name):
+            name = default_storage.save(name, File(f))
+            f.seek(0)
+        encodings = Blob.store_variants(name, f.read())
+    return digest, (name, encodings)
+
+
+class Command(BaseCommand):
+    help = 'Bulk import installments listed in a JSON Lines manifest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'manifest',
+            help='A manifest file, or a directory with a {} in it. Each line is one installment: '
+                 'story, ordinal, title, published_on and file (relative to the manifest), plus '
+                 'optional story_title, authors and codes.'.format(MANIFEST),
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of installments to import per transaction.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of processes hashing files.',
+        )
+        parser.add_argument(
+            '--uploads',
+            type=int,
+            default=8,
+            help='Number of files to upload to storage at once.',
+        )
+
+    def handle(self, *args, manifest, batch_size=1000, workers=None, uploads=8, **options):
+        if os.path.isdir(manifest):
+            manifest = os.path.join(manifest, MANIFEST)
+        root = os.path.dirname(os.path.abspath(manifest))
+        records = list(self.read_manifest(manifest, root))
+
+        # NOTE: every batch commits on its own, and whatever already exists
+        #       is skipped, so an interrupted import resumes by running again
+        self.authors = {slug.lower(): pk for slug, pk in Author.objects.values_list('slug', 'pk')}
+        self.stories = dict(Story.objects.values_list('slug', 'pk'))
+        self.codes = set(Code.objects.values_list('abbr', flat=True))
+
+        imported = 0
+        with ProcessPoolExecutor(workers) as hashers, ThreadPoolExecutor(uploads) as uploaders:
+            for i in range(0, len(records), batch_size):
+                batch = self.pending(records[i:i + batch_size])
+                if not batch:
+                    continue
+                digests = hashers.map(_digest, [r['path'] for r in batch], chunksize=16)
+                for record, (digest, checksum, size, length, text) in zip(batch, digests):
+                    record.update(digest=digest, checksum=checksum, size=size, length=length, text=text)
+                with transaction.atomic():
+                    self.import_batch(batch, uploaders)
+                for record in batch:
+                    del record['text']
+                imported += len(batch)
+                self.stdout.write('{:d}/{:d}'.format(i + len(batch), len(records)))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {:d} of {:d} installments.'.format(imported, len(records))))
+
+    def read_manifest(self, manifest, root):
+        with open(manifest, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    missing = [key for key in REQUIRED if not record.get(key)]
+                    if missing:
+                        raise ValueError('missing ' + ', '.join(missing))
+                    record['ordinal'] = int(record['ordinal'])
+                    record['published_on'] = dt.date.fromisoformat(record['published_on'])
+                except ValueError as e:
+                    raise CommandError('{}:{:d}: {}'.format(manifest, line_no, e))
+                record['path'] = os.path.join(root, record['file'])
+                yield record
+
+    def pending(self, batch):
+        """Drop the records that were imported before, or are repeated."""
+        story_ids = {self.stories[r['story']] for r in batch if r['story'] in self.stories}
+        seen = {(story_id, ordinal, published_on) for story_id, ordinal, published_on in
+                Installment.objects
+                .filter(story_id__in=story_ids)
+                .values_list('story_id', 'ordinal', 'published_on')}
+        pending = []
+        for record in batch:
+            key = (self.stories.get(record['story'], record['story']), record['ordinal'],
+                   record['published_on'])
+            if key not in seen:
+                seen.add(key)
+                pending.append(record)
+        return pending
+
+    def import_batch(self, batch, uploaders):
+        self.resolve_authors(batch)
+        new_stories = self.resolve_stories(batch)
+        blobs = self.resolve_blobs(batch, uploaders)
+
+        installments = [
+            Installment(story_id=self.stories[r['story']],
+                        ordinal=r['ordinal'],
+                        title=r['title'][:Installment.TITLE_LEN],
+                        published_on=r['published_on'],
+                        blob_id=blobs[r['digest']][0],
+                        file=blobs[r['digest']][1],
+                        checksum=r['checksum'],
+                        length=r['length'])
+            for r in batch
+        ]
+        Installment.objects.bulk_create(installments)
+        # the events before the earliest new installment of each story stand
+        since = {}
+        for inst in installments:
+            since[inst.story_id] = min(inst.published_on, since.get(inst.story_id, inst.published_on))
+        story_ids = set(since)
+        inst_ids = {(story_id, ordinal, published_on): pk for pk, story_id, ordinal, published_on in
+                    Installment.objects
+                    .filter(story_id__in=story_ids)
+                    .values_list('pk', 'story_id', 'ordinal', 'published_on')}
+
+        through = Installment.authors.through
+        through.objects.bulk_create(
+            through(installment_id=inst_ids[(self.stories[r['story']], r['ordinal'], r['published_on'])],
+                    author_id=self.authors[slug])
+            for r in batch
+            for slug in {get_author_slug(name).lower() for name in r.get('authors', ())})
+
+        current = self.fix_current(story_ids)
+        self.index(batch, inst_ids, current, new_stories)
+        self.refresh(since, {pk for pk, _ in blobs.values()}, new_stories)
+
+    def resolve_authors(self, batch):
+        # slugs are matched case-insensitively; see Author._perform_unique_checks
+        new = {}
+        for record in batch:
+            for name in record.get('authors', ()):
+                slug = get_author_slug(name)
+                if slug.lower() not in self.authors:
+                    new.setdefault(slug.lower(), Author(name=name, slug=slug))
+        if new:
+            Author.objects.bulk_create(new.values())
+            self.authors.update((slug.lower(), pk) for slug, pk in
+                                Author.objects
+                                .filter(slug__in=[a.slug for a in new.values()])
+                                .values_list('slug', 'pk'))
+
+    def resolve_stories(self, batch):
+        """Create the stories that don't exist yet, with their authors and
+        codes. Existing stories are left as they are."""
+        new = {}
+        for record in batch:
+            slug = record['story']
+            if slug in self.stories:
+                continue
+            if slug not in new:
+                title = record.get('story_title') or record['title']
+                sort_title = get_sort_name(title)[:Story.TITLE_LEN]
+                new[slug] = (Story(title=title[:Story.TITLE_LEN],
+                                   slug=slug,
+                                   sort_title=sort_title,
+                                   sort_letter=get_sort_letter(sort_title),
+                                   published_on=record['published_on'],
+                                   updated_on=record['published_on']), set(), set())
+            story, authors, codes = new[slug]
+            story.published_on = min(story.published_on, record['published_on'])
+            story.updated_on = max(story.updated_on, record['published_on'])
+            authors.update(get_author_slug(name).lower() for name in record.get('authors', ()))
+            codes.update(record.get('codes', ()))
+        if not new:
+            return new
+
+        Story.objects.bulk_create(story for story, _, _ in new.values())
+        self.stories.update(Story.objects.filter(slug__in=new.keys()).values_list('slug', 'pk'))
+
+        missing_codes = {abbr for _, _, codes in new.values() for abbr in codes} - self.codes
+        Code.objects.bulk_create(Code(abbr=abbr) for abbr in missing_codes)
+        self.codes |= missing_codes
+
+        Story.authors.through.objects.bulk_create(
+            Story.authors.through(story_id=self.stories[slug], author_id=self.authors[author])
+            for slug, (_, authors, _) in new.items()
+            for author in authors)
+        Story.codes.through.objects.bulk_create(
+            Story.codes.through(story_id=self.stories[slug], code_id=abbr)
+            for slug, (_, _, codes) in new.items()
+            for abbr in codes)
+        return new
+
+    def resolve_blobs(self, batch, uploaders):
+        """Return `{digest: (blob_id, name)}`, uploading only the content
+        that isn't stored yet."""
+        paths = {r['digest']: (r['path'], r['size']) for r in batch}
+        blobs = {digest: (pk, name) for digest, pk, name in
+                 Blob.objects.filter(digest__in=paths.keys()).values_list('digest', 'pk', 'file')}
+
+        missing = [digest for digest in paths if digest not in blobs]
+        stored = dict(uploaders.map(lambda digest: _upload(paths[digest][0], digest), missing))
+        Blob.objects.bulk_create([Blob(digest=digest, file=stored[digest][0], size=paths[digest][1],
+                                       encodings=stored[digest][1])
+                                  for digest in missing], ignore_conflicts=True)
+        blobs.update((digest, (pk, name)) for digest, pk, name in
+                     Blob.objects.filter(digest__in=missing).values_list('digest', 'pk', 'file'))
+        return blobs
+
+    def fix_current(self, story_ids):
+        """Only the latest version of each installment is current."""
+        rows = Installment.objects \
+            .filter(story_id__in=story_ids) \
+            .order_by('story_id', 'ordinal', '-published_on') \
+            .values_list('pk', 'story_id', 'ordinal')
+        current = [next(versions)[0] for _, versions in groupby(rows, itemgetter(1, 2))]
+        Installment.objects.filter(story_id__in=story_ids).exclude(pk__in=current).update(is_current=False)
+        Installment.objects.filter(pk__in=current).update(is_current=True)
+        return set(current)
+
+    def index(self, batch, inst_ids, current, new_stories):
+        """Feed library.search the text extracted while hashing, and drop
+        the versions that aren't current anymore."""
+        backend = get_backend()
+        backend.index_stories(self.stories[slug] for slug in new_stories)
+        backend.remove_installments(set(inst_ids.values()) - current)
+        docs = []
+        for r in batch:
+            story_id = self.stories[r['story']]
+            pk = inst_ids[story_id, r['ordinal'], r['published_on']]
+            if pk in current:
+                docs.append((pk, story_id, '', r['title'][:Installment.TITLE_LEN], r['text']))
+        backend.remove_installments(pk for pk, *_ in docs)
+        backend.insert(docs)
+
+    def refresh(self, since, blob_ids, new_stories):
+        """Do what library.signals would have, had the rows been saved one
+        at a time; `since` maps the stories to their earliest new date."""
+        story_ids = set(since)
+        CatalogCount.count_live(*StoryStats.refresh(story_ids))
+        SagaStats.refresh(SagaEntry.objects
+                          .filter(story_id__in=story_ids)
+                          .values_list('saga_id', flat=True))
+        WeeklyDigest.refresh(story_ids)
+        ActivityEvent.refresh(since)
+        Blob.recount(blob_ids)
+
+        if new_stories:
+            CatalogCount.adjust(CatalogCount.KIND_LETTER,
+                                Counter(story.sort_letter for story, _, _ in new_stories.values()))
+            CatalogCount.adjust(CatalogCount.KIND_AUTHOR,
+                                Counter(self.authors[a] for _, authors, _ in new_stories.values() for a in authors))
+            CatalogCount.adjust(CatalogCount.KIND_CODE,
+                                Counter(c for _, _, codes in new_stories.values() for c in codes))
+
+        tags = ['story:{}'.format(pk) for pk in story_ids]
+        for story, authors, codes in (new_stories or {}).values():
+            tags.append('letter:' + story.sort_letter)
+            tags.extend('author:{}'.format(self.authors[a]) for a in authors)
+            tags.extend('code:' + c for c in codes)
+        bump_version(CATALOG, 'activity', *tags)
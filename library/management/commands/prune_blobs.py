@@ -0,0 +1,59 @@
+import datetime as dt
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from library.models import Blob, Installment
+from library.util import STORIES_DIR
+
+
+def _walk(path):
+    dirs, files = default_storage.listdir(path)
+    for name in files:
+        yield '{}/{}'.format(path, name)
+    for name in dirs:
+        yield from _walk('{}/{}'.format(path, name))
+
+
+class Command(BaseCommand):
+    help = 'Recount blob references and delete the blobs nothing refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=24,
+            help='Keep unreferenced blobs younger than this many hours (default: 24).',
+        )
+        parser.add_argument(
+            '--legacy',
+            action='store_true',
+            help='Also delete the per-installment files from before blobs.',
+        )
+
+    def handle(self, *args, grace=24, legacy=False, **options):
+        # a blob stored by an installment that isn't saved yet has no refs
+        cutoff = timezone.now() - dt.timedelta(hours=grace)
+        with transaction.atomic():
+            Blob.recount(Blob.objects.values_list('pk', flat=True))
+            orphans = list(Blob.objects
+                           .select_for_update()
+                           .filter(ref_count=0, created_at__lt=cutoff))
+            Blob.objects.filter(pk__in=[b.pk for b in orphans]).delete()
+        for blob in orphans:
+            default_storage.delete(blob.file.name)
+            for coding in blob.encoding_list:
+                default_storage.delete(blob.file.name + Blob.VARIANTS[coding])
+
+        legacy_files = 0
+        if legacy and default_storage.exists(STORIES_DIR):
+            in_use = set(Installment.objects.exclude(file='').values_list('file', flat=True))
+            for name in _walk(STORIES_DIR):
+                if name not in in_use:
+                    default_storage.delete(name)
+                    legacy_files += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            'Pruned {:d} blobs and {:d} legacy files.'.format(len(orphans), legacy_files)))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.cache import DIGEST, bump_version
+from library.models import Installment, Story, WeeklyDigest
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the WeeklyDigest rollup behind What Was New.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year',
+            type=int,
+            help='Only rebuild this year.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of stories to refresh per query.',
+        )
+
+    def handle(self, *args, year=None, batch_size=500, **options):
+        if year is None:
+            story_ids = Story.objects.values_list('pk', flat=True)
+        else:
+            story_ids = Installment.objects \
+                .filter(published_on__year=year) \
+                .values_list('story_id', flat=True) \
+                .distinct()
+        story_ids = sorted(story_ids)
+
+        with transaction.atomic():
+            # also drops any orphans
+            if year is None:
+                years = set(WeeklyDigest.objects.order_by().values_list('year', flat=True).distinct())
+                WeeklyDigest.objects.all().delete()
+            else:
+                years = {year}
+                WeeklyDigest.objects.filter(year=year).delete()
+            bump_version(DIGEST.format('years'), *(DIGEST.format(y) for y in years))
+            for i in range(0, len(story_ids), batch_size):
+                WeeklyDigest.refresh(story_ids[i:i + batch_size], year=year)
+
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} for {:d} stories.'.format(
+            'all years' if year is None else year, len(story_ids))))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.models import Saga, SagaEntry, SagaStats, Story, StoryStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized StoryStats and SagaStats rollups from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of stories to refresh per query.',
+        )
+
+    def handle(self, *args, batch_size=500, **options):
+        story_ids = list(Story.objects.order_by('pk').values_list('pk', flat=True))
+        saga_ids = list(Saga.objects.order_by('pk').values_list('pk', flat=True))
+
+        with transaction.atomic():
+            # also drops any orphans
+            StoryStats.objects.all().delete()
+            for i in range(0, len(story_ids), batch_size):
+                StoryStats.refresh(story_ids[i:i + batch_size])
+
+            SagaStats.objects.all().delete()
+            SagaStats.refresh(saga_ids)
+            SagaEntry.relink(saga_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt stats for {:d} stories and {:d} sagas.'.format(len(story_ids), len(saga_ids))))
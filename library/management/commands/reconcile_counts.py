@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.models import CatalogCount
+
+
+class Command(BaseCommand):
+    help = 'Recount the CatalogCount rows from scratch and repair any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the counts that are off.',
+        )
+
+    def handle(self, *args, dry_run=False, **options):
+        drifted = 0
+        with transaction.atomic():
+            for kind, name in CatalogCount.KIND_CHOICES:
+                stored = CatalogCount.counts(kind)
+                actual = CatalogCount.tally(kind)
+                for key in sorted(stored.keys() | actual.keys()):
+                    if stored.get(key, 0) != actual.get(key, 0):
+                        drifted += 1
+                        self.stdout.write('{} {!r}: {:d} -> {:d}'.format(
+                            name, key, stored.get(key, 0), actual.get(key, 0)))
+                if not dry_run and stored != actual:
+                    CatalogCount.refresh(kind)
+
+        if dry_run:
+            self.stdout.write('{:d} counts are off.'.format(drifted))
+        else:
+            self.stdout.write(self.style.SUCCESS('Repaired {:d} counts.'.format(drifted)))
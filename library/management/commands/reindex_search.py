@@ -0,0 +1,48 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.models import Installment, Story
+from library.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of documents to index per query.',
+        )
+
+    def handle(self, *args, batch_size=500, **options):
+        backend = get_backend()
+        story_ids = Story.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        inst_ids = Installment.objects \
+            .filter(is_current=True) \
+            .exclude(file='') \
+            .order_by('pk') \
+            .values_list('pk', flat=True) \
+            .iterator()
+
+        stories = installments = 0
+        with transaction.atomic():
+            backend.clear()
+            while True:
+                batch = list(islice(story_ids, batch_size))
+                if not batch:
+                    break
+                backend.index_stories(batch)
+                stories += len(batch)
+            while True:
+                batch = list(islice(inst_ids, batch_size))
+                if not batch:
+                    break
+                backend.index_installments(batch)
+                installments += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed {:d} stories and {:d} installments.'.format(stories, installments)))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.models import ListEntry
+
+
+class Command(BaseCommand):
+    help = 'Space out the entries of hand-sorted lists that are running out of room between them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-gap',
+            type=int,
+            default=ListEntry.ORDINAL_GAP // 64,
+            help='Renumber lists with two entries closer than this (default: %(default)s).',
+        )
+
+    def handle(self, *args, min_gap=None, **options):
+        # one pass over the (list, ordinal) index
+        rows = ListEntry.objects \
+            .filter(list__auto_sort=False) \
+            .order_by('list_id', 'ordinal') \
+            .values_list('list_id', 'ordinal')
+        crowded = set()
+        last_list = last_ordinal = None
+        for list_id, ordinal in rows.iterator():
+            if list_id == last_list and ordinal - last_ordinal < min_gap:
+                crowded.add(list_id)
+            last_list, last_ordinal = list_id, ordinal
+
+        for list_id in crowded:
+            with transaction.atomic():
+                ListEntry.renumber(list_id)
+
+        self.stdout.write(self.style.SUCCESS('Renumbered {:d} lists.'.format(len(crowded))))
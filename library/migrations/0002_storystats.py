@@ -0,0 +1,77 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+from library.expressions import Concat, SQCount
+
+
+def populate_stats(apps, schema_editor):
+    # NOTE: mirrors StoryStats.refresh() against the historical models
+    Author = apps.get_model('library', 'Author')
+    Code = apps.get_model('library', 'Code')
+    Installment = apps.get_model('library', 'Installment')
+    Story = apps.get_model('library', 'Story')
+    StoryStats = apps.get_model('library', 'StoryStats')
+
+    current = Installment.objects \
+        .order_by() \
+        .filter(story=OuterRef('pk'), is_current=True)
+    valid = current.exclude(file='').values_list('ordinal', flat=True)
+
+    rows = Story.objects \
+        .order_by() \
+        .annotate(stats_authors=Subquery(Author.objects
+                                         .order_by()
+                                         .filter(stories__pk=OuterRef('pk'))
+                                         .annotate(names=Concat('name', separator='|'))
+                                         .values('names')),
+                  stats_codes=Subquery(Code.objects
+                                       .order_by()
+                                       .filter(stories__pk=OuterRef('pk'))
+                                       .annotate(abbrs=Concat('abbr'))
+                                       .values('abbrs')),
+                  stats_ic=SQCount(current.values('pk')),
+                  stats_mc=SQCount(current.filter(file='').values('pk')),
+                  stats_first=Subquery(valid.order_by('ordinal')[:1]),
+                  stats_last=Subquery(valid.order_by('-ordinal')[:1])) \
+        .values_list('pk', 'stats_authors', 'stats_codes', 'stats_ic',
+                     'stats_mc', 'stats_first', 'stats_last')
+
+    StoryStats.objects.bulk_create([
+        StoryStats(story_id=pk,
+                   author_names=authors or '',
+                   code_abbrs=codes or '',
+                   installment_count=ic,
+                   missing_count=mc,
+                   first_ordinal=first,
+                   last_ordinal=last)
+        for pk, authors, codes, ic, mc, first, last in rows.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryStats',
+            fields=[
+                ('story', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='library.story')),
+                ('installment_count', models.IntegerField(default=0)),
+                ('missing_count', models.IntegerField(default=0)),
+                ('first_ordinal', models.SmallIntegerField(blank=True, null=True)),
+                ('last_ordinal', models.SmallIntegerField(blank=True, null=True)),
+                ('author_names', models.TextField(blank=True)),
+                ('code_abbrs', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'story stats',
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:06
+
+from django.db import migrations, models
+
+from library.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # required by CREATE INDEX CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('library', '0002_storystats'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='installment',
+            index=models.Index(condition=models.Q(('is_current', True)), fields=['story', 'ordinal'], name='inst_current_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='installment',
+            index=models.Index(condition=models.Q(('is_current', True), models.Q(('file', ''), _negated=True)), fields=['story', 'ordinal'], name='inst_valid_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='installment',
+            index=models.Index(condition=models.Q(('file', ''), ('is_current', True)), fields=['story'], name='inst_missing_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='installment',
+            index=models.Index(fields=['story', 'published_on'], name='inst_story_pub_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='installment',
+            index=models.Index(fields=['published_on'], name='inst_published_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='story',
+            index=models.Index(fields=['sort_title', 'published_on'], name='story_sort_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='story',
+            index=models.Index(fields=['updated_on'], name='story_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='story',
+            index=models.Index(condition=models.Q(('removed_at__isnull', True)), fields=['id'], name='story_live_idx'),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:09
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+from library.expressions import Concat, SQCount
+
+
+def populate_navigation(apps, schema_editor):
+    # NOTE: mirrors SagaStats.refresh() and SagaEntry.relink() against the
+    #       historical models
+    Author = apps.get_model('library', 'Author')
+    Code = apps.get_model('library', 'Code')
+    Installment = apps.get_model('library', 'Installment')
+    Saga = apps.get_model('library', 'Saga')
+    SagaEntry = apps.get_model('library', 'SagaEntry')
+    SagaStats = apps.get_model('library', 'SagaStats')
+    Story = apps.get_model('library', 'Story')
+
+    in_saga = {'stories__sagaentry__saga': OuterRef('pk')}
+    rows = Saga.objects \
+        .order_by() \
+        .annotate(stats_authors=Subquery(Author.objects
+                                         .order_by()
+                                         .filter(**in_saga)
+                                         .annotate(names=Concat('name', separator='|'))
+                                         .values('names')),
+                  stats_codes=Subquery(Code.objects
+                                       .order_by()
+                                       .filter(**in_saga)
+                                       .annotate(abbrs=Concat('abbr', distinct=True))
+                                       .values('abbrs')),
+                  stats_updated=Subquery(Installment.objects
+                                         .order_by('-published_on')
+                                         .filter(story__sagaentry__saga=OuterRef('pk'),
+                                                 is_current=True)
+                                         .values('published_on')[:1]),
+                  stats_ec=SQCount(Story.objects
+                                   .order_by()
+                                   .filter(sagaentry__saga=OuterRef('pk')))) \
+        .values_list('pk', 'stats_authors', 'stats_codes', 'stats_updated', 'stats_ec')
+
+    SagaStats.objects.bulk_create([
+        SagaStats(saga_id=pk,
+                  author_names=authors or '',
+                  code_abbrs=codes or '',
+                  updated_on=updated_on,
+                  entry_count=ec)
+        for pk, authors, codes, updated_on, ec in rows.iterator()
+    ], batch_size=500)
+
+    entries = list(SagaEntry.objects.order_by('saga_id', 'order', 'pk'))
+    for i, entry in enumerate(entries):
+        prev_entry = entries[i-1] if i > 0 else None
+        next_entry = entries[i+1] if i+1 < len(entries) else None
+        if prev_entry and prev_entry.saga_id == entry.saga_id:
+            entry.prev_story_id = prev_entry.story_id
+        if next_entry and next_entry.saga_id == entry.saga_id:
+            entry.next_story_id = next_entry.story_id
+    SagaEntry.objects.bulk_update(entries, ['prev_story', 'next_story'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='saga',
+            name='stories',
+            field=models.ManyToManyField(related_name='sagas', through='library.SagaEntry', through_fields=('saga', 'story'), to='library.Story'),
+        ),
+        migrations.CreateModel(
+            name='SagaStats',
+            fields=[
+                ('saga', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='library.saga')),
+                ('entry_count', models.IntegerField(default=0)),
+                ('updated_on', models.DateField(blank=True, null=True)),
+                ('author_names', models.TextField(blank=True)),
+                ('code_abbrs', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'saga stats',
+            },
+        ),
+        migrations.AddField(
+            model_name='sagaentry',
+            name='next_story',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='library.story'),
+        ),
+        migrations.AddField(
+            model_name='sagaentry',
+            name='prev_story',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='library.story'),
+        ),
+        migrations.RunPython(populate_navigation, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:11
+
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_activity(apps, schema_editor):
+    # NOTE: mirrors ActivityEvent.replay() against the historical models
+    ActivityEvent = apps.get_model('library', 'ActivityEvent')
+    Installment = apps.get_model('library', 'Installment')
+
+    rows = Installment.objects \
+        .order_by('story_id', 'published_on', 'ordinal') \
+        .values_list('pk', 'story_id', 'ordinal', 'published_on')
+
+    events = []
+    for story_id, story_rows in groupby(rows.iterator(), itemgetter(1)):
+        seen = set()
+        for date, date_rows in groupby(story_rows, itemgetter(3)):
+            date_rows = list(date_rows)
+            for pk, _, ordinal, _ in date_rows:
+                kind = 's' if not seen else 'r' if ordinal in seen else 'c'
+                events.append(ActivityEvent(installment_id=pk,
+                                            story_id=story_id,
+                                            ordinal=ordinal,
+                                            kind=kind,
+                                            date=date))
+            seen.update(row[2] for row in date_rows)
+    ActivityEvent.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_saga_navigation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordinal', models.SmallIntegerField()),
+                ('kind', models.CharField(choices=[('s', 'new story'), ('c', 'new chapter'), ('r', 'revision')], max_length=1)),
+                ('date', models.DateField()),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+                ('installment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='library.installment')),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='library.story')),
+            ],
+            options={
+                'ordering': ['-date', 'story', 'ordinal'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activityevent',
+            index=models.Index(fields=['date', 'story'], name='activity_date_idx'),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
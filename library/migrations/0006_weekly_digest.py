@@ -0,0 +1,68 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:12
+
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_digest(apps, schema_editor):
+    # NOTE: mirrors WeeklyDigest.compute() against the historical models
+    Installment = apps.get_model('library', 'Installment')
+    WeeklyDigest = apps.get_model('library', 'WeeklyDigest')
+
+    rows = Installment.objects \
+        .order_by('story_id', 'published_on', 'ordinal') \
+        .values_list('story_id', 'ordinal', 'published_on')
+
+    digests = []
+    for story_id, story_rows in groupby(rows.iterator(), itemgetter(0)):
+        seen = set()
+        first_week = None
+        weeks = {}
+        for _, ordinal, published_on in story_rows:
+            week = (published_on.year, published_on.isocalendar()[1])
+            first_week = first_week or week
+            if ordinal in seen:
+                continue
+            seen.add(ordinal)
+            digest = weeks.get(week)
+            if not digest:
+                digest = weeks[week] = WeeklyDigest(year=week[0],
+                                                    week=week[1],
+                                                    story_id=story_id,
+                                                    is_update=week != first_week,
+                                                    up_count=0,
+                                                    published_on=published_on)
+            digest.up_count += 1
+            digest.published_on = published_on
+        digests.extend(weeks.values())
+    WeeklyDigest.objects.bulk_create(digests, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_activity_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyDigest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.SmallIntegerField()),
+                ('week', models.SmallIntegerField()),
+                ('is_update', models.BooleanField(default=False)),
+                ('up_count', models.IntegerField(default=0)),
+                ('published_on', models.DateField()),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.story')),
+            ],
+            options={
+                'ordering': ['-year', '-week'],
+                'unique_together': {('year', 'week', 'story')},
+            },
+        ),
+        migrations.RunPython(populate_digest, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:15
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef
+
+
+def populate_counts(apps, schema_editor):
+    # NOTE: mirrors CatalogCount.tally() against the historical models
+    CatalogCount = apps.get_model('library', 'CatalogCount')
+    Installment = apps.get_model('library', 'Installment')
+    Story = apps.get_model('library', 'Story')
+
+    valid_insts = Installment.objects \
+        .order_by() \
+        .filter(story_id=OuterRef('pk'), is_current=True) \
+        .exclude(file='') \
+        .values('pk')
+    total = Story.objects \
+        .filter(Exists(valid_insts), removed_at__isnull=True) \
+        .count()
+    counts = [CatalogCount(kind='t', key='', count=total)]
+
+    titles = Story.objects.values_list('sort_title', flat=True)
+    letters = Counter(t[:1].upper() for t in titles.iterator())
+    counts.extend(CatalogCount(kind='l', key=k, count=n) for k, n in letters.items())
+
+    for kind, qs, field in (('a', Story.authors.through.objects, 'author_id'),
+                            ('c', Story.codes.through.objects, 'code_id'),
+                            ('s', Story.objects, 'slant_id')):
+        rows = qs.order_by().values(field).annotate(n=Count('pk')).values_list(field, 'n')
+        counts.extend(CatalogCount(kind=kind, key=str(k), count=n) for k, n in rows)
+
+    CatalogCount.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_weekly_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('t', 'total'), ('l', 'letter'), ('a', 'author'), ('c', 'code'), ('s', 'slant')], max_length=1)),
+                ('key', models.CharField(blank=True, max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('kind', 'key')},
+            },
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:16
+
+from django.db import migrations, models
+from django.db.models.functions import Substr, Upper
+
+from library.operations import AddIndexConcurrently
+
+
+def populate_sort_letter(apps, schema_editor):
+    # NOTE: get_sort_name() leaves only [a-z] up front, so SQL upper() is
+    #  as good as get_sort_letter() here
+    Story = apps.get_model('library', 'Story')
+    Story.objects.update(sort_letter=Upper(Substr('sort_title', 1, 1)))
+
+
+class Migration(migrations.Migration):
+
+    # required by CREATE INDEX CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('library', '0007_catalog_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='sort_letter',
+            field=models.CharField(blank=True, editable=False, max_length=1),
+        ),
+        migrations.RunPython(populate_sort_letter, migrations.RunPython.noop, atomic=True),
+        AddIndexConcurrently(
+            model_name='story',
+            index=models.Index(fields=['sort_letter', 'sort_title', 'published_on', 'id'], name='story_letter_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:19
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def populate_structured(apps, schema_editor):
+    # NOTE: same result as StoryStats/SagaStats.refresh(), sorted in Python
+    Story = apps.get_model('library', 'Story')
+    SagaEntry = apps.get_model('library', 'SagaEntry')
+    StoryStats = apps.get_model('library', 'StoryStats')
+    SagaStats = apps.get_model('library', 'SagaStats')
+
+    story_authors = defaultdict(dict)
+    for story_id, name, slug in Story.authors.through.objects \
+            .values_list('story_id', 'author__name', 'author__slug').iterator():
+        story_authors[story_id][slug] = {'name': name, 'slug': slug}
+    story_codes = defaultdict(set)
+    for story_id, abbr in Story.codes.through.objects.values_list('story_id', 'code_id').iterator():
+        story_codes[story_id].add(abbr)
+
+    saga_authors = defaultdict(dict)
+    saga_codes = defaultdict(set)
+    for saga_id, story_id in SagaEntry.objects.values_list('saga_id', 'story_id').iterator():
+        saga_authors[saga_id].update(story_authors[story_id])
+        saga_codes[saga_id].update(story_codes[story_id])
+
+    def by_name(authors):
+        return sorted(authors.values(), key=lambda a: a['name'].lower())
+
+    stats = list(StoryStats.objects.all())
+    for s in stats:
+        s.authors = by_name(story_authors[s.story_id])
+        s.codes = sorted(story_codes[s.story_id], key=str.lower)
+    StoryStats.objects.bulk_update(stats, ['authors', 'codes'], batch_size=500)
+
+    stats = list(SagaStats.objects.all())
+    for s in stats:
+        s.authors = by_name(saga_authors[s.saga_id])
+        s.codes = sorted(saga_codes[s.saga_id], key=str.lower)
+    SagaStats.objects.bulk_update(stats, ['authors', 'codes'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_sort_letter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='sagastats',
+            name='author_names',
+        ),
+        migrations.RemoveField(
+            model_name='sagastats',
+            name='code_abbrs',
+        ),
+        migrations.RemoveField(
+            model_name='storystats',
+            name='author_names',
+        ),
+        migrations.RemoveField(
+            model_name='storystats',
+            name='code_abbrs',
+        ),
+        migrations.AddField(
+            model_name='sagastats',
+            name='authors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='sagastats',
+            name='codes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='storystats',
+            name='authors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='storystats',
+            name='codes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(populate_structured, migrations.RunPython.noop),
+    ]
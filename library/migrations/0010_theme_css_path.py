@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_structured_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='theme',
+            name='css_path',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# NOTE: existing installments are moved onto blobs by `manage.py fold_blobs`,
+#       which reads every file; that is too slow for a deploy
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_theme_css_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=78, upload_to='')),
+                ('size', models.PositiveIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='installment',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='installments', to='library.blob'),
+        ),
+    ]
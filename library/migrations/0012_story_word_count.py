@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:33
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_word_count(apps, schema_editor):
+    # NOTE: mirrors StoryStats._word_count_sq() against the historical models
+    Installment = apps.get_model('library', 'Installment')
+    StoryStats = apps.get_model('library', 'StoryStats')
+
+    totals = Installment.objects \
+        .order_by() \
+        .filter(is_current=True, length_unit='w', length__gt=0) \
+        .values('story_id') \
+        .annotate(n=Sum('length')) \
+        .values_list('story_id', 'n')
+    for story_id, n in totals.iterator():
+        StoryStats.objects.filter(story_id=story_id).update(word_count=n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storystats',
+            name='word_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_word_count, migrations.RunPython.noop),
+    ]
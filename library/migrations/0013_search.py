@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# NOTE: see library.search for how these are used
+
+SQLITE_CREATE = [
+    """CREATE VIRTUAL TABLE library_search USING fts5(
+        heading, summary, body, story_id UNINDEXED,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )""",
+]
+
+POSTGRES_CREATE = [
+    """CREATE TABLE library_search (
+        id bigint PRIMARY KEY,
+        story_id integer NOT NULL,
+        content text NOT NULL,
+        vector tsvector NOT NULL
+    )""",
+    'CREATE INDEX library_search_vector_idx ON library_search USING gin (vector)',
+    'CREATE INDEX library_search_story_idx ON library_search (story_id)',
+]
+
+
+def create_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = POSTGRES_CREATE if vendor == 'postgresql' else SQLITE_CREATE
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search(apps, schema_editor):
+    schema_editor.execute('DROP TABLE library_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_story_word_count'),
+    ]
+
+    operations = [
+        # filled by `manage.py reindex_search`
+        migrations.RunPython(create_search, drop_search),
+    ]
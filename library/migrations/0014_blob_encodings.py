@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encodings',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_blob_encodings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listentry',
+            index=models.Index(fields=['content_type', 'object_id'], name='library_lis_content_25a3d9_idx'),
+        ),
+    ]
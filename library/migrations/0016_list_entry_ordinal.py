@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+def number_entries(apps, schema_editor):
+    # NOTE: mirrors ListEntry.renumber() against the historical models,
+    # keeping every list in the order its entries were added
+    ListEntry = apps.get_model('library', 'ListEntry')
+
+    entries = list(ListEntry.objects.order_by('list_id', 'created_at', 'pk').only('list_id'))
+    n, list_id = 0, None
+    for entry in entries:
+        n = n + 1 if entry.list_id == list_id else 1
+        list_id = entry.list_id
+        entry.ordinal = n * 1024
+    ListEntry.objects.bulk_update(entries, ['ordinal'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_list_entry_story_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listentry',
+            name='ordinal',
+            field=models.IntegerField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_entries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listentry',
+            index=models.Index(fields=['list', 'ordinal'], name='library_lis_list_id_d64748_idx'),
+        ),
+    ]
@@ -1,19 +1,35 @@
+import gzip
+import hashlib
 from io import BytesIO
+from itertools import groupby
+from operator import itemgetter
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models, IntegrityError
-from django.db.models import Min, Max, OuterRef, Subquery
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Count, Exists, FilteredRelation, Min, Max, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.functional import cached_property
 
-from library.expressions import Concat, SQCount
+from library.cache import DIGEST, READER, bump_version, get_version
+from library.expressions import JSONArray, SQCount
 from library.fields import CssField, ShortUUIDField
 from library.managers import OrderedLowerManager
-from library.mixins import AuthorsMixin, CodesMixin, DEFAULT_AUTHOR_SEP
-from library.util import get_sort_name, get_author_slug, b64md5sum, inst_path, is_css_color
+from library.mixins import AuthorsMixin, CodesMixin
+from library.util import get_sort_name, get_sort_letter, get_author_slug, b64md5sum, blob_path, count_text, \
+    is_css_color, minify_css
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 # TODO: Come up with a more specific name for this functionality. Or don't.
@@ -39,6 +55,9 @@ class List(models.Model):
         default=True,
     )
 
+    MEMBERSHIPS_KEY = 'storkive:lists:{}:{}'
+    MEMBERSHIPS_TIMEOUT = 24 * 60 * 60
+
     @property
     def entry_count(self):
         if not hasattr(self, '_ec'):
@@ -56,6 +75,33 @@ class List(models.Model):
         ordering = ['-priority', 'name']
         unique_together = ['user', 'name']
 
+    @classmethod
+    def memberships(cls, user):
+        """Return `(lists, story_lists)`: the user's lists, in order, and the
+        ones each story is on, by story id. Kept in the cache as ids until
+        the user's stamp is bumped; see library.signals._bump_readers."""
+        version = get_version(READER.format(user.pk))
+        key = cls.MEMBERSHIPS_KEY.format(user.pk, version)
+        entry = cache.get(key)
+        if entry is None:
+            lists = list(cls.objects.filter(user=user))
+            order = {lst.pk: n for n, lst in enumerate(lists)}
+            story_list_ids = {}
+            rows = ListEntry.objects \
+                .filter(list__user=user, content_type=ContentType.objects.get_for_model(Story)) \
+                .values_list('object_id', 'list_id')
+            for story_id, list_id in rows:
+                story_list_ids.setdefault(story_id, []).append(list_id)
+            for list_ids in story_list_ids.values():
+                list_ids.sort(key=order.get)
+            entry = (lists, story_list_ids)
+            cache.set(key, entry, cls.MEMBERSHIPS_TIMEOUT)
+
+        lists, story_list_ids = entry
+        by_pk = {lst.pk: lst for lst in lists}
+        return lists, {story_id: [by_pk[pk] for pk in list_ids]
+                       for story_id, list_ids in story_list_ids.items()}
+
     def clean_fields(self, exclude=None):
         super().clean_fields(exclude)
         if 'color' not in exclude:
@@ -72,13 +118,102 @@ class ListEntry(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
-    # ordinal = models.SmallIntegerField()
+    # spaced ORDINAL_GAP apart, so that moving an entry only rewrites its
+    # own; used by lists that aren't auto_sort. See place()
+    ordinal = models.IntegerField(
+        blank=True,
+    )
     created_at = models.DateTimeField(
         auto_now_add=True
     )
 
+    ORDINAL_GAP = 1024
+
+    def save(self, *args, **kwargs):
+        if self.ordinal is None:
+            self.ordinal = self._tails([self.list_id]).get(self.list_id, 0) + self.ORDINAL_GAP
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def _tails(cls, list_ids):
+        return dict(cls.objects
+                    .filter(list_id__in=list_ids)
+                    .order_by()
+                    .values('list_id')
+                    .annotate(tail=Max('ordinal'))
+                    .values_list('list_id', 'tail'))
+
+    # NOTE: add() and place() skip the signals, for speed, and bump the reader
+    # themselves; remove() deletes normally, so list_entry_changed bumps it
+
+    @classmethod
+    def add(cls, user, list_ids, story_ids):
+        """Put the stories at the end of the given lists of `user`, unless
+        they're on them already."""
+        content_type = ContentType.objects.get_for_model(Story)
+        tails = cls._tails(list_ids)
+        cls.objects.bulk_create([cls(list_id=list_id, content_type=content_type, object_id=story_id,
+                                     ordinal=tails.get(list_id, 0) + n * cls.ORDINAL_GAP)
+                                 for list_id in list_ids
+                                 for n, story_id in enumerate(story_ids, 1)],
+                                ignore_conflicts=True)
+        bump_version(READER.format(user.pk))
+
+    @classmethod
+    def place(cls, user, list_id, story_id, after_id=None):
+        """Move a story on a list of `user` to just after another one, or
+        to the top. Only its own entry changes, unless there's no room left
+        between its new neighbours; then the list is renumbered first.
+        Return whether both stories were found on the list."""
+        entries = cls.objects.filter(list_id=list_id, content_type=ContentType.objects.get_for_model(Story))
+        others = entries.exclude(object_id=story_id).order_by('ordinal').values_list('ordinal', flat=True)
+        if after_id is None:
+            low = None
+            high = others.first()
+        else:
+            low = entries.filter(object_id=after_id).values_list('ordinal', flat=True).first()
+            if low is None:
+                return False
+            high = others.filter(ordinal__gt=low).first()
+
+        if high is None:
+            ordinal = (low or 0) + cls.ORDINAL_GAP
+        elif low is None:
+            ordinal = high - cls.ORDINAL_GAP
+        elif high - low > 1:
+            ordinal = (low + high) // 2
+        else:
+            cls.renumber(list_id)
+            return cls.place(user, list_id, story_id, after_id)
+
+        if not entries.filter(object_id=story_id).update(ordinal=ordinal):
+            return False
+        bump_version(READER.format(user.pk))
+        return True
+
+    @classmethod
+    def renumber(cls, list_id):
+        """Space the entries of a list ORDINAL_GAP apart again, in order."""
+        entries = list(cls.objects.filter(list_id=list_id).order_by('ordinal', 'pk').only('pk'))
+        for n, entry in enumerate(entries, 1):
+            entry.ordinal = n * cls.ORDINAL_GAP
+        cls.objects.bulk_update(entries, ['ordinal'], batch_size=500)
+
+    @classmethod
+    def remove(cls, user, list_ids, story_ids):
+        """Take the stories off the given lists of `user`."""
+        cls.objects.filter(list_id__in=list_ids,
+                           content_type=ContentType.objects.get_for_model(Story),
+                           object_id__in=story_ids).delete()
+
     class Meta:
         unique_together = ('list', 'content_type', 'object_id')
+        indexes = [
+            # from the story side; see Story.list_entries
+            models.Index(fields=['content_type', 'object_id']),
+            # a list in order, as one range
+            models.Index(fields=['list', 'ordinal']),
+        ]
         verbose_name_plural = 'entries'
 
 
@@ -195,11 +330,15 @@ class Slant(models.Model):
 
 class StoryDisplayManager(models.Manager):
     def get_queryset(self):
+        # see: StoryStats
         return super().get_queryset() \
-            .annotate(author_dicts=Story.authors_sq(),
-                      code_abbrs=Story.codes_sq(),
-                      installment_count=Story.installment_count_sq(),
-                      missing_count=Story.missing_count_sq())
+            .annotate(author_dicts=F('stats__authors'),
+                      code_abbrs=F('stats__codes'),
+                      installment_count=Coalesce('stats__installment_count', 0),
+                      missing_count=Coalesce('stats__missing_count', 0),
+                      first_ordinal=F('stats__first_ordinal'),
+                      last_ordinal=F('stats__last_ordinal'),
+                      word_count=Coalesce('stats__word_count', 0))
 
 
 class Story(models.Model, AuthorsMixin, CodesMixin):
@@ -219,6 +358,11 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
     sort_title = models.CharField(
         max_length=TITLE_LEN,
     )
+    sort_letter = models.CharField(
+        max_length=1,
+        blank=True,
+        editable=False,
+    )
     slug = models.SlugField(
         max_length=SLUG_LEN,
         unique=True,
@@ -257,14 +401,6 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
     )
     list_entries = GenericRelation(ListEntry, related_query_name='story')
 
-    def user_lists(self, user):
-        entries = self.list_entries \
-            .select_related('list') \
-            .filter(list__user=user) \
-            .order_by('-list__priority', 'list__name') \
-            .all()
-        return [entry.list for entry in entries]
-
     @property
     def author_list(self):
         return self.authors.all()
@@ -280,7 +416,7 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
     @property
     def installment_count(self):
         if not hasattr(self, '_ic'):
-            self._ic = self.current_installments.count()
+            self._ic = self.installments.filter(is_current=True).count()
         return self._ic
 
     @installment_count.setter
@@ -297,39 +433,26 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
 
     @cached_property
     def valid_installment_count(self):
-        return self.current_installments.exclude(file='').count()
+        return self.installments.filter(is_current=True).exclude(file='').count()
 
     @cached_property
     def current_installments(self):
-        # return [inst for inst in self.installments.all() if inst.is_current]
-        return self.installments.filter(is_current=True).order_by('ordinal')
-
-    # @cached_property
-    # def installment_dates(self):
-    #     return self.installments.values('ordinal').annotate(
-    #         date_published=Min('published_on'),
-    #         date_updated=Max('published_on'),
-    #     )
-
-    @cached_property
-    def installment_dates(self):
+        """The table of contents, in one query. The window functions have to
+        see every version of an ordinal, so the filtering happens here."""
+        by_ordinal = [F('ordinal')]
         qs = self.installments \
-            .values('ordinal') \
-            .order_by('ordinal') \
-            .annotate(date_published=Min('published_on'),
-                      date_updated=Max('published_on'))
-        return {
-            d['ordinal']: {
-                'date_published': d['date_published'],
-                'date_updated': d['date_updated'],
-            }
-            for d in qs
-        }
+            .order_by('ordinal', 'published_on') \
+            .annotate(first_published=Window(Min('published_on'), partition_by=by_ordinal),
+                      last_published=Window(Max('published_on'), partition_by=by_ordinal),
+                      version_count=Window(Count('pk'), partition_by=by_ordinal),
+                      author_dicts=Installment.authors_sq())
+        return [inst for inst in qs if inst.is_current]
 
     @cached_property
     def first_ordinal(self):
         try:
-            return self.current_installments \
+            return self.installments \
+                .filter(is_current=True) \
                 .exclude(file='') \
                 .order_by('ordinal') \
                 .values_list('ordinal', flat=True)[0]
@@ -339,7 +462,8 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
     @cached_property
     def last_ordinal(self):
         try:
-            return self.current_installments \
+            return self.installments \
+                .filter(is_current=True) \
                 .exclude(file='') \
                 .order_by('-ordinal') \
                 .values_list('ordinal', flat=True)[0]
@@ -355,24 +479,38 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
     class Meta:
         ordering = ['sort_title', 'published_on']
         verbose_name_plural = 'stories'
+        indexes = [
+            models.Index(
+                fields=['sort_title', 'published_on'],
+                name='story_sort_idx',
+            ),
+            models.Index(
+                fields=['updated_on'],
+                name='story_updated_idx',
+            ),
+            # see: library.pagination
+            models.Index(
+                fields=['sort_letter', 'sort_title', 'published_on', 'id'],
+                name='story_letter_idx',
+            ),
+            models.Index(
+                fields=['id'],
+                name='story_live_idx',
+                condition=Q(removed_at__isnull=True),
+            ),
+        ]
 
     @staticmethod
-    def authors_sq(separator=DEFAULT_AUTHOR_SEP):
-        return Subquery(Author.objects
-                        .order_by()
-                        .filter(stories__pk=OuterRef('pk'))
-                        .annotate(names=Concat('name', separator=separator))
-                        .values('names')
-                        )
+    def authors_sq():
+        return JSONArray(Author.objects
+                         .filter(stories__pk=OuterRef('pk')),
+                         ('name', 'slug'))
 
     @staticmethod
     def codes_sq():
-        return Subquery(Code.objects
-                        .order_by()
-                        .filter(stories__pk=OuterRef('pk'))
-                        .annotate(abbrs=Concat('abbr'))
-                        .values('abbrs')
-                        )
+        return JSONArray(Code.objects
+                         .filter(stories__pk=OuterRef('pk')),
+                         ('abbr',))
 
     @staticmethod
     def installment_count_sq():
@@ -398,13 +536,111 @@ class Story(models.Model, AuthorsMixin, CodesMixin):
     def save(self, *args, **kwargs):
         if not self.sort_title:
             self.sort_title = get_sort_name(self.title)[:self.TITLE_LEN]
+        self.sort_letter = get_sort_letter(self.sort_title)
         self.full_clean()
         if not self.updated_on:
             self.updated_on = self.published_on
         super().save(*args, **kwargs)
 
 
-class Installment(models.Model):
+class Blob(models.Model):
+    """Installment content, stored once per distinct sha256 digest no matter
+    how many installments share it. `ref_count` is kept up to date by the
+    handlers in `library.signals`; unreferenced blobs are removed by
+    `manage.py prune_blobs`.
+    """
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+    )
+    file = models.FileField(
+        # see: library.util.blob_path
+        max_length=6 + 3 + 64 + 5,
+    )
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(
+        default=0,
+    )
+    # content codings of the variants stored next to the file, best first
+    encodings = models.CharField(
+        max_length=20,
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    # file name suffix, by content coding
+    VARIANTS = {
+        'br': '.br',
+        'gzip': '.gz',
+    }
+    # what compress() makes here
+    CODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+    def __str__(self):
+        return self.digest
+
+    @property
+    def encoding_list(self):
+        return self.encodings.split(',') if self.encodings else []
+
+    @staticmethod
+    def compress(content):
+        """Yield `(coding, bytes)` for every variant of `content` that can be
+        made here, best first."""
+        if brotli:
+            yield 'br', brotli.compress(content, mode=brotli.MODE_TEXT)
+        yield 'gzip', gzip.compress(content, mtime=0)
+
+    @classmethod
+    def store_variants(cls, name, content):
+        """Write the compressed variants of `content` next to the file
+        `name`, and return their codings as a value for `encodings`."""
+        codings = []
+        for coding, data in cls.compress(content):
+            path = name + cls.VARIANTS[coding]
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(data))
+            codings.append(coding)
+        return ','.join(codings)
+
+    @classmethod
+    def store(cls, content):
+        """Return the blob holding `content` (bytes), writing it and its
+        variants to storage only if no blob has it yet."""
+        digest = hashlib.sha256(content).hexdigest()
+        blob = cls.objects.filter(digest=digest).first()
+        if blob:
+            return blob
+        name = blob_path(digest)
+        if not default_storage.exists(name):
+            # an unlucky race writes the same bytes twice, nothing worse
+            name = default_storage.save(name, ContentFile(content))
+        blob, _ = cls.objects.get_or_create(digest=digest, defaults={
+            'file': name,
+            'size': len(content),
+            'encodings': cls.store_variants(name, content),
+        })
+        return blob
+
+    @classmethod
+    def recount(cls, blob_ids):
+        """Recount references to the given blobs. Meant to be called from
+        within the transaction that changed them."""
+        blob_ids = {pk for pk in blob_ids if pk is not None}
+        if not blob_ids:
+            return
+        refs = Installment.objects \
+            .order_by() \
+            .filter(blob_id=OuterRef('pk')) \
+            .values('pk')
+        cls.objects \
+            .filter(pk__in=blob_ids) \
+            .update(ref_count=SQCount(refs))
+
+
+class Installment(models.Model, AuthorsMixin):
     TITLE_LEN = 125
 
     LU_WORDS = 'w'
@@ -451,15 +687,28 @@ class Installment(models.Model):
         default=LU_WORDS,
     )
     file = models.FileField(
-        # see: library.util.story_path
+        # sized for the files from before blobs, stories/L/slug/slug.001.date.html:
         # PREFIX + LETTER + 2xSLUG + ordinal + date + ext
+        # NOTE: since blobs, the same as blob.file; see `manage.py fold_blobs`
         max_length=15 + 2 + 2*(Story.SLUG_LEN+1) + 4 + 11 + 5
     )
+    blob = models.ForeignKey(
+        'Blob',
+        related_name='installments',
+        blank=True,
+        null=True,
+        on_delete=models.PROTECT,
+    )
     checksum = models.CharField(
         max_length=64,
         blank=True,
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the unit `length` was counted in; None when deferred
+        self._counted_unit = self.__dict__.get('length_unit')
+
     @property
     def file_as_html(self):
         if self.file:
@@ -477,13 +726,16 @@ class Installment(models.Model):
         if not value:
             return
 
-        buf = BytesIO(value.encode('utf-8'))
-        checksum = b64md5sum(buf)
+        content = value.encode('utf-8')
+        checksum = b64md5sum(BytesIO(content))
         if checksum != self.checksum:
-            buf.seek(0)
-            file_path = inst_path(self.story.slug, self.ordinal, self.published_on)
-            self.file.save(file_path, buf)
+            self.blob = Blob.store(content)
+            self.file = self.blob.file.name
             self.checksum = checksum
+        elif self.length_unit == self._counted_unit:
+            return
+        self.length = count_text([value], self.length_unit)
+        self._counted_unit = self.length_unit
 
     @cached_property
     def versions(self):
@@ -499,23 +751,20 @@ class Installment(models.Model):
     def exists(self):
         return True if self.file else False
 
+    # NOTE: date_published, date_updated and has_revision expect the
+    #       annotations from Story.current_installments
+
     @property
     def date_published(self):
-        dates = self.story.installment_dates[self.ordinal]
-        return dates['date_published'] if dates['date_published'].year > 1 else None
-
-        # return self.versions[0].published_on
+        return self.first_published if self.first_published.year > 1 else None
 
     @property
     def date_updated(self):
-        dates = self.story.installment_dates[self.ordinal]
-        published_on = dates['date_published']
-        updated_on = dates['date_updated']
-        return updated_on if updated_on != published_on else None
+        return self.last_published if self.last_published != self.first_published else None
 
-        # published_on = self.date_published_on
-        # updated_on = self.versions[-1].published_on
-        # return updated_on if updated_on != published_on else None
+    @property
+    def has_revision(self):
+        return self.version_count > 1
 
     @property
     def story_str(self):
@@ -526,6 +775,37 @@ class Installment(models.Model):
 
     class Meta:
         unique_together = ('story', 'ordinal', 'published_on')
+        indexes = [
+            models.Index(
+                fields=['story', 'ordinal'],
+                name='inst_current_idx',
+                condition=Q(is_current=True),
+            ),
+            models.Index(
+                fields=['story', 'ordinal'],
+                name='inst_valid_idx',
+                condition=Q(is_current=True) & ~Q(file=''),
+            ),
+            models.Index(
+                fields=['story'],
+                name='inst_missing_idx',
+                condition=Q(is_current=True, file=''),
+            ),
+            models.Index(
+                fields=['story', 'published_on'],
+                name='inst_story_pub_idx',
+            ),
+            models.Index(
+                fields=['published_on'],
+                name='inst_published_idx',
+            ),
+        ]
+
+    @staticmethod
+    def authors_sq():
+        return JSONArray(Author.objects
+                         .filter(installment__pk=OuterRef('pk')),
+                         ('name', 'slug'))
 
     @staticmethod
     def _ord_seeker(forward=True):
@@ -552,16 +832,497 @@ class Installment(models.Model):
 
     def save(self, *args, **kwargs):
         # TODO: fixup is_current
+        if self.file and self._counted_unit and self.length_unit != self._counted_unit:
+            with self.file.open(mode='rb') as f:
+                self.length = count_text(f.chunks(), self.length_unit)
+            self._counted_unit = self.length_unit
         super().save(*args, **kwargs)
 
 
+class ActivityEvent(models.Model):
+    """Every installment as a dated event, for What's New: a new story, a
+    new chapter or a revision, by what was published before it. Kept up to
+    date by the handlers in `library.signals`, which replay a story from
+    the earliest date that changed: a new installment appends its event,
+    backdating one reclassifies the later ones, and the events before it
+    are left alone. Rebuild with `manage.py backfill_activity`.
+    """
+    KIND_STORY = 's'
+    KIND_CHAPTER = 'c'
+    KIND_REVISION = 'r'
+    KIND_CHOICES = (
+        (KIND_STORY, 'new story'),
+        (KIND_CHAPTER, 'new chapter'),
+        (KIND_REVISION, 'revision'),
+    )
+
+    installment = models.OneToOneField(
+        'Installment',
+        related_name='activity',
+        on_delete=models.CASCADE,
+    )
+    story = models.ForeignKey(
+        'Story',
+        related_name='activity',
+        on_delete=models.CASCADE,
+    )
+    ordinal = models.SmallIntegerField()
+    kind = models.CharField(
+        max_length=1,
+        choices=KIND_CHOICES,
+    )
+    date = models.DateField()
+    # when the event first appeared; reclassifying it keeps this
+    recorded_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    def __str__(self):
+        return '{:%Y-%m-%d} {} [{:03d}] {}'.format(
+            self.date, self.story_id, self.ordinal, self.get_kind_display())
+
+    class Meta:
+        ordering = ['-date', 'story', 'ordinal']
+        indexes = [
+            models.Index(
+                fields=['date', 'story'],
+                name='activity_date_idx',
+            ),
+        ]
+
+    @classmethod
+    def replay(cls, rows, seen=None):
+        """Classify `(pk, story_id, ordinal, published_on)` rows, which must
+        be sorted by story, then date. For replaying only the later part of
+        a story, `seen` maps its id to the ordinals published before."""
+        seen = seen or {}
+        for story_id, story_rows in groupby(rows, itemgetter(1)):
+            story_seen = set(seen.get(story_id, ()))
+            for date, date_rows in groupby(story_rows, itemgetter(3)):
+                date_rows = list(date_rows)
+                for pk, _, ordinal, _ in date_rows:
+                    if not story_seen:
+                        kind = cls.KIND_STORY
+                    elif ordinal in story_seen:
+                        kind = cls.KIND_REVISION
+                    else:
+                        kind = cls.KIND_CHAPTER
+                    yield cls(installment_id=pk,
+                              story_id=story_id,
+                              ordinal=ordinal,
+                              kind=kind,
+                              date=date)
+                story_seen.update(row[2] for row in date_rows)
+
+    @classmethod
+    def refresh(cls, since):
+        """Replay the events of the stories in `since`, a `{story_id: date}`
+        map, from that date on; nothing published before it can change. A
+        moved installment needs the earlier of its old and new dates. Only
+        the events that differ are written. Meant to be called from within
+        the transaction that changed them."""
+        if not since:
+            return
+
+        earlier = later = logged = Q()
+        for story_id, date in since.items():
+            earlier |= Q(story_id=story_id, published_on__lt=date)
+            later |= Q(story_id=story_id, published_on__gte=date)
+            logged |= Q(story_id=story_id, date__gte=date)
+        seen = {}
+        for story_id, ordinal in Installment.objects \
+                .filter(earlier) \
+                .order_by() \
+                .values_list('story_id', 'ordinal') \
+                .distinct():
+            seen.setdefault(story_id, set()).add(ordinal)
+        rows = Installment.objects \
+            .filter(later) \
+            .order_by('story_id', 'published_on', 'ordinal') \
+            .values_list('pk', 'story_id', 'ordinal', 'published_on')
+        events = {e.installment_id: e for e in cls.replay(rows.iterator(), seen)}
+
+        changed = []
+        stale = []
+        for event in cls.objects.filter(logged).only('installment_id', 'ordinal', 'kind', 'date'):
+            new = events.pop(event.installment_id, None)
+            if new is None:
+                stale.append(event.pk)
+            elif (event.ordinal, event.kind, event.date) != (new.ordinal, new.kind, new.date):
+                event.ordinal, event.kind, event.date = new.ordinal, new.kind, new.date
+                changed.append(event)
+        with transaction.atomic():
+            cls.objects.filter(pk__in=stale).delete()
+            cls.objects.bulk_update(changed, ['ordinal', 'kind', 'date'])
+            cls.objects.bulk_create(events.values())
+
+
+class WeeklyDigest(models.Model):
+    """Per-story summary of each week's new installments, for What Was New.
+    Revisions are left out. Kept up to date by the handlers in
+    `library.signals`; rebuild with `manage.py rebuild_digest`.
+    """
+    year = models.SmallIntegerField()
+    week = models.SmallIntegerField()
+    story = models.ForeignKey(
+        'Story',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    is_update = models.BooleanField(
+        default=False,
+    )
+    up_count = models.IntegerField(
+        default=0,
+    )
+    published_on = models.DateField()
+
+    def __str__(self):
+        return '{:d}-W{:02d} {}'.format(self.year, self.week, self.story_id)
+
+    class Meta:
+        ordering = ['-year', '-week']
+        unique_together = ('year', 'week', 'story')
+
+    @staticmethod
+    def week_of(date):
+        # matches ExtractYear and ExtractWeek, quirks and all
+        return date.year, date.isocalendar()[1]
+
+    @classmethod
+    def compute(cls, rows):
+        """Summarize `(story_id, ordinal, published_on)` rows, which must be
+        sorted by story, then date."""
+        for story_id, story_rows in groupby(rows, itemgetter(0)):
+            seen = set()
+            first_week = None
+            weeks = {}
+            for _, ordinal, published_on in story_rows:
+                week = cls.week_of(published_on)
+                first_week = first_week or week
+                if ordinal in seen:
+                    continue
+                seen.add(ordinal)
+                digest = weeks.get(week)
+                if not digest:
+                    digest = weeks[week] = cls(year=week[0],
+                                               week=week[1],
+                                               story_id=story_id,
+                                               is_update=week != first_week,
+                                               published_on=published_on)
+                digest.up_count += 1
+                digest.published_on = published_on
+            yield from weeks.values()
+
+    @classmethod
+    def refresh(cls, story_ids, year=None):
+        """Recompute the rows for the given stories, optionally only those
+        for one year, and invalidate the pages showing them. Meant to be
+        called from within the transaction that changed them."""
+        story_ids = set(story_ids)
+        if not story_ids:
+            return
+
+        rows = Installment.objects \
+            .filter(story_id__in=story_ids) \
+            .order_by('story_id', 'published_on', 'ordinal') \
+            .values_list('story_id', 'ordinal', 'published_on')
+        digests = cls.compute(rows.iterator())
+
+        existing = cls.objects.filter(story_id__in=story_ids)
+        if year is not None:
+            digests = (d for d in digests if d.year == year)
+            existing = existing.filter(year=year)
+        digests = list(digests)
+
+        with transaction.atomic():
+            years = set(existing.order_by().values_list('year', flat=True).distinct())
+            years.update(d.year for d in digests)
+            had = cls._years_with_rows(years)
+            existing.delete()
+            cls.objects.bulk_create(digests)
+
+            tags = [DIGEST.format(y) for y in years]
+            if had != cls._years_with_rows(years):
+                # a year came or went, so the links between them change
+                tags.append(DIGEST.format('years'))
+            if tags:
+                bump_version(*tags)
+
+    @classmethod
+    def _years_with_rows(cls, years):
+        return set(cls.objects.filter(year__in=years).order_by().values_list('year', flat=True).distinct())
+
+
+class CatalogCount(models.Model):
+    """Story counts for the catalog index pages: the number of live stories
+    with something to read, and how many stories fall under each letter,
+    author, code and slant. Kept up to date by the handlers in
+    `library.signals`; repair drift with `manage.py reconcile_counts`.
+    """
+    KIND_TOTAL = 't'
+    KIND_LETTER = 'l'
+    KIND_AUTHOR = 'a'
+    KIND_CODE = 'c'
+    KIND_SLANT = 's'
+    KIND_CHOICES = (
+        (KIND_TOTAL, 'total'),
+        (KIND_LETTER, 'letter'),
+        (KIND_AUTHOR, 'author'),
+        (KIND_CODE, 'code'),
+        (KIND_SLANT, 'slant'),
+    )
+
+    kind = models.CharField(
+        max_length=1,
+        choices=KIND_CHOICES,
+    )
+    key = models.CharField(
+        max_length=20,
+        blank=True,
+    )
+    count = models.IntegerField(
+        default=0,
+    )
+
+    def __str__(self):
+        return '{}:{} = {:d}'.format(self.kind, self.key, self.count)
+
+    class Meta:
+        unique_together = ('kind', 'key')
+
+    @classmethod
+    def counts(cls, kind):
+        return dict(cls.objects
+                    .filter(kind=kind)
+                    .values_list('key', 'count'))
+
+    @classmethod
+    def tally(cls, kind, keys=None):
+        """Count from scratch, for all keys of a kind or only the given ones.
+        Keys without any stories are left out."""
+        if kind == cls.KIND_TOTAL:
+            valid_insts = Installment.objects \
+                .order_by() \
+                .filter(story_id=OuterRef('pk'),
+                        is_current=True) \
+                .exclude(file='') \
+                .values('pk')
+            # NOTE: spelled to match the condition on story_live_idx
+            total = Story.objects \
+                .filter(Exists(valid_insts),
+                        removed_at__isnull=True) \
+                .count()
+            return {'': total}
+
+        if kind == cls.KIND_LETTER:
+            qs, field = Story.objects, 'sort_letter'
+        elif kind == cls.KIND_AUTHOR:
+            qs, field = Story.authors.through.objects, 'author_id'
+        elif kind == cls.KIND_CODE:
+            qs, field = Story.codes.through.objects, 'code_id'
+        elif kind == cls.KIND_SLANT:
+            qs, field = Story.objects, 'slant_id'
+        else:
+            raise ValueError('Unknown kind: {}'.format(kind))
+
+        if keys is not None:
+            qs = qs.filter(**{field + '__in': keys})
+        else:
+            # refresh() never counts a missing slant, either
+            qs = qs.filter(**{field + '__isnull': False})
+        rows = qs \
+            .order_by() \
+            .values(field) \
+            .annotate(n=Count('pk')) \
+            .values_list(field, 'n')
+        return {str(k): n for k, n in rows}
+
+    @classmethod
+    def refresh(cls, kind, keys=None):
+        """Recount the given keys of a kind, or all of them, from scratch;
+        see `manage.py reconcile_counts`. Writes go through adjust()."""
+        if keys is not None:
+            keys = {str(k) for k in keys if k is not None}
+            if kind == cls.KIND_TOTAL:
+                keys = {''}
+            if not keys:
+                return
+
+        counts = cls.tally(kind, keys)
+        existing = cls.objects.filter(kind=kind)
+        if keys is not None:
+            existing = existing.filter(key__in=keys)
+
+        with transaction.atomic():
+            existing.delete()
+            cls.objects.bulk_create(cls(kind=kind, key=k, count=n)
+                                    for k, n in counts.items())
+
+    @classmethod
+    def adjust(cls, kind, deltas):
+        """Add `{key: delta}` to the counts of a kind, as stories come and go
+        under those keys. Keys left without stories are dropped, as tally()
+        leaves them out. Meant to be called from within the transaction that
+        changed them."""
+        emptied = []
+        for key, delta in deltas.items():
+            if key is None or not delta:
+                continue
+            key = str(key)
+            rows = cls.objects.filter(kind=kind, key=key)
+            if delta < 0:
+                rows.update(count=F('count') + delta)
+                emptied.append(key)
+            elif not rows.update(count=F('count') + delta):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(kind=kind, key=key, count=delta)
+                except IntegrityError:
+                    # the first story under it came in from elsewhere, too
+                    rows.update(count=F('count') + delta)
+        if emptied:
+            cls.objects.filter(kind=kind, key__in=emptied, count__lte=0).delete()
+
+    @classmethod
+    def count_live(cls, gained, lost):
+        """Adjust the total for stories that gained their first valid
+        installment or lost their last one; see StoryStats.refresh. Removed
+        stories aren't counted either way."""
+        gained, lost = set(gained), set(lost)
+        if not gained and not lost:
+            return
+        live = set(Story.objects
+                   .filter(pk__in=gained | lost, removed_at__isnull=True)
+                   .values_list('pk', flat=True))
+        cls.adjust(cls.KIND_TOTAL, {'': len(live & gained) - len(live & lost)})
+
+
+class StoryStats(models.Model):
+    """Denormalized rollup of the per-story values shown in listings. Kept up
+    to date by the handlers in `library.signals`; rebuild everything with
+    `manage.py rebuild_story_stats`.
+    """
+    story = models.OneToOneField(
+        'Story',
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+    )
+    installment_count = models.IntegerField(
+        default=0,
+    )
+    missing_count = models.IntegerField(
+        default=0,
+    )
+    first_ordinal = models.SmallIntegerField(
+        blank=True,
+        null=True,
+    )
+    last_ordinal = models.SmallIntegerField(
+        blank=True,
+        null=True,
+    )
+    word_count = models.IntegerField(
+        default=0,
+    )
+    authors = models.JSONField(
+        default=list,
+        blank=True,
+    )
+    codes = models.JSONField(
+        default=list,
+        blank=True,
+    )
+
+    def __str__(self):
+        return str(self.story_id)
+
+    class Meta:
+        verbose_name_plural = 'story stats'
+
+    @staticmethod
+    def _valid_ordinal_sq(forward=True):
+        qs = Installment.objects \
+            .filter(story=OuterRef('pk'), is_current=True) \
+            .exclude(file='') \
+            .values_list('ordinal', flat=True)
+        return Subquery(qs.order_by('ordinal' if forward else '-ordinal')[:1])
+
+    @staticmethod
+    def _word_count_sq():
+        qs = Installment.objects \
+            .order_by() \
+            .filter(story=OuterRef('pk'), is_current=True, length_unit=Installment.LU_WORDS) \
+            .values('story') \
+            .annotate(n=Sum('length')) \
+            .values('n')
+        return Subquery(qs)
+
+    @classmethod
+    def refresh(cls, story_ids):
+        """Recompute the rows for the given stories, and return the ids of
+        those that gained their first valid installment, and of those that
+        lost their last, for CatalogCount.count_live(). Meant to be called
+        from within the transaction that changed them."""
+        story_ids = set(story_ids)
+        if not story_ids:
+            return set(), set()
+
+        rows = Story.objects \
+            .order_by() \
+            .filter(pk__in=story_ids) \
+            .annotate(stats_authors=Story.authors_sq(),
+                      stats_codes=Story.codes_sq(),
+                      stats_ic=Story.installment_count_sq(),
+                      stats_mc=Story.missing_count_sq(),
+                      stats_first=cls._valid_ordinal_sq(True),
+                      stats_last=cls._valid_ordinal_sq(False),
+                      stats_wc=cls._word_count_sq()) \
+            .values_list('pk', 'stats_authors', 'stats_codes', 'stats_ic',
+                         'stats_mc', 'stats_first', 'stats_last', 'stats_wc')
+
+        stats = [
+            cls(story_id=pk,
+                authors=authors or [],
+                codes=codes or [],
+                installment_count=ic,
+                missing_count=mc,
+                first_ordinal=first,
+                last_ordinal=last,
+                word_count=wc or 0)
+            for pk, authors, codes, ic, mc, first, last, wc in rows
+        ]
+        existing = cls.objects.filter(story_id__in=story_ids)
+        with transaction.atomic():
+            # only stories with a valid installment have a first one
+            had = set(existing.filter(first_ordinal__isnull=False).values_list('story_id', flat=True))
+            existing.delete()
+            cls.objects.bulk_create(stats)
+        has = {s.story_id for s in stats if s.first_ordinal is not None}
+        return has - had, had - has
+
+
 class SagaDisplayManager(models.Manager):
     def get_queryset(self):
+        # see: SagaStats
         return super().get_queryset() \
-            .annotate(author_dicts=Saga.authors_sq(),
-                      code_abbrs=Saga.codes_sq(),
-                      updated_on=Saga.updated_on_sq(),
-                      entry_count=Saga.entry_count_sq())
+            .annotate(author_dicts=F('stats__authors'),
+                      code_abbrs=F('stats__codes'),
+                      updated_on=F('stats__updated_on'),
+                      entry_count=Coalesce('stats__entry_count', 0))
+
+    def navigating(self, story):
+        """Annotate the position of `story` within each saga, along with its
+        neighbors, from the links maintained on SagaEntry."""
+        here = FilteredRelation('sagaentry', condition=Q(sagaentry__story=story))
+        return self.get_queryset() \
+            .annotate(here=here) \
+            .annotate(current_index=F('here__order'),
+                      prev_slug=F('here__prev_story__slug'),
+                      prev_last_ordinal=F('here__prev_story__stats__last_ordinal'),
+                      next_slug=F('here__next_story__slug'),
+                      next_first_ordinal=F('here__next_story__stats__first_ordinal'))
 
 
 class Saga(models.Model, AuthorsMixin, CodesMixin):
@@ -578,6 +1339,7 @@ class Saga(models.Model, AuthorsMixin, CodesMixin):
     stories = models.ManyToManyField(
         'Story',
         through='SagaEntry',
+        through_fields=('saga', 'story'),
         related_name='sagas',
     )
 
@@ -605,18 +1367,18 @@ class Saga(models.Model, AuthorsMixin, CodesMixin):
     def current_index(self, value):
         self._ci = value
 
-    @cached_property
+    # NOTE: prev_entry and next_entry expect SagaDisplayManager.navigating()
+
+    @property
     def prev_entry(self):
-        if self.current_index and 1 < self.current_index:
-            # current_index is 1-indexed
-            return self.stories_ordered.all()[self.current_index-2]
+        if self.prev_slug:
+            return {'slug': self.prev_slug, 'last_ordinal': self.prev_last_ordinal}
         return None
 
-    @cached_property
+    @property
     def next_entry(self):
-        if self.current_index and self.current_index < self.entry_count:
-            # current_index is 1-indexed
-            return self.stories_ordered.all()[self.current_index]
+        if self.next_slug:
+            return {'slug': self.next_slug, 'first_ordinal': self.next_first_ordinal}
         return None
 
     objects = models.Manager()
@@ -644,22 +1406,23 @@ class Saga(models.Model, AuthorsMixin, CodesMixin):
                 self.slug = ShortUUIDField.gen()
 
     @staticmethod
-    def authors_sq(separator=DEFAULT_AUTHOR_SEP):
-        return Subquery(Author.objects
-                        .order_by()
-                        .filter(stories__sagas__pk=OuterRef('pk'))
-                        .annotate(names=Concat('name', separator=separator))
-                        .values('names')
-                        )
+    def authors_sq():
+        # EXISTS rather than a join, so authors of several entries appear once
+        in_saga = Story.authors.through.objects \
+            .filter(author_id=OuterRef('pk'),
+                    story__sagas__pk=OuterRef(OuterRef('pk')))
+        return JSONArray(Author.objects
+                         .filter(Exists(in_saga)),
+                         ('name', 'slug'))
 
     @staticmethod
     def codes_sq():
-        return Subquery(Code.objects
-                        .order_by()
-                        .filter(stories__sagas__pk=OuterRef('pk'))
-                        .annotate(abbrs=Concat('abbr', distinct=True))
-                        .values('abbrs')
-                        )
+        in_saga = Story.codes.through.objects \
+            .filter(code_id=OuterRef('pk'),
+                    story__sagas__pk=OuterRef(OuterRef('pk')))
+        return JSONArray(Code.objects
+                         .filter(Exists(in_saga)),
+                         ('abbr',))
 
     @staticmethod
     def updated_on_sq():
@@ -677,18 +1440,89 @@ class Saga(models.Model, AuthorsMixin, CodesMixin):
                        .filter(sagas__pk=OuterRef('pk'))
                        )
 
-    @staticmethod
-    def current_index_sq(story):
-        return Subquery(SagaEntry.objects
-                        .values_list('order', flat=True)
-                        .filter(story=story, saga_id=OuterRef('pk'))
-                        )
+
+class SagaStats(models.Model):
+    """Denormalized rollup of the per-saga values shown in listings; see
+    StoryStats."""
+    saga = models.OneToOneField(
+        'Saga',
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE,
+    )
+    entry_count = models.IntegerField(
+        default=0,
+    )
+    updated_on = models.DateField(
+        blank=True,
+        null=True,
+    )
+    authors = models.JSONField(
+        default=list,
+        blank=True,
+    )
+    codes = models.JSONField(
+        default=list,
+        blank=True,
+    )
+
+    def __str__(self):
+        return str(self.saga_id)
+
+    class Meta:
+        verbose_name_plural = 'saga stats'
+
+    @classmethod
+    def refresh(cls, saga_ids):
+        """Recompute the rows for the given sagas. Meant to be called from
+        within the transaction that changed them."""
+        saga_ids = set(saga_ids)
+        if not saga_ids:
+            return
+
+        rows = Saga.objects \
+            .order_by() \
+            .filter(pk__in=saga_ids) \
+            .annotate(stats_authors=Saga.authors_sq(),
+                      stats_codes=Saga.codes_sq(),
+                      stats_updated=Saga.updated_on_sq(),
+                      stats_ec=Saga.entry_count_sq()) \
+            .values_list('pk', 'stats_authors', 'stats_codes', 'stats_updated', 'stats_ec')
+
+        stats = [
+            cls(saga_id=pk,
+                authors=authors or [],
+                codes=codes or [],
+                updated_on=updated_on,
+                entry_count=ec)
+            for pk, authors, codes, updated_on, ec in rows
+        ]
+        with transaction.atomic():
+            cls.objects.filter(saga_id__in=saga_ids).delete()
+            cls.objects.bulk_create(stats)
 
 
 class SagaEntry(models.Model):
     saga = models.ForeignKey('Saga', on_delete=models.CASCADE)
     story = models.ForeignKey('Story', on_delete=models.CASCADE)
     order = models.PositiveSmallIntegerField()
+    # neighbors within the saga; see relink()
+    prev_story = models.ForeignKey(
+        'Story',
+        related_name='+',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    next_story = models.ForeignKey(
+        'Story',
+        related_name='+',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False,
+    )
     # TODO: for stories that already include a grouping in their titles?
     # short_title = models.CharField(
     #     max_length=Story.TITLE_LEN,
@@ -703,6 +1537,24 @@ class SagaEntry(models.Model):
         unique_together = ('saga', 'story')
         verbose_name_plural = 'entries'
 
+    @classmethod
+    def relink(cls, saga_ids):
+        """Point each entry of the given sagas at its neighbors."""
+        changed = []
+        for saga_id in set(saga_ids):
+            entries = list(cls.objects
+                           .filter(saga_id=saga_id)
+                           .order_by('order', 'pk')
+                           .only('story_id', 'prev_story_id', 'next_story_id'))
+            for i, entry in enumerate(entries):
+                prev_id = entries[i-1].story_id if i > 0 else None
+                next_id = entries[i+1].story_id if i+1 < len(entries) else None
+                if (entry.prev_story_id, entry.next_story_id) != (prev_id, next_id):
+                    entry.prev_story_id = prev_id
+                    entry.next_story_id = next_id
+                    changed.append(entry)
+        cls.objects.bulk_update(changed, ['prev_story', 'next_story'])
+
 
 class Theme(models.Model):
     slug = ShortUUIDField(
@@ -713,6 +1565,12 @@ class Theme(models.Model):
         unique=True,
     )
     css = models.TextField()
+    # compiled copy in static storage; see compile_css()
+    css_path = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
     active = models.BooleanField(
         default=False,
     )
@@ -722,11 +1580,41 @@ class Theme(models.Model):
 
     objects = OrderedLowerManager('name')
 
+    THEMES_DIR = 'themes'
+
     def __str__(self):
         return str(self.name)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # what css_path was compiled from; None when deferred
+        self._compiled_css = self.__dict__.get('css') if self.__dict__.get('css_path') else None
+
+    def compile_css(self):
+        """Write the minified stylesheet, plus the variants Blob.compress()
+        makes, to static storage under a content-hashed name. Files are never
+        overwritten, so they can be cached forever; the stylesheet goes last,
+        so once it exists, so do its variants."""
+        css = minify_css(self.css).encode('utf-8')
+        digest = hashlib.md5(css).hexdigest()[:12]
+        name = '{}/{}.{}.css'.format(self.THEMES_DIR, self.slug, digest)
+
+        if not staticfiles_storage.exists(name):
+            for coding, content in Blob.compress(css):
+                path = name + Blob.VARIANTS[coding]
+                if not staticfiles_storage.exists(path):
+                    staticfiles_storage.save(path, ContentFile(content))
+            staticfiles_storage.save(name, ContentFile(css))
+
+        self.css_path = name
+        self._compiled_css = self.css
+        return name
+
     # TODO: atomic?
     def save(self, *args, **kwargs):
+        if self.css != self._compiled_css:
+            self.compile_css()
+
         # https://stackoverflow.com/a/44720466
         if self.active:
             qs = type(self).objects.filter(active=True)
@@ -0,0 +1,130 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Page through a queryset by the values of its sort keys rather than by
+    OFFSET, so every page is a range read off an index on `keys`.
+
+    The keys are ascending, must end in something unique, and may be
+    nullable; NULLs sort after everything else. Cursors are opaque strings
+    pointing just past the first or last row of a page.
+    """
+
+    def __init__(self, queryset, keys, per_page):
+        self.queryset = queryset
+        self.keys = tuple(keys)
+        self.per_page = per_page
+
+        opts = queryset.model._meta
+        self.fields = {key: opts.pk if key == 'pk' else opts.get_field(key) for key in self.keys}
+        self.nullable = {key for key, field in self.fields.items() if field.null}
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, key) for key in self.keys]
+        data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data)
+        except ValueError:
+            raise InvalidCursor('That cursor is not valid.')
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise InvalidCursor('That cursor is not valid.')
+        try:
+            return [self._clean(key, value) for key, value in zip(self.keys, values)]
+        except ValidationError:
+            raise InvalidCursor('That cursor is not valid.')
+
+    def _clean(self, key, value):
+        # cursors come from the query string, so anything could be in them
+        if value is None and key in self.nullable:
+            return None
+        if not isinstance(value, (str, int, float)):
+            raise ValidationError('Not a scalar.')
+        return self.fields[key].to_python(value)
+
+    def _seek(self, values, forward):
+        """Build the filter for rows strictly after (or before) `values`."""
+        seek = Q()
+        equal = Q()
+        for key, value in zip(self.keys, values):
+            if key not in self.nullable:
+                step = Q(**{key + ('__gt' if forward else '__lt'): value})
+                same = Q(**{key: value})
+            elif value is None:
+                # nothing sorts after a NULL; everything else sorts before it
+                step = None if forward else Q(**{key + '__isnull': False})
+                same = Q(**{key + '__isnull': True})
+            else:
+                step = Q(**{key + '__gt': value}) | Q(**{key + '__isnull': True}) \
+                    if forward else Q(**{key + '__lt': value})
+                same = Q(**{key: value})
+            if step is not None:
+                seek |= equal & step
+            equal &= same
+        return seek
+
+    def _ordering(self, forward):
+        ordering = []
+        for key in self.keys:
+            nulls = {} if key not in self.nullable else \
+                {'nulls_last': True} if forward else {'nulls_first': True}
+            ordering.append(F(key).asc(**nulls) if forward else F(key).desc(**nulls))
+        return ordering
+
+    def page(self, after=None, before=None):
+        forward = before is None
+        cursor = after if forward else before
+
+        qs = self.queryset.order_by(*self._ordering(forward))
+        if cursor:
+            qs = qs.filter(self._seek(self.decode_cursor(cursor), forward))
+
+        rows = list(qs[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        # there is always something on the side we came from
+        has_next = has_more if forward else True
+        has_previous = bool(cursor) if forward else has_more
+        return KeysetPage(rows,
+                          next_cursor=self.encode_cursor(rows[-1]) if has_next else None,
+                          previous_cursor=self.encode_cursor(rows[0]) if has_previous else None)
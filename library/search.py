@@ -0,0 +1,279 @@
+"""Full-text search over story titles, synopses and installment text.
+
+Every story has a document with its title and synopsis, and every current
+installment one with its title and text; results are ranked per story by
+its best document. PostgreSQL keeps the documents in a table with a
+weighted tsvector and a GIN index, SQLite in an FTS5 virtual table. Both
+are created by migration 0013 and kept up to date by the handlers in
+`library.signals`; (re)build everything with `manage.py reindex_search`.
+"""
+import html
+import re
+
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from library.models import Installment, Story
+from library.util import extract_text
+
+TABLE = 'library_search'
+BATCH_SIZE = 500
+
+# swapped for <mark> once the snippet is escaped
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+
+re_term = re.compile(r'\w+')
+
+
+def _story_rowid(story_id):
+    # installments use their own pk
+    return -story_id
+
+
+def _file_text(name):
+    try:
+        with default_storage.open(name, 'rb') as f:
+            return extract_text(f.chunks())
+    except OSError:
+        return ''
+
+
+def _batched(items):
+    items = list(items)
+    for i in range(0, len(items), BATCH_SIZE):
+        yield items[i:i + BATCH_SIZE]
+
+
+def _snippet_html(text):
+    return html.escape(text) \
+        .replace(MARK_START, '<mark>') \
+        .replace(MARK_END, '</mark>')
+
+
+class SearchBackend:
+    """Documents are `(rowid, story_id, heading, summary, body)` tuples,
+    weighted in that order."""
+
+    def __init__(self, conn):
+        self.connection = conn
+
+    # documents
+
+    def story_docs(self, story_ids):
+        rows = Story.objects \
+            .filter(pk__in=story_ids) \
+            .values_list('pk', 'title', 'synopsis')
+        return [(_story_rowid(pk), pk, title, synopsis or '', '')
+                for pk, title, synopsis in rows.iterator()]
+
+    def installment_docs(self, installment_ids):
+        """Documents for the current installments with a file among the
+        given ones; the rest have none."""
+        rows = Installment.objects \
+            .filter(pk__in=installment_ids, is_current=True) \
+            .exclude(file='') \
+            .values_list('pk', 'story_id', 'title', 'file')
+        texts = {}
+        docs = []
+        for pk, story_id, title, name in rows.iterator():
+            # installments sharing a blob are only read once
+            if name not in texts:
+                texts[name] = _file_text(name)
+            docs.append((pk, story_id, '', title, texts[name]))
+        return docs
+
+    def index_stories(self, story_ids):
+        story_ids = set(story_ids)
+        self.delete(_story_rowid(pk) for pk in story_ids)
+        self.insert(self.story_docs(story_ids))
+
+    def index_installments(self, installment_ids):
+        installment_ids = set(installment_ids)
+        self.delete(installment_ids)
+        self.insert(self.installment_docs(installment_ids))
+
+    def remove_stories(self, story_ids):
+        self.delete(_story_rowid(pk) for pk in story_ids)
+
+    def remove_installments(self, installment_ids):
+        self.delete(installment_ids)
+
+    def _rowids(self, story_ids):
+        # every document the given stories could have
+        inst_ids = Installment.objects \
+            .filter(story_id__in=story_ids, is_current=True) \
+            .exclude(file='') \
+            .values_list('pk', flat=True)
+        return [_story_rowid(pk) for pk in story_ids] + list(inst_ids)
+
+    def _filters(self, codes, slant):
+        where, params = ['s.removed_at IS NULL'], []
+        if slant:
+            where.append('s.slant_id = %s')
+            params.append(slant)
+        for code in codes:
+            where.append('EXISTS (SELECT 1 FROM {} sc WHERE sc.story_id = s.id AND sc.code_id = %s)'
+                         .format(Story.codes.through._meta.db_table))
+            params.append(code)
+        return ' AND '.join(where), params
+
+    # the backend specific parts
+
+    def clear(self):
+        raise NotImplementedError
+
+    def delete(self, rowids):
+        raise NotImplementedError
+
+    def insert(self, docs):
+        raise NotImplementedError
+
+    def search(self, query, codes=(), slant=None, offset=0, limit=20):
+        """Return the ids of the best matching stories, best first."""
+        raise NotImplementedError
+
+    def snippets(self, query, story_ids):
+        """Return `{story_id: html}` with the matches in the best document
+        of each story marked."""
+        raise NotImplementedError
+
+
+class SqliteSearch(SearchBackend):
+    # weights for bm25(), by column
+    WEIGHTS = '10.0, 4.0, 1.0'
+
+    @staticmethod
+    def match(query):
+        # every term, as a phrase so nothing in them is taken for syntax
+        return ' '.join('"{}"'.format(term) for term in re_term.findall(query))
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(TABLE))
+
+    def delete(self, rowids):
+        with self.connection.cursor() as cursor:
+            for batch in _batched(rowids):
+                cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(
+                    TABLE, ', '.join(['%s'] * len(batch))), batch)
+
+    def insert(self, docs):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO {} (rowid, story_id, heading, summary, body) '
+                'VALUES (%s, %s, %s, %s, %s)'.format(TABLE), docs)
+
+    def search(self, query, codes=(), slant=None, offset=0, limit=20):
+        match = self.match(query)
+        if not match:
+            return []
+        where, params = self._filters(codes, slant)
+        sql = '''
+            SELECT h.story_id
+              FROM (SELECT story_id, min(rank) AS rank
+                      FROM (SELECT story_id, bm25({table}, {weights}) AS rank
+                              FROM {table}
+                             WHERE {table} MATCH %s
+                             -- keeps bm25() out of the GROUP BY
+                             LIMIT -1)
+                     GROUP BY story_id) h
+              JOIN {story} s ON s.id = h.story_id
+             WHERE {where}
+             ORDER BY h.rank, h.story_id
+             LIMIT %s OFFSET %s
+        '''.format(table=TABLE, weights=self.WEIGHTS, story=Story._meta.db_table, where=where)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [match] + params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def snippets(self, query, story_ids):
+        match = self.match(query)
+        rowids = self._rowids(story_ids)
+        if not match or not rowids:
+            return {}
+        sql = '''
+            SELECT story_id, snippet({table}, -1, %s, %s, '…', 24)
+              FROM {table}
+             WHERE {table} MATCH %s AND rowid IN ({rowids})
+             ORDER BY bm25({table}, {weights})
+        '''.format(table=TABLE, weights=self.WEIGHTS, rowids=', '.join(['%s'] * len(rowids)))
+        snippets = {}
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [MARK_START, MARK_END, match] + rowids)
+            for story_id, snippet in cursor.fetchall():
+                snippets.setdefault(story_id, _snippet_html(snippet))
+        return snippets
+
+
+class PostgresSearch(SearchBackend):
+    CONFIG = 'english'
+    HEADLINE = 'StartSel={}, StopSel={}, MaxWords=35, MinWords=15, MaxFragments=2'.format(
+        MARK_START, MARK_END)
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('TRUNCATE {}'.format(TABLE))
+
+    def delete(self, rowids):
+        rowids = list(rowids)
+        if rowids:
+            with self.connection.cursor() as cursor:
+                cursor.execute('DELETE FROM {} WHERE id = ANY(%s)'.format(TABLE), [rowids])
+
+    def insert(self, docs):
+        sql = '''
+            INSERT INTO {} (id, story_id, content, vector)
+            VALUES (%s, %s, %s,
+                    setweight(to_tsvector(%s::regconfig, %s), 'A') ||
+                    setweight(to_tsvector(%s::regconfig, %s), 'B') ||
+                    setweight(to_tsvector(%s::regconfig, %s), 'C'))
+        '''.format(TABLE)
+        with self.connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                (rowid, story_id, ' '.join(filter(None, (heading, summary, body))),
+                 self.CONFIG, heading, self.CONFIG, summary, self.CONFIG, body)
+                for rowid, story_id, heading, summary, body in docs
+            ])
+
+    def search(self, query, codes=(), slant=None, offset=0, limit=20):
+        where, params = self._filters(codes, slant)
+        sql = '''
+            SELECT h.story_id
+              FROM (SELECT story_id, max(ts_rank(d.vector, q)) AS rank
+                      FROM {table} d, websearch_to_tsquery(%s::regconfig, %s) q
+                     WHERE d.vector @@ q
+                     GROUP BY story_id) h
+              JOIN {story} s ON s.id = h.story_id
+             WHERE {where}
+             ORDER BY h.rank DESC, h.story_id
+             LIMIT %s OFFSET %s
+        '''.format(table=TABLE, story=Story._meta.db_table, where=where)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [self.CONFIG, query] + params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def snippets(self, query, story_ids):
+        rowids = self._rowids(story_ids)
+        if not rowids:
+            return {}
+        # the headline is only worth building for the best document
+        sql = '''
+            SELECT best.story_id, ts_headline(%s::regconfig, best.content, q, %s)
+              FROM (SELECT DISTINCT ON (d.story_id) d.story_id, d.content
+                      FROM {table} d, websearch_to_tsquery(%s::regconfig, %s) q
+                     WHERE d.id = ANY(%s) AND d.vector @@ q
+                     ORDER BY d.story_id, ts_rank(d.vector, q) DESC) best,
+                   websearch_to_tsquery(%s::regconfig, %s) q
+        '''.format(table=TABLE)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [self.CONFIG, self.HEADLINE, self.CONFIG, query, rowids,
+                                 self.CONFIG, query])
+            return {story_id: _snippet_html(headline) for story_id, headline in cursor.fetchall()}
+
+
+def get_backend(conn=None):
+    conn = conn or connection
+    if conn.vendor == 'postgresql':
+        return PostgresSearch(conn)
+    return SqliteSearch(conn)
@@ -0,0 +1,381 @@
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from library.cache import CATALOG, READER, SITE, bump_version
+from library.models import ActivityEvent, Author, Blob, CatalogCount, Code, Installment, List, \
+    ListEntry, Saga, SagaEntry, SagaStats, Slant, Story, StoryStats, Theme, UserProfile, WeeklyDigest
+from library.search import get_backend as get_search_backend
+
+
+def _m2m_story_ids(instance, reverse, pk_set):
+    if not reverse:
+        return [instance.pk]
+    elif pk_set is not None:
+        return pk_set
+    else:
+        # reverse clear; see _stash_story_ids
+        return getattr(instance, '_stashed_story_ids', [])
+
+
+def _stash_story_ids(instance):
+    # the m2m rows are gone by the time post_clear/post_delete come around
+    instance._stashed_story_ids = list(instance.stories.values_list('pk', flat=True))
+
+
+def _refresh_stories(story_ids):
+    story_ids = set(story_ids)
+    CatalogCount.count_live(*StoryStats.refresh(story_ids))
+    SagaStats.refresh(SagaEntry.objects
+                      .filter(story_id__in=story_ids)
+                      .values_list('saga_id', flat=True))
+
+
+# StoryStats, SagaStats
+
+@receiver(post_save, sender=Story)
+def story_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _refresh_stories([instance.pk])
+
+
+@receiver(post_delete, sender=Story)
+def story_deleted(sender, instance, **kwargs):
+    # cascading deletes may have refreshed these after they were deleted
+    StoryStats.objects.filter(story_id=instance.pk).delete()
+    # with the installments gone, this just drops its rows
+    WeeklyDigest.refresh([instance.pk])
+
+
+@receiver(post_save, sender=Installment)
+@receiver(post_delete, sender=Installment)
+def installment_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _refresh_stories([instance.story_id])
+
+
+@receiver(m2m_changed, sender=Story.authors.through)
+@receiver(m2m_changed, sender=Story.codes.through)
+def story_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        _stash_story_ids(instance)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        _refresh_stories(_m2m_story_ids(instance, reverse, pk_set))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Code)
+def story_tag_deleting(sender, instance, **kwargs):
+    _stash_story_ids(instance)
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        _refresh_stories(instance.stories.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Code)
+def story_tag_deleted(sender, instance, **kwargs):
+    _refresh_stories(instance._stashed_story_ids)
+
+
+@receiver(post_save, sender=Saga)
+def saga_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        SagaStats.refresh([instance.pk])
+
+
+@receiver(post_delete, sender=Saga)
+def saga_deleted(sender, instance, **kwargs):
+    # see: story_deleted
+    SagaStats.objects.filter(saga_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=SagaEntry)
+@receiver(post_delete, sender=SagaEntry)
+def saga_entry_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        SagaEntry.relink([instance.saga_id])
+        SagaStats.refresh([instance.saga_id])
+
+
+# ActivityEvent, WeeklyDigest
+
+@receiver(post_save, sender=Installment)
+@receiver(post_delete, sender=Installment)
+def installment_dated(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # its event still has the date it was published on before
+        dates = [instance.published_on]
+        dates.extend(ActivityEvent.objects.filter(installment_id=instance.pk).values_list('date', flat=True))
+        ActivityEvent.refresh({instance.story_id: min(dates)})
+        WeeklyDigest.refresh([instance.story_id])
+
+
+# CatalogCount
+
+_COUNTED_M2M = {
+    Story.authors.through: (CatalogCount.KIND_AUTHOR, 'authors', 'author_id'),
+    Story.codes.through: (CatalogCount.KIND_CODE, 'codes', 'code_id'),
+}
+
+
+def _stash_story_keys(story):
+    # the previous letter and slant, plus the tags as the delete cascades
+    story._stashed_keys = {
+        CatalogCount.KIND_LETTER: {story.sort_letter},
+        CatalogCount.KIND_SLANT: {story.slant_id},
+    }
+    story._stashed_row = None
+    if story.pk is None:
+        return
+    old = Story.objects.filter(pk=story.pk).values_list('sort_letter', 'slant_id', 'removed_at').first()
+    if old:
+        story._stashed_keys[CatalogCount.KIND_LETTER].add(old[0])
+        story._stashed_keys[CatalogCount.KIND_SLANT].add(old[1])
+        story._stashed_row = old
+
+
+def _is_readable(story_id):
+    # see StoryStats.refresh
+    return StoryStats.objects.filter(story_id=story_id, first_ordinal__isnull=False).exists()
+
+
+@receiver(pre_save, sender=Story)
+def story_counting(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _stash_story_keys(instance)
+
+
+@receiver(pre_delete, sender=Story)
+def story_uncounting(sender, instance, **kwargs):
+    _stash_story_keys(instance)
+    for kind, attr, _ in _COUNTED_M2M.values():
+        instance._stashed_keys[kind] = set(getattr(instance, attr).values_list('pk', flat=True))
+    instance._stashed_live = instance.removed_at is None and _is_readable(instance.pk)
+    # so the cascading installment deletes don't count it out, too
+    StoryStats.objects.filter(story_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Story)
+def story_counted(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance._stashed_row
+    letter, slant, removed_at = old or (None, None, None)
+    if instance.sort_letter != letter:
+        CatalogCount.adjust(CatalogCount.KIND_LETTER, {instance.sort_letter: 1, letter: -1})
+    if instance.slant_id != slant:
+        CatalogCount.adjust(CatalogCount.KIND_SLANT, {instance.slant_id: 1, slant: -1})
+
+    # new stories have nothing to read yet
+    if old and (instance.removed_at is None) != (removed_at is None) and _is_readable(instance.pk):
+        CatalogCount.adjust(CatalogCount.KIND_TOTAL, {'': 1 if instance.removed_at is None else -1})
+
+
+@receiver(post_delete, sender=Story)
+def story_uncounted(sender, instance, **kwargs):
+    # as counted, not as edited but unsaved
+    letter, slant, _ = instance._stashed_row
+    CatalogCount.adjust(CatalogCount.KIND_LETTER, {letter: -1})
+    CatalogCount.adjust(CatalogCount.KIND_SLANT, {slant: -1})
+    for kind, _, _ in _COUNTED_M2M.values():
+        CatalogCount.adjust(kind, dict.fromkeys(instance._stashed_keys[kind], -1))
+    if instance._stashed_live:
+        CatalogCount.adjust(CatalogCount.KIND_TOTAL, {'': -1})
+
+
+def _m2m_tag_keys(instance, reverse, pk_set):
+    if reverse:
+        return [instance.pk]
+    elif pk_set is not None:
+        return pk_set
+    else:
+        # forward clear; see story_tags_counted
+        return instance._stashed_tag_keys
+
+
+@receiver(m2m_changed, sender=Story.authors.through)
+@receiver(m2m_changed, sender=Story.codes.through)
+def story_tags_counted(sender, instance, action, reverse, pk_set, **kwargs):
+    kind, _, field = _COUNTED_M2M[sender]
+    if action in ('pre_remove', 'pre_clear'):
+        # only the rows that are there get taken away
+        rows = sender.objects.filter(**{field if reverse else 'story_id': instance.pk})
+        if pk_set is not None:
+            rows = rows.filter(**{('story_id' if reverse else field) + '__in': pk_set})
+        instance._stashed_tag_counts = Counter(rows.values_list(field, flat=True))
+        instance._stashed_tag_keys = set(instance._stashed_tag_counts)
+    elif action == 'post_add':
+        # pk_set only has the rows that were actually added
+        CatalogCount.adjust(kind, {instance.pk: len(pk_set)} if reverse else dict.fromkeys(pk_set, 1))
+    elif action in ('post_remove', 'post_clear'):
+        CatalogCount.adjust(kind, {k: -n for k, n in instance._stashed_tag_counts.items()})
+
+
+@receiver(post_delete, sender=Author)
+def author_uncounted(sender, instance, **kwargs):
+    CatalogCount.objects.filter(kind=CatalogCount.KIND_AUTHOR, key=str(instance.pk)).delete()
+
+
+@receiver(post_delete, sender=Code)
+def code_uncounted(sender, instance, **kwargs):
+    CatalogCount.objects.filter(kind=CatalogCount.KIND_CODE, key=str(instance.pk)).delete()
+
+
+# Blob
+
+@receiver(pre_save, sender=Installment)
+def installment_unreferencing(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._stashed_blob_id = Installment.objects \
+            .filter(pk=instance.pk) \
+            .values_list('blob_id', flat=True) \
+            .first()
+
+
+@receiver(post_save, sender=Installment)
+@receiver(post_delete, sender=Installment)
+def installment_referenced(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Blob.recount([instance.blob_id, getattr(instance, '_stashed_blob_id', None)])
+
+
+# site_processor
+
+@receiver(post_save, sender=Slant)
+@receiver(post_delete, sender=Slant)
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+def site_globals_changed(sender, **kwargs):
+    bump_version(SITE)
+
+
+# cache_tagged pages
+
+_M2M_PAGE_TAGS = {
+    Story.authors.through: 'author',
+    Story.codes.through: 'code',
+}
+
+
+def _bump_tags(kind, keys):
+    tags = ['{}:{}'.format(kind, key) for key in keys if key is not None]
+    if tags:
+        # anything tagged shows up in some listing, too
+        bump_version(CATALOG, *tags)
+
+
+@receiver(post_save, sender=Story)
+@receiver(post_delete, sender=Story)
+def story_paged(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # letters stashed by story_counting/story_uncounting
+        _bump_tags('story', [instance.pk])
+        _bump_tags('letter', instance._stashed_keys[CatalogCount.KIND_LETTER])
+        # on delete, the tags too; the cascade skips m2m_changed
+        _bump_tags('author', instance._stashed_keys.get(CatalogCount.KIND_AUTHOR, ()))
+        _bump_tags('code', instance._stashed_keys.get(CatalogCount.KIND_CODE, ()))
+
+
+@receiver(m2m_changed, sender=Story.authors.through)
+@receiver(m2m_changed, sender=Story.codes.through)
+def story_tags_paged(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _bump_tags('story', _m2m_story_ids(instance, reverse, pk_set))
+        _bump_tags(_M2M_PAGE_TAGS[sender], _m2m_tag_keys(instance, reverse, pk_set))
+
+
+@receiver(post_save, sender=Installment)
+@receiver(post_delete, sender=Installment)
+def installment_paged(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_tags('story', [instance.story_id])
+        bump_version('activity')
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Code)
+def story_tag_paged(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        _bump_tags(sender.__name__.lower(), [instance.pk])
+        _bump_tags('story', instance.stories.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Code)
+def story_tag_unpaged(sender, instance, **kwargs):
+    _bump_tags(sender.__name__.lower(), [instance.pk])
+    _bump_tags('story', instance._stashed_story_ids)
+
+
+@receiver(post_save, sender=Saga)
+@receiver(post_delete, sender=Saga)
+def saga_paged(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_tags('saga', [instance.slug])
+        if not kwargs.get('created', True):
+            # story pages name their sagas; deletes go through saga_entry_paged
+            _bump_tags('story', instance.stories.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=SagaEntry)
+@receiver(post_delete, sender=SagaEntry)
+def saga_entry_paged(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_tags('saga', Saga.objects.filter(pk=instance.saga_id).values_list('slug', flat=True))
+        _bump_tags('story', [instance.story_id])
+
+
+# per-reader pages; see library.views._etag
+
+def _bump_readers(user_ids):
+    tags = [READER.format(pk) for pk in user_ids]
+    if tags:
+        bump_version(*tags)
+
+
+@receiver(post_save, sender=List)
+@receiver(post_delete, sender=List)
+@receiver(post_save, sender=UserProfile)
+def reader_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_readers([instance.user_id])
+
+
+@receiver(post_save, sender=ListEntry)
+@receiver(post_delete, sender=ListEntry)
+def list_entry_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _bump_readers(List.objects.filter(pk=instance.list_id).values_list('user_id', flat=True))
+
+
+# library.search
+
+@receiver(post_save, sender=Story)
+def story_indexed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index_stories([instance.pk])
+
+
+@receiver(post_delete, sender=Story)
+def story_unindexed(sender, instance, **kwargs):
+    get_search_backend().remove_stories([instance.pk])
+
+
+@receiver(post_save, sender=Installment)
+def installment_indexed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # other versions may have stopped being current
+        get_search_backend().index_installments(Installment.objects
+                                                .filter(story_id=instance.story_id,
+                                                        ordinal=instance.ordinal)
+                                                .values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Installment)
+def installment_unindexed(sender, instance, **kwargs):
+    get_search_backend().remove_installments([instance.pk])
@@ -0,0 +1,202 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import Storage, get_storage_class
+from django.utils.deconstruct import deconstructible
+
+from library.util import BLOBS_DIR
+
+STATS = ('hits', 'misses', 'evictions')
+
+
+@deconstructible
+class LocalCacheStorage(Storage):
+    """Keep local copies of recently read files from a slower (remote)
+    storage, e.g. django-storages' GoogleCloudStorage.
+
+    Only names under `prefixes` are cached. Those must never change once
+    written, like blobs, whose names carry their sha256 checksum, so a
+    local copy never has to be checked for staleness. Copies are written
+    atomically and shared by every process using the same `location`.
+    Reads never evict anything; `manage.py cull_media_cache`, run every few
+    minutes, evicts the least recently read copies once they take up more
+    than `max_size` bytes. Hits, misses and evictions are added up in the
+    default cache for every process; see stats().
+
+    Configured by settings.MEDIA_CACHE, a dict with BACKEND (a storage
+    class path), LOCATION and MAX_SIZE.
+    """
+    # share of max_size to free up when culling
+    CULL_FRACTION = 0.1
+    # reads between adding this process' counts to the shared ones
+    FLUSH_EVERY = 100
+
+    def __init__(self, backend=None, location=None, max_size=None, prefixes=(BLOBS_DIR + '/',)):
+        options = getattr(settings, 'MEDIA_CACHE', {})
+        backend = backend or options.get('BACKEND')
+        self.backend = backend if isinstance(backend, Storage) else get_storage_class(backend)()
+        self.location = os.path.abspath(location or options['LOCATION'])
+        self.max_size = max_size or options.get('MAX_SIZE', 1 << 30)
+        self.prefixes = tuple(prefixes)
+        # for this process; see stats() for everyone's
+        self.hits = self.misses = self.evictions = 0
+        self._flushed = dict.fromkeys(STATS, 0)
+
+    def caches(self, name):
+        return name.startswith(self.prefixes)
+
+    def cache_path(self, name):
+        key = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.location, key[:2], key + os.path.splitext(name)[1])
+
+    def _open(self, name, mode='rb'):
+        if mode not in ('r', 'rb') or not self.caches(name):
+            return self.backend.open(name, mode)
+        path = self.cache_path(name)
+        try:
+            f = open(path, mode)
+        except FileNotFoundError:
+            self.misses += 1
+            f = self._fill(name, path, mode)
+        else:
+            self.hits += 1
+            # the mtime is when it was last read; see cull()
+            os.utime(path)
+        if (self.hits + self.misses) % self.FLUSH_EVERY == 0:
+            self.flush_stats()
+        return File(f, name=path)
+
+    def _stats_key(self, stat):
+        # processes sharing a location share their counts
+        return 'media-cache:{}:{}'.format(hashlib.sha1(self.location.encode('utf-8')).hexdigest()[:12], stat)
+
+    def flush_stats(self):
+        """Add the counts of this process since the last flush to the
+        shared ones."""
+        for stat in STATS:
+            delta = getattr(self, stat) - self._flushed[stat]
+            if not delta:
+                continue
+            key = self._stats_key(stat)
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # a lost race adds nothing, and the next flush incr()s
+                if not cache.add(key, delta, timeout=None):
+                    cache.incr(key, delta)
+            self._flushed[stat] += delta
+
+    def stats(self):
+        """Return `{stat: count}` of hits, misses and evictions, added up
+        over every process that flushed them."""
+        counts = cache.get_many([self._stats_key(stat) for stat in STATS])
+        return {stat: counts.get(self._stats_key(stat), 0) for stat in STATS}
+
+    def _fill(self, name, path, mode):
+        """Copy `name` from the backend to `path`, and return it opened."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # dot files are skipped by cull()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as tmp, self.backend.open(name, 'rb') as src:
+                for chunk in src.chunks():
+                    tmp.write(chunk)
+            # opened first, so an eviction right after can't take it away
+            f = open(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return f
+
+    def cull(self):
+        """Evict the least recently read copies until they fit well within
+        `max_size`, unless another process is at it already. Walks the whole
+        cache, so it's too slow for a request. Return the number of copies
+        evicted, and the bytes left."""
+        os.makedirs(self.location, exist_ok=True)
+        with open(os.path.join(self.location, '.cull.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0, None
+
+            copies, total = [], 0
+            for directory, _, file_names in os.walk(self.location):
+                for file_name in file_names:
+                    if file_name.startswith('.'):
+                        continue
+                    path = os.path.join(directory, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    copies.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_size:
+                return 0, total
+
+            copies.sort()
+            evicted = 0
+            target = self.max_size * (1 - self.CULL_FRACTION)
+            for _, size, path in copies:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.evictions += evicted
+        self.flush_stats()
+        return evicted, total
+
+    def _save(self, name, content):
+        return self.backend.save(name, content)
+
+    def delete(self, name):
+        self.backend.delete(name)
+        if self.caches(name):
+            try:
+                os.remove(self.cache_path(name))
+            except FileNotFoundError:
+                pass
+
+    # the rest is up to the backend
+
+    def get_valid_name(self, name):
+        return self.backend.get_valid_name(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
@@ -25,15 +25,24 @@ def short_fmt(value, format="d M Y"):
 @register.filter
 def index_cell(inst, col):
     if col == 'wc':
-        return '%d words' % inst.length if inst.length else '(unknown)'
+        return length_fmt(inst.length, inst.length_unit) or '(unknown)'
     elif col == 'cdate':
         return inst.date_published.strftime('%d %b %Y') if inst.date_published else ''
     elif col == 'mdate':
         return inst.date_updated.strftime('%d %b %Y') if inst.date_updated else ''
+    elif col == 'authors':
+        return ', '.join(a['name'] for a in inst.author_dicts)
     else:
         return '—'
 
 
+@register.filter
+def length_fmt(num, unit='w'):
+    if not num:
+        return ''
+    return '{:d} {}'.format(num, 'chars' if unit == 'c' else 'words')
+
+
 @register.filter
 def story_count(num):
     return repr(num) + (' story' if num == 1 else ' stories')
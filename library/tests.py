@@ -1 +1,984 @@
-# Create your tests here.
+import base64
+import datetime as dt
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.core.paginator import InvalidPage
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from library.models import ActivityEvent, Author, Blob, CatalogCount, Code, Installment, List, ListEntry, Saga, \
+    SagaEntry, SagaStats, Slant, Story, StoryStats, Theme, WeeklyDigest
+from library.pagination import KeysetPaginator
+from library.search import get_backend as get_search_backend
+from library.storage import LocalCacheStorage
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='storkive-tests-')
+
+
+def setUpModule():
+    # the default cache is on disk, and outlives the test database
+    cache.clear()
+
+
+def tearDownModule():
+    # every class shares it
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def _large_tables():
+    return {
+        Installment._meta.db_table,
+        Installment.authors.through._meta.db_table,
+        ListEntry._meta.db_table,
+        Story._meta.db_table,
+        Story.authors.through._meta.db_table,
+        Story.codes.through._meta.db_table,
+        StoryStats._meta.db_table,
+    }
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryPlanTests(TestCase):
+    """Run EXPLAIN over everything the hot views execute and complain about
+    sequential scans on the big tables. For SQLite that includes walking a
+    whole index (SCAN ... USING INDEX); only a SEARCH seeks into one.
+
+    PostgreSQL happily seq scans tables this small, so it is told not to; if
+    it still does, there is no index it could have used instead.
+    """
+
+    STORY_COUNT = 40
+
+    re_sqlite_scan = re.compile(r'\bSCAN (?:TABLE )?(\w+)')
+    re_pg_scan = re.compile(r'\bSeq Scan on (\w+)')
+
+    @classmethod
+    def setUpTestData(cls):
+        code = Code.objects.create(abbr='tst', name='Test')
+        slant = Slant.objects.create(abbr='t', description='test', affinity=code, display_order=1)
+        author = Author(name='Test Author')
+        author.save()
+        saga = Saga(name='Test Saga', synopsis='')
+        saga.save()
+        user = get_user_model().objects.create_user('reader', password='reader')
+        user_list = List.objects.create(user=user, name='Test List')
+
+        published_on = dt.date(2020, 1, 1)
+        for n in range(cls.STORY_COUNT):
+            story = Story(title='{} Story {:d}'.format(chr(ord('A') + n % 26), n),
+                          slug='story-{:d}'.format(n),
+                          slant=slant,
+                          published_on=published_on)
+            story.save()
+            story.authors.add(author)
+            story.codes.add(code)
+            for ordinal in range(1, 4):
+                inst = Installment(story=story,
+                                   ordinal=ordinal,
+                                   title='Part {:d}'.format(ordinal),
+                                   published_on=published_on + dt.timedelta(days=ordinal))
+                inst.file_as_html = '<p>{} {:d}</p>'.format(story.title, ordinal)
+                inst.save()
+                inst.authors.add(author)
+            if n < 3:
+                SagaEntry.objects.create(saga=saga, story=story, order=n + 1)
+                story.list_entries.create(list=user_list)
+
+        cls.saga = saga
+        cls.user = user
+        cls.user_list = user_list
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def seq_scans(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+                pattern = self.re_pg_scan
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                pattern = self.re_sqlite_scan
+            plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+        return {t for t in pattern.findall(plan) if t in _large_tables()}, plan
+
+    def assertNoSeqScans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            scans, plan = self.seq_scans(sql)
+            self.assertFalse(scans, 'Sequential scan of {} for {}:\n{}\n{}'.format(
+                ', '.join(sorted(scans)), url, sql, plan))
+
+    def test_index(self):
+        self.assertNoSeqScans('/')
+
+    def test_whats_new(self):
+        self.assertNoSeqScans('/WhatsNew.html')
+
+    def test_letter_page(self):
+        self.assertNoSeqScans('/Titles/b.html')
+
+    def test_author_page(self):
+        self.assertNoSeqScans('/Authors/Test-Author.html')
+
+    def test_code_page(self):
+        self.assertNoSeqScans('/Codes/tst.html')
+
+    def test_saga_page(self):
+        self.assertNoSeqScans('/Sagas/{}/'.format(self.saga.slug))
+
+    def test_story_page(self):
+        self.assertNoSeqScans('/story-1/index.html')
+
+    def test_saga_story_page(self):
+        self.assertNoSeqScans('/Sagas/{}/story-1/index.html'.format(self.saga.slug))
+
+    def test_installment_page(self):
+        self.assertNoSeqScans('/story-1/2.html')
+
+    def test_list_page(self):
+        self.assertNoSeqScans('/Lists/{}/'.format(self.user_list.slug))
+
+
+class KeysetPaginatorTests(TestCase):
+    KEYS = ('sort_title', 'published_on', 'pk')
+
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(7):
+            Story(title='Same Title' if n % 2 else 'Title {:d}'.format(n),
+                  slug='story-{:d}'.format(n),
+                  published_on=None if n % 3 else dt.date(2020, 1, n + 1)).save()
+
+    def expected(self):
+        return sorted(Story.objects.all(),
+                      key=lambda s: (s.sort_title, s.published_on is None, s.published_on or dt.date.min, s.pk))
+
+    def test_walk_forward_and_back(self):
+        paginator = KeysetPaginator(Story.objects.all(), self.KEYS, 2)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+        self.assertFalse(pages[0].has_previous())
+        self.assertEqual([s for p in pages for s in p], self.expected())
+
+        for i in range(len(pages) - 1, 0, -1):
+            previous = paginator.page(before=pages[i].previous_cursor)
+            self.assertEqual(list(previous), list(pages[i - 1]))
+
+    def test_bad_cursors(self):
+        paginator = KeysetPaginator(Story.objects.all(), self.KEYS, 2)
+        for values in (['x', {'$gt': ''}, 1], ['x', '2020-01-01', 'one'], ['x', None]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            with self.assertRaises(InvalidPage):
+                paginator.page(after=cursor)
+        self.assertEqual(self.client.get('/Titles/s.html', {'after': 'e30'}).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BlobTests(TestCase):
+
+    def test_identical_installments_share_a_blob(self):
+        insts = []
+        for n in range(2):
+            story = Story(title='Twin {:d}'.format(n), slug='twin-{:d}'.format(n))
+            story.save()
+            inst = Installment(story=story, ordinal=1, title='One', published_on=dt.date(2020, 1, 1))
+            inst.file_as_html = '<p>Same.</p>'
+            inst.save()
+            insts.append(inst)
+        self.assertEqual(insts[0].file.name, insts[1].file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        insts[1].file_as_html = '<p>Different.</p>'
+        insts[1].save()
+        insts[0].delete()
+        self.assertEqual(sorted(Blob.objects.values_list('ref_count', flat=True)), [0, 1])
+
+    def test_body_is_served_precompressed_and_offloaded(self):
+        story = Story(title='Squeezed', slug='squeezed')
+        story.save()
+        inst = Installment(story=story, ordinal=1, title='One', published_on=dt.date(2020, 1, 1))
+        inst.file_as_html = '<p>Over and over.</p>' * 100
+        inst.save()
+        self.client.force_login(get_user_model().objects.create_user('reader'))
+
+        response = self.client.get('/squeezed/1.body.html', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding, Cookie')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(gzip.decompress(body), inst.file_as_html.encode('utf-8'))
+
+        response = self.client.get('/squeezed/1.body.html', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), inst.file_as_html.encode('utf-8'))
+
+        response = self.client.get('/squeezed/1.body.html', HTTP_RANGE='bytes=3-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 3-10/{:d}'.format(len(inst.file_as_html)))
+        self.assertEqual(b''.join(response.streaming_content), b'Over and')
+        self.assertEqual(self.client.get('/squeezed/1.body.html', HTTP_RANGE='bytes=9999-').status_code, 416)
+
+        with self.settings(SENDFILE_HEADER='X-Sendfile'):
+            response = self.client.get('/squeezed/1.body.html')
+        self.assertEqual(response['X-Sendfile'], os.path.join(MEDIA_ROOT, inst.file.name))
+
+
+def _installment(story, ordinal, published_on, **kwargs):
+    inst = Installment(story=story, ordinal=ordinal, title='Part {:d}'.format(ordinal),
+                       published_on=published_on, **kwargs)
+    inst.file_as_html = '<p>{} {:d} {}</p>'.format(story.slug, ordinal, published_on)
+    inst.save()
+    return inst
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class StoryStatsTests(TestCase):
+    """Change things one row at a time, as the admin does, and check the
+    rows against StoryStats.refresh() run from scratch."""
+
+    def assertStatsRefreshed(self):
+        def snapshot():
+            # authors and codes are lists, so no sets
+            return list(StoryStats.objects.order_by('pk').values_list(
+                'story_id', 'installment_count', 'missing_count', 'first_ordinal', 'last_ordinal',
+                'word_count', 'authors', 'codes'))
+        kept = snapshot()
+        StoryStats.refresh(Story.objects.values_list('pk', flat=True))
+        self.assertEqual(kept, snapshot())
+
+    def test_story_stats(self):
+        code = Code.objects.create(abbr='ins', name='Insects')
+        apis, vespa = Author(name='Apis'), Author(name='Vespa')
+        apis.save()
+        vespa.save()
+        bees, wasps, ants = (Story(title=title, slug=title.lower()) for title in ('Bees', 'Wasps', 'Ants'))
+        for story in (bees, wasps, ants):
+            story.save()
+            story.authors.add(apis)
+        _installment(bees, 1, dt.date(2020, 1, 1))
+        two = _installment(bees, 2, dt.date(2020, 1, 8))
+        _installment(wasps, 1, dt.date(2020, 1, 2))
+        self.assertStatsRefreshed()
+        self.assertEqual(StoryStats.objects.get(story=bees).last_ordinal, 2)
+
+        # backdated, and then gone
+        two.published_on = dt.date(2019, 12, 1)
+        two.save()
+        self.assertStatsRefreshed()
+        two.delete()
+        self.assertStatsRefreshed()
+        self.assertEqual(StoryStats.objects.get(story=bees).last_ordinal, 1)
+
+        # re-tagged
+        bees.codes.add(code)
+        vespa.stories.add(wasps, bees)
+        wasps.authors.remove(apis)
+        self.assertStatsRefreshed()
+        apis.name = 'Apis mellifera'
+        apis.save()
+        self.assertStatsRefreshed()
+        apis.delete()
+        code.delete()
+        self.assertStatsRefreshed()
+        self.assertEqual(StoryStats.objects.get(story=ants).authors, [])
+
+        wasps.delete()
+        self.assertStatsRefreshed()
+
+    def test_length_follows_unit(self):
+        story = Story(title='Bees', slug='bees')
+        story.save()
+        inst = _installment(story, 1, dt.date(2020, 1, 1))
+        self.assertEqual(StoryStats.objects.get(story=story).word_count, 3)
+
+        # the same file, counted again in the new unit
+        inst = Installment.objects.get(pk=inst.pk)
+        inst.length_unit = Installment.LU_CHARS
+        inst.file_as_html = inst.file_as_html
+        inst.save()
+        self.assertEqual(inst.length, len('bees12020-01-01'))
+        self.assertEqual(StoryStats.objects.get(story=story).word_count, 0)
+
+        # without the file at hand
+        inst = Installment.objects.get(pk=inst.pk)
+        inst.length_unit = Installment.LU_WORDS
+        inst.save()
+        self.assertEqual(Installment.objects.get(pk=inst.pk).length, 3)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SagaStatsTests(TestCase):
+    """See StoryStatsTests."""
+
+    def assertSagasRefreshed(self):
+        def snapshot():
+            return (list(SagaStats.objects.order_by('pk').values_list(
+                        'saga_id', 'entry_count', 'updated_on', 'authors', 'codes')),
+                    list(SagaEntry.objects.order_by('pk').values_list('story_id', 'prev_story_id', 'next_story_id')))
+        kept = snapshot()
+        saga_ids = Saga.objects.values_list('pk', flat=True)
+        SagaStats.refresh(saga_ids)
+        SagaEntry.relink(saga_ids)
+        self.assertEqual(kept, snapshot())
+
+    def test_saga_stats(self):
+        apis = Author(name='Apis')
+        apis.save()
+        bees, wasps, ants = (Story(title=title, slug=title.lower()) for title in ('Bees', 'Wasps', 'Ants'))
+        for story in (bees, wasps, ants):
+            story.save()
+        _installment(bees, 1, dt.date(2020, 1, 1))
+        two = _installment(bees, 2, dt.date(2020, 1, 8))
+        _installment(wasps, 1, dt.date(2020, 1, 2))
+
+        saga = Saga(name='Hives', synopsis='Buzzing.')
+        saga.save()
+        for order, story in enumerate((wasps, bees, ants)):
+            SagaEntry.objects.create(saga=saga, story=story, order=order)
+        self.assertSagasRefreshed()
+        self.assertEqual(SagaEntry.objects.get(story=bees).prev_story_id, wasps.pk)
+
+        two.published_on = dt.date(2019, 12, 1)
+        two.save()
+        self.assertSagasRefreshed()
+        self.assertEqual(SagaStats.objects.get(saga=saga).updated_on, dt.date(2020, 1, 2))
+        two.delete()
+        self.assertSagasRefreshed()
+
+        apis.stories.add(bees)
+        self.assertSagasRefreshed()
+        apis.delete()
+        self.assertSagasRefreshed()
+        self.assertEqual(SagaStats.objects.get(saga=saga).authors, [])
+
+        # taken out of the middle, and off the end
+        SagaEntry.objects.get(story=bees).delete()
+        self.assertSagasRefreshed()
+        self.assertEqual(SagaEntry.objects.get(story=ants).prev_story_id, wasps.pk)
+        ants.delete()
+        self.assertSagasRefreshed()
+        self.assertEqual(SagaEntry.objects.get(story=wasps).next_story_id, None)
+        self.assertEqual(SagaStats.objects.get(saga=saga).entry_count, 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ActivityEventTests(TestCase):
+    """See StoryStatsTests."""
+
+    def setUp(self):
+        # anonymous pages are cached, and stamps only move on commit
+        cache.clear()
+
+    def assertActivityReplayed(self):
+        rows = Installment.objects \
+            .order_by('story_id', 'published_on', 'ordinal') \
+            .values_list('pk', 'story_id', 'ordinal', 'published_on')
+        self.assertEqual(set(ActivityEvent.objects.values_list('installment_id', 'kind', 'date')),
+                         {(e.installment_id, e.kind, e.date) for e in ActivityEvent.replay(rows)})
+
+    def test_activity(self):
+        story = Story(title='Bees', slug='bees')
+        story.save()
+        _installment(story, 1, dt.date(2020, 1, 10))
+        _installment(story, 2, dt.date(2020, 1, 17))
+        _installment(story, 2, dt.date(2020, 1, 20))
+
+        def kinds():
+            return list(ActivityEvent.objects.order_by('date').values_list('ordinal', 'kind'))
+        self.assertEqual(kinds(), [(1, 's'), (2, 'c'), (2, 'r')])
+
+        # backdated, a prologue makes everything after it chapters
+        prologue = _installment(story, 0, dt.date(2020, 1, 3))
+        self.assertEqual(kinds(), [(0, 's'), (1, 'c'), (2, 'c'), (2, 'r')])
+        self.assertActivityReplayed()
+        prologue.delete()
+        self.assertEqual(kinds(), [(1, 's'), (2, 'c'), (2, 'r')])
+        self.assertActivityReplayed()
+
+        # the events before a change are kept as they were
+        before = list(ActivityEvent.objects.order_by('date').values_list('pk', 'recorded_at'))
+        three = _installment(story, 3, dt.date(2020, 1, 24))
+        self.assertEqual(list(ActivityEvent.objects.order_by('date').values_list('pk', 'recorded_at'))[:3], before)
+        # and moving one later replays from where it was
+        three.published_on = dt.date(2020, 1, 31)
+        three.ordinal = 2
+        three.save()
+        self.assertEqual(kinds(), [(1, 's'), (2, 'c'), (2, 'r'), (2, 'r')])
+        self.assertActivityReplayed()
+        three.published_on = dt.date(2020, 1, 15)
+        three.save()
+        self.assertEqual(kinds(), [(1, 's'), (2, 'c'), (2, 'r'), (2, 'r')])
+        self.assertActivityReplayed()
+        three.delete()
+
+        # two days a page, going back
+        self.assertContains(self.client.get('/WhatsNew.html'), '?before=2020-01-17')
+        response = self.client.get('/WhatsNew.html', {'before': '2020-01-17'})
+        self.assertContains(response, 'Bees')
+        self.assertNotContains(response, '?before=')
+        self.assertEqual(self.client.get('/WhatsNew.html', {'before': 'then'}).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class WeeklyDigestTests(TestCase):
+    """See StoryStatsTests."""
+
+    def setUp(self):
+        # anonymous pages are cached, and stamps only move on commit
+        cache.clear()
+
+    def assertDigestComputed(self):
+        rows = Installment.objects \
+            .order_by('story_id', 'published_on', 'ordinal') \
+            .values_list('story_id', 'ordinal', 'published_on')
+        fields = ('year', 'week', 'story_id', 'is_update', 'up_count', 'published_on')
+        self.assertEqual(set(WeeklyDigest.objects.values_list(*fields)),
+                         {tuple(getattr(d, f) for f in fields) for d in WeeklyDigest.compute(rows)})
+
+    def test_weekly_digest(self):
+        story = Story(title='Bees', slug='bees')
+        story.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            _installment(story, 1, dt.date(2019, 3, 4))
+            _installment(story, 2, dt.date(2019, 3, 5))
+        self.assertDigestComputed()
+
+        response = self.client.get('/WhatWasNew2019.html')
+        self.assertContains(response, 'Bees')
+        self.assertFalse(response.has_header('Cache-Control'))
+        self.assertNotContains(self.client.get('/WhatWasNew2019.html'), 'What Was New in 2018')
+
+        # past years change too
+        with self.captureOnCommitCallbacks(execute=True):
+            _installment(story, 0, dt.date(2018, 12, 3))
+        self.assertDigestComputed()
+        self.assertContains(self.client.get('/WhatWasNew2019.html'), 'What Was New in 2018')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            story.title = 'Wasps'
+            story.save()
+        self.assertContains(self.client.get('/WhatWasNew2019.html'), 'Wasps')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            story.delete()
+        self.assertFalse(WeeklyDigest.objects.exists())
+        self.assertEqual(self.client.get('/WhatWasNew2019.html').status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CatalogCountTests(TestCase):
+    """See StoryStatsTests."""
+
+    def assertCountsTallied(self):
+        for kind, name in CatalogCount.KIND_CHOICES:
+            # tally() always has a total, adjust() drops it at zero
+            self.assertEqual({k: n for k, n in CatalogCount.counts(kind).items() if n},
+                             {k: n for k, n in CatalogCount.tally(kind).items() if n}, name)
+
+    def test_catalog_counts(self):
+        code = Code.objects.create(abbr='ins', name='Insects')
+        slant = Slant.objects.create(abbr='b', description='buzzing', affinity=code, display_order=1)
+        author = Author(name='Apis')
+        author.save()
+        bees, wasps = Story(title='Bees', slug='bees', slant=slant), Story(title='Wasps', slug='wasps')
+        for story in (bees, wasps):
+            story.save()
+            story.authors.add(author)
+            story.codes.add(code)
+        one = _installment(bees, 1, dt.date(2020, 1, 1))
+        _installment(bees, 2, dt.date(2020, 1, 2))
+        _installment(wasps, 1, dt.date(2020, 1, 3))
+        self.assertCountsTallied()
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_TOTAL), {'': 2})
+
+        # only losing the last valid installment counts a story out
+        one.delete()
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_TOTAL), {'': 2})
+        bees.installments.update(file='')
+        bees.installments.get().save()
+        self.assertCountsTallied()
+
+        wasps.title = 'Yellowjackets'
+        wasps.slant = slant
+        wasps.removed_at = dt.datetime(2020, 2, 1, tzinfo=dt.timezone.utc)
+        wasps.save()
+        wasps.codes.clear()
+        author.stories.remove(bees)
+        author.stories.remove(bees)
+        code.stories.add(bees)
+        self.assertCountsTallied()
+
+        author.delete()
+        self.assertCountsTallied()
+        wasps.removed_at = None
+        wasps.save()
+        self.assertCountsTallied()
+        wasps.delete()
+        self.assertCountsTallied()
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_LETTER), {'B': 1})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CommandTests(TestCase):
+    """Run the bulk commands over a small tree of files, and check they
+    leave behind what saving the rows one at a time would have."""
+
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(dir=MEDIA_ROOT)
+
+    def write(self, name, content):
+        path = os.path.join(self.tree, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_import_installments(self):
+        self.write('bees/1.html', '<p>The queen sleeps.</p>')
+        self.write('bees/2.html', '<p>Same old hive.</p>')
+        self.write('bees/2b.html', '<p>The queen wakes.</p>')
+        self.write('wasps/1.html', '<p>Same old hive.</p>')
+        records = [
+            {'story': 'bees', 'ordinal': 1, 'title': 'One', 'published_on': '2020-01-01',
+             'file': 'bees/1.html', 'story_title': 'Bees', 'authors': ['Apis'], 'codes': ['ins']},
+            {'story': 'wasps', 'ordinal': 1, 'title': 'One', 'published_on': '2020-01-02',
+             'file': 'wasps/1.html', 'story_title': 'The Wasps', 'authors': ['Apis', 'Vespa']},
+            {'story': 'bees', 'ordinal': 2, 'title': 'Two', 'published_on': '2020-01-08',
+             'file': 'bees/2.html', 'authors': ['Apis']},
+            {'story': 'bees', 'ordinal': 2, 'title': 'Two', 'published_on': '2020-01-09',
+             'file': 'bees/2b.html', 'authors': ['Apis']},
+        ]
+        self.write('manifest.jsonl', ''.join(json.dumps(r) + '\n' for r in records))
+
+        # batches of two, so the second one finds bees already there
+        out = StringIO()
+        call_command('import_installments', self.tree, batch_size=2, workers=1, uploads=1, stdout=out)
+        self.assertIn('Imported 4 of 4 installments.', out.getvalue())
+        self.assertEqual(set(Story.objects.values_list('slug', 'sort_letter')), {('bees', 'B'), ('wasps', 'W')})
+        self.assertEqual(list(Installment.objects.filter(story__slug='bees', is_current=True)
+                              .order_by('ordinal').values_list('published_on', flat=True)),
+                         [dt.date(2020, 1, 1), dt.date(2020, 1, 9)])
+        self.assertEqual(sorted(Blob.objects.values_list('ref_count', flat=True)), [1, 1, 2])
+
+        bees, wasps = Story.objects.get(slug='bees'), Story.objects.get(slug='wasps')
+        apis, vespa = Author.objects.get(slug='Apis'), Author.objects.get(slug='Vespa')
+        self.assertEqual(list(StoryStats.objects.order_by('story__slug').values_list(
+                             'installment_count', 'first_ordinal', 'last_ordinal', 'word_count', 'codes')),
+                         [(2, 1, 2, 6, ['ins']), (1, 1, 1, 3, [])])
+        self.assertEqual([a['slug'] for a in wasps.stats.authors], ['Apis', 'Vespa'])
+        self.assertEqual(list(ActivityEvent.objects.order_by('date').values_list('story__slug', 'ordinal', 'kind')),
+                         [('bees', 1, 's'), ('wasps', 1, 's'), ('bees', 2, 'c'), ('bees', 2, 'r')])
+        # the revision is left out
+        self.assertEqual(list(WeeklyDigest.objects.order_by('week', 'story__slug').values_list(
+                             'week', 'story__slug', 'is_update')),
+                         [(1, 'bees', False), (1, 'wasps', False), (2, 'bees', True)])
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_TOTAL), {'': 2})
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_LETTER), {'B': 1, 'W': 1})
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_AUTHOR), {str(apis.pk): 2, str(vespa.pk): 1})
+        self.assertEqual(CatalogCount.counts(CatalogCount.KIND_CODE), {'ins': 1})
+        # only the current version of bees 2 is searched
+        search = get_search_backend()
+        self.assertEqual(search.search('wakes'), [bees.pk])
+        self.assertEqual(search.search('hive'), [wasps.pk])
+        self.assertEqual(search.search('wasps'), [wasps.pk])
+
+        # again, nothing is left to do
+        out = StringIO()
+        call_command('import_installments', self.tree, workers=1, stdout=out)
+        self.assertIn('Imported 0 of 4 installments.', out.getvalue())
+        self.assertEqual(Installment.objects.count(), 4)
+
+    def test_fold_blobs(self):
+        story = Story(title='Bees', slug='bees')
+        story.save()
+        for ordinal, text in ((1, '<p>Same.</p>'), (2, '<p>Same.</p>'), (3, None)):
+            name = 'stories/B/bees/bees.{:03d}.html'.format(ordinal)
+            if text:
+                name = default_storage.save(name, ContentFile(text.encode('utf-8')))
+            Installment(story=story, ordinal=ordinal, title='Part', published_on=dt.date(2020, 1, 1),
+                        file=name).save()
+
+        out = StringIO()
+        call_command('fold_blobs', workers=1, batch_size=1, stdout=out)
+        self.assertIn('Folded 2 installments into blobs, 1 files missing.', out.getvalue())
+        blob = Blob.objects.get()
+        self.assertEqual((blob.ref_count, blob.size), (2, len('<p>Same.</p>')))
+        self.assertEqual(set(Installment.objects.exclude(ordinal=3).values_list('file', flat=True)),
+                         {blob.file.name})
+        self.assertTrue(default_storage.exists(blob.file.name + '.gz'))
+
+        # only the missing one is tried again
+        out = StringIO()
+        call_command('fold_blobs', workers=1, stdout=out)
+        self.assertIn('Folded 0 installments into blobs, 1 files missing.', out.getvalue())
+
+    def test_count_lengths(self):
+        bees, wasps = Story(title='Bees', slug='bees'), Story(title='Wasps', slug='wasps')
+        for n, (story, unit, text) in enumerate([(bees, Installment.LU_WORDS, '<p>The queen sleeps.</p>'),
+                                                 (bees, Installment.LU_CHARS, '<p>The queen wakes.</p>'),
+                                                 (wasps, Installment.LU_WORDS, '<p>The queen sleeps.</p>')]):
+            story.save()
+            inst = Installment(story=story, ordinal=n + 1, title='Part', published_on=dt.date(2020, 1, 1),
+                               length_unit=unit)
+            inst.file_as_html = text
+            inst.save()
+        saved = dict(Installment.objects.values_list('pk', 'length'))
+        stats = dict(StoryStats.objects.values_list('story_id', 'word_count'))
+        self.assertEqual(stats, {bees.pk: 3, wasps.pk: 3})
+
+        # as if imported before lengths were counted
+        Installment.objects.update(length=0)
+        StoryStats.refresh([bees.pk, wasps.pk])
+        out = StringIO()
+        call_command('count_lengths', workers=1, batch_size=1, stdout=out)
+        self.assertIn('Counted 3 installments.', out.getvalue())
+        self.assertEqual(dict(Installment.objects.values_list('pk', 'length')), saved)
+        self.assertEqual(dict(StoryStats.objects.values_list('story_id', 'word_count')), stats)
+
+        # only --all recounts what has a length already
+        Installment.objects.update(length=F('length') + 1)
+        StoryStats.refresh([bees.pk, wasps.pk])
+        call_command('count_lengths', workers=1, stdout=StringIO())
+        self.assertNotEqual(dict(Installment.objects.values_list('pk', 'length')), saved)
+        call_command('count_lengths', recount=True, workers=1, stdout=StringIO())
+        self.assertEqual(dict(Installment.objects.values_list('pk', 'length')), saved)
+
+    @mock.patch('library.views.STORIES_PER_PAGE', 1)
+    def test_export_static(self):
+        cache.clear()
+        out_dir = os.path.join(self.tree, 'site')
+        code = Code.objects.create(abbr='ins', name='Insects')
+        author = Author(name='Apis')
+        author.save()
+        ants, bees, wasps = (Story(title=title, slug=title.lower()) for title in ('Ants', 'Bees', 'Wasps'))
+        for day, story in enumerate((ants, bees, wasps), 1):
+            story.save()
+            story.authors.add(author)
+            story.codes.add(code)
+            inst = Installment(story=story, ordinal=1, title='One', published_on=dt.date(2020, 1, day))
+            inst.file_as_html = '<p>{}</p>'.format(story.title)
+            inst.save()
+
+        def export():
+            out = StringIO()
+            call_command('export_static', out_dir, workers=1, stdout=out)
+            return re.search(r'Rendered (\d+) of (\d+) pages, removed (\d+), (\d+) failed', out.getvalue()) \
+                .groups()
+
+        def page(url):
+            with open(os.path.join(out_dir, url.lstrip('/') or 'index.html'), encoding='utf-8') as f:
+                return f.read()
+
+        def walk(url):
+            """The pages of a listing, by following the links between the files."""
+            pages = [page(url)]
+            while True:
+                link = re.search(r'<nav class="pages">[^<]*(?:<a class="prev[^>]*>[^<]*</a>\s*)?'
+                                 r'<a class="next arrow" href="([^"?]+)"', pages[-1])
+                if not link:
+                    return pages
+                later = os.path.join(os.path.dirname(url), link.group(1))
+                pages.append(page(later))
+                # what's new only goes back
+                previous = re.search(r'<a class="prev arrow" href="([^"]+)"', pages[-1])
+                if previous:
+                    self.assertEqual(previous.group(1), os.path.basename(url))
+                url = later
+
+        rendered, total, removed, failed = export()
+        self.assertEqual((rendered, removed, failed), (total, '0', '0'))
+        self.assertIn('Wasps', page(reverse('story', args=['wasps'])))
+        self.assertTrue(os.path.exists(os.path.join(out_dir, 'index.html')))
+        # every page of a listing, not just the first
+        self.assertEqual([re.findall(r'<cite>(\w+)</cite>', html) for html in walk(reverse('code', args=['ins']))],
+                         [['Ants'], ['Bees'], ['Wasps']])
+        self.assertEqual(len(walk(reverse('whats_new'))), 2)
+        self.assertNotIn('?before=', ''.join(walk(reverse('whats_new'))))
+        self.assertEqual(export(), ('0', total, '0', '0'))
+
+        # only the pages showing the story are rendered again
+        with self.captureOnCommitCallbacks(execute=True):
+            wasps.title = 'Yellowjackets'
+            wasps.save()
+        rendered, _, _, _ = export()
+        self.assertLess(0, int(rendered))
+        self.assertLess(int(rendered), int(total))
+        self.assertIn('Yellowjackets', page(reverse('story', args=['wasps'])))
+        self.assertIn('Yellowjackets', walk(reverse('code', args=['ins']))[-1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            wasps.delete()
+        # its page and its letter's, and the last pages of the code, the author and what's new
+        _, _, removed, failed = export()
+        self.assertEqual((removed, failed), ('5', '0'))
+        for url in (reverse('story', args=['wasps']), reverse('letter', args=['Y'])):
+            self.assertFalse(os.path.exists(os.path.join(out_dir, url.lstrip('/'))))
+        self.assertEqual(len(walk(reverse('code', args=['ins']))), 2)
+        self.assertEqual(len(walk(reverse('author', args=[author.slug]))), 2)
+        self.assertEqual(len(walk(reverse('whats_new'))), 1)
+
+
+class SlowStorage(FileSystemStorage):
+    """Stands in for a remote storage."""
+    opened = 0
+
+    def _open(self, name, mode='rb'):
+        self.opened += 1
+        time.sleep(0.01)
+        return super()._open(name, mode)
+
+
+class LocalCacheStorageTests(SimpleTestCase):
+
+    def setUp(self):
+        self.backend = SlowStorage(location=tempfile.mkdtemp(dir=MEDIA_ROOT))
+        self.storage = LocalCacheStorage(self.backend, location=tempfile.mkdtemp(dir=MEDIA_ROOT),
+                                         max_size=2500)
+        self.names = [self.storage.save('blobs/{:d}.html'.format(n), ContentFile(bytes([65 + n]) * 1000))
+                      for n in range(3)]
+
+    def test_reads_through_and_evicts(self):
+        for n in (0, 0, 1):
+            with self.storage.open(self.names[n]) as f:
+                self.assertEqual(f.read(), bytes([65 + n]) * 1000)
+        self.assertEqual((self.storage.hits, self.storage.misses, self.backend.opened), (1, 2, 2))
+
+        # reading never evicts; culling takes the least recently read copy
+        os.utime(self.storage.cache_path(self.names[0]), (0, 0))
+        self.storage.open(self.names[2]).close()
+        self.assertTrue(os.path.exists(self.storage.cache_path(self.names[0])))
+        self.assertEqual(self.storage.cull(), (1, 2000))
+        self.assertFalse(os.path.exists(self.storage.cache_path(self.names[0])))
+        self.assertTrue(os.path.exists(self.storage.cache_path(self.names[1])))
+
+        # counted for every process
+        other = LocalCacheStorage(self.backend, location=self.storage.location)
+        other.open(self.names[1]).close()
+        other.flush_stats()
+        self.assertEqual(self.storage.stats(), {'hits': 2, 'misses': 3, 'evictions': 1})
+
+        self.storage.delete(self.names[1])
+        self.assertFalse(os.path.exists(self.storage.cache_path(self.names[1])))
+
+    def test_cull_media_cache(self):
+        for name in self.names:
+            self.storage.open(name).close()
+        with self.settings(DEFAULT_FILE_STORAGE='library.storage.LocalCacheStorage',
+                           MEDIA_CACHE={'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                                        'LOCATION': self.storage.location, 'MAX_SIZE': 2500}):
+            out = StringIO()
+            call_command('cull_media_cache', stdout=out)
+        self.assertIn('Evicted 1 copies, 2000 of 2500 bytes in use.', out.getvalue())
+        self.assertIn('1 evictions.', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        story = Story(title='Bees', slug='bees', synopsis='A hive of activity.')
+        story.save()
+        for n, text in enumerate(['<p>The queen <i>sleeps</i>.</p>', '<p>The queen wakes.</p>']):
+            inst = Installment(story=story, ordinal=1, title='One', published_on=dt.date(2020, 1, 1 + n),
+                               is_current=bool(n))
+            inst.file_as_html = text
+            inst.save()
+
+    def test_search(self):
+        response = self.client.get('/Search.html', {'q': 'hive'})
+        self.assertContains(response, 'A <mark>hive</mark> of activity.')
+
+        response = self.client.get('/Search.html', {'q': 'queen wakes'})
+        self.assertContains(response, 'The <mark>queen</mark> <mark>wakes</mark>.')
+        # only the current version is searched
+        self.assertContains(self.client.get('/Search.html', {'q': 'sleeps'}), 'Nothing found.')
+
+
+@override_settings(STATIC_ROOT=MEDIA_ROOT)
+class SiteGlobalsTests(TestCase):
+
+    def test_theme_change_reaches_cached_globals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Theme(name='First', css='', active=True).save()
+        self.client.get('/')
+        with self.assertNumQueries(1):
+            self.client.get('/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            theme = Theme(name='Second', css='', active=True)
+            theme.save()
+        self.assertContains(self.client.get('/'), theme.css_path)
+
+    def test_theme_css_is_minified_around_strings(self):
+        theme = Theme(name='Quoted', css='q::before {\n  content: " ;  " ;  /* spaced */\n}\n'
+                                         'body { background: url( a.png ) ; font-family: "A  B" , serif; }')
+        theme.save()
+        with staticfiles_storage.open(theme.css_path) as f:
+            self.assertEqual(f.read().decode(),
+                             'q::before{content:" ;  "}body{background:url( a.png );font-family:"A  B",serif}')
+
+    def test_theme_css_is_only_compiled_when_changed(self):
+        theme = Theme(name='Plain', css='body { color: black; }')
+        theme.save()
+        compiled = theme.css_path
+        staticfiles_storage.delete(compiled)
+
+        theme = Theme.objects.get(pk=theme.pk)
+        theme.name = 'Plainer'
+        theme.save()
+        self.assertEqual(theme.css_path, compiled)
+        self.assertFalse(staticfiles_storage.exists(compiled))
+
+        theme.css = 'body { color: white; }'
+        theme.save()
+        self.assertNotEqual(theme.css_path, compiled)
+        self.assertTrue(staticfiles_storage.exists(theme.css_path + '.gz'))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(dir=MEDIA_ROOT),
+    },
+})
+class CacheTaggedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        code = Code.objects.create(abbr='tst', name='Test')
+        cls.story = Story(title='Bees', slug='bees')
+        cls.story.save()
+        cls.story.codes.add(code)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, url, text):
+        self.assertContains(self.client.get(url), text)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), text)
+
+    def test_story_change_invalidates_listings(self):
+        self.assertCached('/Titles/b.html', 'Bees')
+        self.assertCached('/Codes/tst.html', 'Bees')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.story.title = 'Bumblebees'
+            self.story.save()
+        self.assertCached('/Titles/b.html', 'Bumblebees')
+        self.assertCached('/Codes/tst.html', 'Bumblebees')
+
+    def test_new_story_invalidates_letter(self):
+        self.assertCached('/Titles/b.html', 'Bees')
+        with self.captureOnCommitCallbacks(execute=True):
+            Story(title='Beetles', slug='beetles').save()
+        self.assertCached('/Titles/b.html', 'Beetles')
+
+    @mock.patch('library.views.STORIES_PER_PAGE', 1)
+    def test_deleted_story_invalidates_tag_listings(self):
+        beetles = Story(title='Beetles', slug='beetles')
+        beetles.save()
+        beetles.codes.add(self.story.codes.get())
+        self.assertCached('/Codes/tst.html', 'Next')
+        with self.captureOnCommitCallbacks(execute=True):
+            beetles.delete()
+        self.assertNotContains(self.client.get('/Codes/tst.html'), 'Next')
+
+    def test_conditional_get(self):
+        for url, queries in (('/Titles/b.html', 0), ('/bees/index.html', 1)):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.story.synopsis = 'Buzz.'
+                self.story.save()
+            self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_list_toggle_refreshes_memberships(self):
+        user = get_user_model().objects.create_user('reader')
+        faves = List.objects.create(user=user, name='Faves', slug='FAVES234')
+        self.client.force_login(user)
+        self.assertNotContains(self.client.get('/Titles/b.html'), 'star active')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/ajax/lists/{}/entries/bees'.format(faves.slug))
+        self.assertContains(self.client.get('/Titles/b.html'), 'title="Faves"')
+        with self.assertNumQueries(0):
+            self.assertEqual(List.memberships(user)[1], {self.story.pk: [faves]})
+
+    def test_list_batch(self):
+        user = get_user_model().objects.create_user('curator')
+        a, b = (List.objects.create(user=user, name=name, slug=name * 8) for name in 'AB')
+        Story(title='Wasps', slug='wasps').save()
+        self.client.force_login(user)
+
+        def batch(*ops):
+            return self.client.post('/ajax/lists/entries', {'ops': ops}, content_type='application/json')
+
+        response = batch({'op': 'add', 'lists': [a.slug, b.slug], 'stories': ['bees', 'wasps', 'ants']},
+                         {'op': 'add', 'lists': [a.slug], 'stories': ['bees']})
+        self.assertEqual(response.json(), {
+            'stories': {'bees': [a.slug, b.slug], 'wasps': [a.slug, b.slug]},
+            'missing': ['ants'],
+        })
+        response = batch({'op': 'move', 'from': a.slug, 'to': b.slug, 'stories': ['bees']},
+                         {'op': 'remove', 'lists': [b.slug], 'stories': ['wasps']})
+        self.assertEqual(response.json()['stories'], {'bees': [b.slug], 'wasps': [a.slug]})
+        self.assertEqual(batch({'op': 'copy', 'stories': []}).status_code, 400)
+
+    def test_hand_sorted_list(self):
+        user = get_user_model().objects.create_user('curator')
+        lst = List.objects.create(user=user, name='Picks', slug='P' * 8, auto_sort=False)
+        for title in ('Wasps', 'Ants'):
+            Story(title=title, slug=title.lower()).save()
+        story_ids = dict(Story.objects.values_list('slug', 'pk'))
+        ListEntry.add(user, [lst.pk], [story_ids[slug] for slug in ('bees', 'wasps', 'ants')])
+        self.client.force_login(user)
+
+        def order():
+            response = self.client.get(reverse('list', args=[lst.slug]))
+            return re.findall(r'<cite>(\w+)</cite>', response.content.decode())
+
+        self.assertEqual(order(), ['Bees', 'Wasps', 'Ants'])
+        ListEntry.place(user, lst.pk, story_ids['ants'], story_ids['bees'])
+        ListEntry.place(user, lst.pk, story_ids['wasps'])
+        self.assertEqual(order(), ['Wasps', 'Bees', 'Ants'])
+
+        # squeezed out of room, the list gets renumbered around the move
+        ListEntry.objects.filter(object_id=story_ids['ants']).update(ordinal=F('ordinal') - 1)
+        ListEntry.objects.filter(object_id=story_ids['bees']).update(ordinal=F('ordinal') + 510)
+        self.client.post('/ajax/lists/entries', {'ops': [
+            {'op': 'place', 'list': lst.slug, 'story': 'wasps', 'after': 'bees'},
+        ]}, content_type='application/json')
+        self.assertEqual(order(), ['Bees', 'Wasps', 'Ants'])
+        self.assertEqual(sorted(ListEntry.objects.values_list('ordinal', flat=True)), [2048, 2560, 3072])
@@ -23,12 +23,15 @@ urlpatterns = [
     path('Lists/index.html', views.list_index, name='lists'),
     path('Lists/<suuid:coll>/', views.list_page, name='list'),
     path('Sagas/index.html', views.saga_index, name='sagas'),
+    path('Search.html', views.search, name='search'),
     path('Sagas/<suuid:saga>/', views.saga_page, name='saga'),
     path('Sagas/<suuid:saga>/<slug:story>/index.html', views.story_page, name='saga_story'),
     path('Sagas/<suuid:saga>/<slug:story>/<int:ordinal>.html', views.installment_page, name='saga_installment'),
     path('Titles/index.html', views.letter_index, name='titles'),
     path('Titles/<slug:letter>.html', views.letter_page, name='letter'),
+    path('ajax/lists/entries', views.list_batch, name='list_batch'),
     path('ajax/lists/<suuid:coll>/entries/<slug:story>', views.list_toggle),
     path('<slug:story>/index.html', views.story_page, name='story'),
     path('<slug:story>/<int:ordinal>.html', views.installment_page, name='installment'),
+    path('<slug:story>/<int:ordinal>.body.html', views.installment_body, name='installment_body'),
 ]
@@ -1,11 +1,119 @@
 import base64
+import codecs
 import hashlib
 import re
+from html.parser import HTMLParser
 
 import shortuuid
 from num2words import num2words
 
 
+class TextCounter(HTMLParser):
+    """Count the words and (non-space) characters of the text in an HTML
+    document as it is fed, a chunk at a time. Block tags split words; the
+    contents of script and style don't count.
+
+    >>> counter = TextCounter()
+    >>> for chunk in ('<p>It was a dark and st', 'orm<i>y</i> night.</p><p>Yes', '.</p>'):
+    ...     counter.feed(chunk)
+    >>> counter.close()
+    >>> counter.words, counter.chars
+    (8, 29)
+    """
+    INLINE_TAGS = {'a', 'abbr', 'b', 'cite', 'em', 'font', 'i', 's', 'small', 'span', 'strong',
+                   'sub', 'sup', 'u'}
+    SKIP_TAGS = {'script', 'style'}
+
+    def __init__(self):
+        super().__init__()
+        self.words = 0
+        self.chars = 0
+        self._in_word = False
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skipping += 1
+        if tag not in self.INLINE_TAGS:
+            self._in_word = False
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skipping = max(self._skipping - 1, 0)
+        if tag not in self.INLINE_TAGS:
+            self._in_word = False
+
+    def handle_data(self, data):
+        if self._skipping:
+            return
+        for match in re_nonspace.finditer(data):
+            # a word carried over from the last piece of text
+            if not (match.start() == 0 and self._in_word):
+                self.words += 1
+            self.chars += match.end() - match.start()
+        self._in_word = bool(data) and not data[-1].isspace()
+
+
+def count_text(chunks, unit='w'):
+    """Count the words (`unit` 'w') or characters ('c') of an HTML document
+    given as an iterable of str or utf-8 encoded bytes chunks.
+
+    >>> count_text([b'<p>caf\\xc3', b'\\xa9 au lait</p>'])
+    3
+    >>> count_text(['<p>caf\\xe9 au lait</p>'], unit='c')
+    10
+    """
+    counter = feed_html(TextCounter(), chunks)
+    return counter.chars if unit == 'c' else counter.words
+
+
+class TextExtractor(TextCounter):
+    """A TextCounter that also keeps the text, with the whitespace
+    collapsed."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        super().handle_starttag(tag, attrs)
+        if tag not in self.INLINE_TAGS:
+            self._parts.append(' ')
+
+    def handle_endtag(self, tag):
+        super().handle_endtag(tag)
+        if tag not in self.INLINE_TAGS:
+            self._parts.append(' ')
+
+    def handle_data(self, data):
+        super().handle_data(data)
+        if not self._skipping:
+            self._parts.append(data)
+
+    @property
+    def text(self):
+        return re_space_any.sub(' ', ''.join(self._parts)).strip()
+
+
+def extract_text(chunks):
+    """The plain text of an HTML document, given as in count_text().
+
+    >>> extract_text([b'<p>Tea &amp; <i>cake</i></p><p>', b'After.</p>'])
+    'Tea & cake After.'
+    """
+    return feed_html(TextExtractor(), chunks).text
+
+
+def feed_html(parser, chunks):
+    """Feed an HTML parser str or utf-8 encoded bytes chunks, then close it."""
+    decode = codecs.getincrementaldecoder('utf-8')(errors='replace').decode
+    for chunk in chunks:
+        parser.feed(decode(chunk) if isinstance(chunk, bytes) else chunk)
+    parser.feed(decode(b'', final=True))
+    parser.close()
+    return parser
+
+
 # https://stackoverflow.com/a/7001371
 def char_range(c1, c2):
     for c in range(ord(c1), ord(c2) + 1):
@@ -55,6 +163,37 @@ def is_css_color(color):
             return True
 
 
+re_css_token = re.compile(r"""("(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'|url\([^)"']*\)|/\*.*?\*/)""", re.S)
+
+
+def minify_css(css):
+    """Strip comments and needless whitespace from a stylesheet. Spaces
+    before a colon are kept, since `a :hover` is a selector; strings and
+    unquoted urls are kept as they are.
+
+    >>> minify_css('a,  b {  color : red; } /* note */')
+    'a,b{color :red}'
+    >>> minify_css('q::before { content: " ;  " ; }')
+    'q::before{content:" ;  "}'
+    """
+    chunks, code = [], []
+    # code is at the even indexes, the tokens at the odd ones
+    for i, part in enumerate(re_css_token.split(css)):
+        if i % 2 == 0:
+            code.append(part)
+        elif not part.startswith('/*'):
+            chunks.extend((_minify_css_code(''.join(code)), part))
+            code = []
+    chunks.append(_minify_css_code(''.join(code)))
+    return ''.join(chunks).replace(';}', '}').strip()
+
+
+def _minify_css_code(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    return re.sub(r':\s+', ':', code)
+
+
 def get_author_slug(name):
     name = re.sub(r'[,.?!#$‘"“”(){}[\]]', '', name)
     # name = re.sub(r'[*&\'’]', '-', name)
@@ -100,20 +239,100 @@ def get_sort_name(name):
     return name
 
 
+def get_sort_letter(sort_name):
+    """Return the bucket a sort name is listed under on the Titles pages.
+
+    >>> get_sort_letter('zebra')
+    'Z'
+    """
+    return sort_name[:1].upper()
+
+
 STORIES_DIR = 'stories'
+BLOBS_DIR = 'blobs'
 
 
-def inst_path(slug, ordinal, published_on):
-    sort_dir = slug[0].upper()
-    sort_dir = sort_dir if re.match(r'[A-Z]', sort_dir) else '_'
-    file_name = '{}.{:03d}.{:%Y-%m-%d}.{}'.format(
-        slug, ordinal, published_on, 'html')
-    # TODO: make this not break on Windows
-    #       form really depends on the django storage in use, or is that handled?
-    return '/'.join((STORIES_DIR, sort_dir, slug, file_name))
+def blob_path(digest):
+    """Where the blob with a given sha256 hex digest is stored, fanned out
+    by its first two characters.
+
+    >>> blob_path('2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae')
+    'blobs/2c/2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae.html'
+    """
+    return '/'.join((BLOBS_DIR, digest[:2], digest + '.html'))
+
+
+re_qvalue = re.compile(r'\bq=([0-9.]+)')
+
+
+def pick_encoding(accept_encoding, available):
+    """Pick the content coding from `available` (best first) that an
+    Accept-Encoding header weighs highest, or None for the identity.
+
+    >>> pick_encoding('gzip, deflate, br', ['br', 'gzip'])
+    'br'
+    >>> pick_encoding('gzip;q=1.0, br;q=0.5', ['br', 'gzip'])
+    'gzip'
+    >>> pick_encoding('*, br;q=0', ['br', 'gzip'])
+    'gzip'
+    >>> pick_encoding('', ['br', 'gzip']) is None
+    True
+    """
+    weights = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        m = re_qvalue.search(params)
+        try:
+            weights[coding.strip()] = float(m.group(1)) if m else 1.0
+        except ValueError:
+            pass
+    best, best_q = None, 0
+    for coding in available:
+        q = weights.get(coding, weights.get('*', 0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+re_byte_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """Return `(start, stop)` for a Range header asking for one span of
+    `size` bytes, or None for anything else, which gets the whole thing.
+
+    >>> parse_range('bytes=0-99', 1000)
+    (0, 100)
+    >>> parse_range('bytes=900-', 1000), parse_range('bytes=-100', 1000)
+    ((900, 1000), (900, 1000))
+    >>> parse_range('bytes=500-4999', 1000)
+    (500, 1000)
+    >>> parse_range('bytes=0-1,5-9', 1000) is None
+    True
+    >>> parse_range('bytes=1000-', 1000)
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsatisfiable range: bytes=1000-
+    """
+    m = re_byte_range.match(header.strip()) if header else None
+    if not m or m.groups() == ('', ''):
+        return None
+    first, last = m.groups()
+    if first:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+        if stop <= start and start < size:
+            # last before first; not a range at all
+            return None
+    else:
+        start, stop = max(size - int(last), 0), size
+    if start >= stop:
+        raise ValueError('Unsatisfiable range: ' + header)
+    return start, stop
 
 
 re_space_any = re.compile(r'\s+')
+re_nonspace = re.compile(r'\S+')
 re_squote = re.compile(r'(?:(^|\s)|(.))(["\'])(.|$)', re.M)
 
 
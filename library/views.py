@@ -1,146 +1,134 @@
 import datetime as dt
+import hashlib
+import json
+import os
 from itertools import groupby
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db import IntegrityError
-from django.db.models import F, Count, OuterRef, Min, Exists
-from django.db.models.functions import Substr, Upper, ExtractYear, ExtractWeek
-from django.http import HttpResponse, Http404
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.core.paginator import InvalidPage
+from django.db import transaction
+from django.db.models import F, Count, Max, Min, Q
+from django.http import FileResponse, HttpResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.views.decorators.http import require_safe, require_http_methods, condition
+from django.utils.cache import quote_etag
+from django.views.decorators.http import require_safe, require_http_methods, require_POST, condition
+from django.views.decorators.vary import vary_on_headers
 
-from library.expressions import SQCount, ChillSubquery
-from library.models import Author, Installment, List, Story, Code, Saga, Theme
+from library.cache import CATALOG, DIGEST, READER, SITE, cache_tagged, get_versions, is_tagging, tag_request
+from library.models import ActivityEvent, Author, Blob, CatalogCount, Installment, List, ListEntry, Story, Code, \
+    Saga, Theme, WeeklyDigest
+from library.pagination import KeysetPaginator
+from library.search import get_backend as get_search_backend
+from library.util import parse_range, pick_encoding
 
 ONE_DAY = 24 * 60 * 60
 TIME_BEGINS = dt.date(1, 1, 1)
+STORIES_PER_PAGE = 100
+DAYS_PER_PAGE = 2
+RESULTS_PER_PAGE = 20
 
 
 @require_safe
 def index(request):
-    valid_insts = Installment.objects \
-        .order_by() \
-        .filter(story_id=OuterRef('pk'),
-                is_current=True) \
-        .exclude(file='') \
-        .values('pk')
-
-    valid_stories = Story.objects \
-        .annotate(valid_count=SQCount(valid_insts)) \
-        .exclude(valid_count=0) \
-        .exclude(removed_at__isnull=False) \
-        .count()
-
+    total = CatalogCount.counts(CatalogCount.KIND_TOTAL)
     context = {
-        'total_stories': valid_stories,
+        'total_stories': total.get('', 0),
     }
     return render(request, 'index.html', context)
 
 
 @require_safe
-# @cache_page(ONE_DAY)
+@cache_tagged(ONE_DAY, key_prefix='whats_new')
 def whats_new(request):
-    last_two = Story.objects \
-        .exclude(updated_on=None) \
-        .values_list('updated_on', flat=True) \
-        .order_by('-updated_on') \
-        .distinct()[:2]
+    tag_request(request, 'activity')
+    dates = ActivityEvent.objects \
+        .order_by('-date') \
+        .values_list('date', flat=True) \
+        .distinct()
+    if request.GET.get('before'):
+        try:
+            dates = dates.filter(date__lt=dt.date.fromisoformat(request.GET['before']))
+        except ValueError:
+            raise Http404('Invalid page.')
+    dates = list(dates[:DAYS_PER_PAGE + 1])
 
     def fetch_updates(date):
-        new_insts_exist = Installment.objects \
-            .order_by() \
-            .filter(story=OuterRef('pk'), published_on=date)
-
-        new_insts = Installment.objects \
+        not_revision = ~Q(kind=ActivityEvent.KIND_REVISION)
+        events = ActivityEvent.objects \
             .order_by() \
-            .filter(story_id=OuterRef('pk')) \
-            .values('ordinal') \
-            .annotate(ord_min=Min('published_on')) \
-            .filter(ord_min=date)
-
-        next_inst = Installment.objects \
-            .order_by('ordinal') \
-            .filter(story_id=OuterRef('pk')) \
-            .values('ordinal') \
-            .annotate(ord_min=Min('published_on')) \
-            .filter(ord_min=date) \
-            .values('ordinal')
-
-        return Story.display_objects \
-            .annotate(inst_on_date=Exists(new_insts_exist)) \
-            .filter(inst_on_date=True) \
-            .annotate(up_count=SQCount(new_insts),
-                      next_inst=ChillSubquery(next_inst[:1])) \
+            .filter(date=date) \
+            .values('story_id') \
+            .annotate(up_count=Count('pk', filter=not_revision),
+                      next_inst=Min('ordinal', filter=not_revision))
+        events = {e['story_id']: e for e in events}
+        tag_request(request, *('story:{}'.format(pk) for pk in events))
+
+        stories = Story.display_objects \
+            .filter(pk__in=events.keys()) \
             .iterator()
+        for story in stories:
+            story.up_count = events[story.pk]['up_count']
+            story.next_inst = events[story.pk]['next_inst']
+            yield story
 
-    days = [{'date': date, 'updates': fetch_updates(date)} for date in last_two]
+    days = [{'date': date, 'updates': fetch_updates(date)} for date in dates[:DAYS_PER_PAGE]]
 
     context = {
         'page_title': 'Recent Additions',
         'days': days,
+        # the day to page back from, if there are more
+        'earlier': dates[DAYS_PER_PAGE - 1] if len(dates) > DAYS_PER_PAGE else None,
     }
     return render(request, 'whats-new.html', context)
 
 
 @require_safe
+@cache_tagged(ONE_DAY, key_prefix='what_was_new')
 def what_was_new(request, year=None):
     this_year = dt.date.today().year
+    tag_request(request, DIGEST.format('years'))
     if not year:
-        year = Installment.objects \
-            .annotate(year=ExtractYear('published_on')) \
+        year = WeeklyDigest.objects \
             .order_by('-year') \
             .values_list('year', flat=True) \
             .first()
+        if not year:
+            raise Http404('No updates yet.')
 
-    prev_year = Installment.objects \
-        .annotate(year=ExtractYear('published_on')) \
+    prev_year = WeeklyDigest.objects \
         .filter(year__lt=year) \
         .order_by('-year') \
         .values_list('year', flat=True) \
         .first()
 
-    prev_versions_sq = Installment.objects \
-        .order_by() \
-        .filter(story_id=OuterRef('story_id'),
-                ordinal=OuterRef('ordinal'),
-                published_on__lt=OuterRef('published_on')) \
-        .values('pk')
-
-    prev_insts_sq = Installment.objects \
-        .order_by() \
-        .annotate(year=ExtractYear('published_on'),
-                  week=ExtractWeek('published_on')) \
-        .filter(story_id=OuterRef('story_id'),
-                published_on__lt=OuterRef('published_on')) \
-        .exclude(year=OuterRef('year'), week=OuterRef('week')) \
-        .values('pk')
-
-    updates = Installment.objects \
-        .order_by() \
-        .values('story_id') \
-        .annotate(year=ExtractYear('published_on'),
-                  week=ExtractWeek('published_on'),
-                  is_revision=Exists(prev_versions_sq),
-                  is_update=Exists(prev_insts_sq),
-                  up_count=Count('story_id')) \
-        .filter(year=year, is_revision=False) \
-        .order_by('-week', 'is_update', 'story__sort_title') \
-        .values('story__title',
-                'story__slug',
-                'story__slant_id',
-                'published_on',
-                'week',
-                'is_update',
-                'up_count',
-                )
-
-    def map_story(story):
+    tag_request(request, DIGEST.format(year))
+    updates = list(WeeklyDigest.objects
+                   .filter(year=year)
+                   .values('story_id',
+                           'published_on',
+                           'week',
+                           'is_update',
+                           'up_count',
+                           ))
+    # the stories are read after their stamps; see library.cache
+    tag_request(request, *('story:{}'.format(u['story_id']) for u in updates))
+    stories = Story.objects \
+        .only('title', 'sort_title', 'slug', 'slant_id') \
+        .in_bulk({u['story_id'] for u in updates})
+    updates.sort(key=lambda u: (-u['week'], u['is_update'], stories[u['story_id']].sort_title))
+
+    def map_story(update):
+        story = stories[update['story_id']]
         return {
-            'title': story['story__title'],
-            'slug': story['story__slug'],
-            'slant_cls': story['story__slant_id'],
-            'up_count': story['up_count'],
-            'published_on': story['published_on'],
+            'pk': story.pk,
+            'title': story.title,
+            'slug': story.slug,
+            'slant_cls': story.slant_id,
+            'up_count': update['up_count'],
+            'published_on': update['published_on'],
         }
 
     def make_week(number, stories):
@@ -173,14 +161,195 @@ def what_was_new(request, year=None):
     return render(request, 'what-was-new.html', context)
 
 
+def _etag(request, *parts, tags=()):
+    """Hash `parts` together with the current stamps for `tags`, the site
+    and, for a signed-in reader, their lists and profile. Cheap enough to
+    answer a conditional GET without rendering anything."""
+    tags = [SITE, *tags]
+    if request.user.is_authenticated:
+        tags.append(READER.format(request.user.pk))
+    versions = get_versions(tags)
+    values = [str(part) for part in parts] + [versions[tag] for tag in tags]
+    return hashlib.md5('|'.join(values).encode('utf-8')).hexdigest()
+
+
+def catalog_etag(request, *args, **kwargs):
+    # NOTE: bumped from library.signals whenever any listed story changes
+    return _etag(request, tags=[CATALOG])
+
+
+def _story_validators(request, story):
+    # shared by story_etag and story_last_modified
+    if not hasattr(request, '_story_validators'):
+        request._story_validators = Story.objects \
+            .filter(slug=story) \
+            .annotate(last_added=Max('installments__added_at')) \
+            .values_list('pk', 'added_at', 'updated_on', 'last_added') \
+            .first()
+    return request._story_validators
+
+
+def story_etag(request, story, saga=None):
+    row = _story_validators(request, story)
+    if row is None:
+        return None
+    tags = ['story:{}'.format(row[0])]
+    if saga:
+        tags.append('saga:' + saga)
+    return _etag(request, *row, tags=tags)
+
+
+def story_last_modified(request, story, saga=None):
+    # signed-in readers see their lists, which only the ETag covers
+    row = _story_validators(request, story)
+    if row is None or request.user.is_authenticated:
+        return None
+    pk, added_at, updated_on, last_added = row
+    dates = [added_at, last_added]
+    if updated_on:
+        dates.append(dt.datetime.combine(updated_on, dt.time(), tzinfo=dt.timezone.utc))
+    return max(d for d in dates if d)
+
+
+def installment_etag(request, story, ordinal, saga=None):
+    row = Installment.objects \
+        .filter(story__slug=story, ordinal=ordinal, is_current=True) \
+        .values_list('story_id', 'checksum') \
+        .first()
+    if row is None:
+        return None
+    tags = ['story:{}'.format(row[0])]
+    if saga:
+        tags.append('saga:' + saga)
+    return _etag(request, ordinal, row[1], tags=tags)
+
+
+def _body_variant(request, story, ordinal):
+    """Return `(name, coding, checksum)` for the stored variant of an
+    installment's HTML that suits the reader's Accept-Encoding best."""
+    # shared by installment_body_etag and installment_body
+    if not hasattr(request, '_body_variant'):
+        row = Installment.objects \
+            .filter(story__slug=story, ordinal=ordinal, is_current=True) \
+            .exclude(file='') \
+            .values_list('file', 'checksum', 'blob__encodings') \
+            .first()
+        variant = None
+        if row:
+            name, checksum, encodings = row
+            coding = pick_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''),
+                                   encodings.split(',') if encodings else [])
+            if coding:
+                name += Blob.VARIANTS[coding]
+            variant = (name, coding, checksum)
+        request._body_variant = variant
+    return request._body_variant
+
+
+def installment_body_etag(request, story, ordinal):
+    variant = _body_variant(request, story, ordinal)
+    if variant is None:
+        return None
+    # one per representation
+    name, coding, checksum = variant
+    return '{}.{}'.format(checksum, coding or 'identity')
+
+
+def _sendfile_value(path):
+    # X-Accel-Redirect wants a URL, for an internal location
+    if settings.SENDFILE_HEADER != 'X-Accel-Redirect':
+        return path
+    for root, prefix in settings.SENDFILE_LOCATIONS.items():
+        root = os.path.join(os.path.abspath(root), '')
+        if path.startswith(root):
+            return prefix.rstrip('/') + '/' + path[len(root):]
+    return None
+
+
+def _read_span(f, start, stop, chunk_size=64 * 1024):
+    with f:
+        f.seek(start)
+        while start < stop:
+            chunk = f.read(min(chunk_size, stop - start))
+            if not chunk:
+                break
+            start += len(chunk)
+            yield chunk
+
+
+def _serve_file(request, name, etag=None):
+    """Respond with the stored file `name`. A file on local disk is left
+    to the front server to send when SENDFILE_HEADER is set; otherwise
+    it's sent from here, as one span when a Range asks for it (and any
+    If-Range matches `etag`). Whole files go out through wsgi.file_wrapper,
+    which uWSGI hands to its offload threads."""
+    f = default_storage.open(name, 'rb')
+    path = getattr(f, 'name', None)
+    if settings.SENDFILE_HEADER and path and os.path.isabs(path):
+        value = _sendfile_value(path)
+        if value:
+            f.close()
+            response = HttpResponse()
+            response[settings.SENDFILE_HEADER] = value
+            return response
+
+    span = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range or if_range == etag:
+        try:
+            span = parse_range(request.META.get('HTTP_RANGE'), f.size)
+        except ValueError:
+            f.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{:d}'.format(f.size)
+            return response
+
+    if span:
+        start, stop = span
+        response = StreamingHttpResponse(_read_span(f, start, stop), status=206)
+        response['Content-Range'] = 'bytes {:d}-{:d}/{:d}'.format(start, stop - 1, f.size)
+        response['Content-Length'] = stop - start
+    else:
+        response = FileResponse(f)
+        # FileResponse would make a download of it
+        del response['Content-Disposition']
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _keyset_page(request, queryset, keys):
+    paginator = KeysetPaginator(queryset, keys, STORIES_PER_PAGE)
+    try:
+        return paginator.page(after=request.GET.get('after'),
+                              before=request.GET.get('before'))
+    except InvalidPage:
+        raise Http404('Invalid page.')
+
+
+def _story_page(request, stories):
+    # same order as Story.Meta.ordering, plus the tiebreaker
+    keys = ('sort_title', 'published_on', 'pk')
+    if not is_tagging(request):
+        return _keyset_page(request, stories, keys)
+
+    # find the page, then tag its stories before reading them; see library.cache
+    page = _keyset_page(request, stories.only(*keys[:-1]), keys)
+    tag_request(request, *('story:{}'.format(story.pk) for story in page))
+    by_pk = stories.in_bulk([story.pk for story in page])
+    page.object_list = [by_pk[story.pk] for story in page if story.pk in by_pk]
+    return page
+
+
+def _with_story_count(obj, counts):
+    obj.story_count = counts.get(str(obj.pk), 0)
+    return obj
+
+
 @require_safe
 def letter_index(request):
-    letters = Story.objects \
-        .annotate(letter=Upper(Substr('sort_title', 1, 1))) \
-        .values('letter') \
-        .annotate(story_count=Count('id', distinct=True)) \
-        .order_by('letter') \
-        .iterator()
+    counts = CatalogCount.counts(CatalogCount.KIND_LETTER)
+    letters = [{'letter': letter, 'story_count': counts[letter]}
+               for letter in sorted(counts)]
     context = {
         'page_title': 'Titles',
         'letters': letters,
@@ -189,24 +358,27 @@ def letter_index(request):
 
 
 @require_safe
-# @cache_page(ONE_DAY, key_prefix='letter')
+@condition(etag_func=catalog_etag)
+@cache_tagged(ONE_DAY, key_prefix='letter')
 def letter_page(request, letter):
-    stories = Story.display_objects \
-        .filter(sort_title__istartswith=letter) \
-        .iterator()
+    tag_request(request, 'letter:' + letter.upper())
+    stories = Story.display_objects.filter(sort_letter=letter.upper())
+    page = _story_page(request, stories)
     context = {
         'page_title': 'Stories: ' + letter,
-        'stories': stories,
+        'page': page,
+        'stories': page.object_list,
     }
     return render(request, 'letter.html', context)
 
 
 @require_safe
 def author_index(request):
+    counts = CatalogCount.counts(CatalogCount.KIND_AUTHOR)
     authors = Author.objects \
         .only('slug', 'name') \
-        .annotate(story_count=Count('stories')) \
         .iterator()
+    authors = (_with_story_count(a, counts) for a in authors)
     context = {
         'page_title': 'Authors',
         'authors': authors,
@@ -215,19 +387,20 @@ def author_index(request):
 
 
 @require_safe
+@condition(etag_func=catalog_etag)
 def author_page(request, author):
     author = get_object_or_404(Author, slug=author)
-    stories = author.stories \
-        .only('slug', 'title', 'slant_id', 'published_on', 'updated_on') \
-        .annotate(code_abbrs=Story.codes_sq(),
-                  installment_count=Story.installment_count_sq(),
-                  missing_count=Story.missing_count_sq())
+    stories = Story.display_objects \
+        .filter(authors=author) \
+        .only('slug', 'title', 'sort_title', 'slant_id', 'published_on', 'updated_on')
+    page = _story_page(request, stories)
     sagas = Saga.objects.filter(stories__authors__in=[author]).distinct()
     context = {
         'page_title': author.name,
         'author': author,
         'sagas': sagas,
-        'stories': stories,
+        'page': page,
+        'stories': page.object_list,
         'has_updated': False,
     }
     # TODO: updated col
@@ -236,7 +409,8 @@ def author_page(request, author):
 
 @require_safe
 def code_index(request):
-    codes = Code.objects.annotate(story_count=Count('stories'))
+    counts = CatalogCount.counts(CatalogCount.KIND_CODE)
+    codes = [_with_story_count(c, counts) for c in Code.objects.all()]
     context = {
         'page_title': 'Codes',
         'codes': codes,
@@ -245,17 +419,20 @@ def code_index(request):
 
 
 @require_safe
-# @cache_page(ONE_DAY, key_prefix='code')
+@condition(etag_func=catalog_etag)
+@cache_tagged(ONE_DAY, key_prefix='code')
 def code_page(request, abbr):
+    tag_request(request, 'code:' + abbr)
     code = get_object_or_404(Code, abbr=abbr)
     stories = Story.display_objects \
         .filter(codes__abbr=abbr) \
-        .only('slug', 'title', 'slant_id') \
-        .iterator()
+        .only('slug', 'title', 'sort_title', 'slant_id', 'published_on')
+    page = _story_page(request, stories)
     context = {
         'page_title': 'Codes; '+abbr,
         'code': code,
-        'stories': stories,
+        'page': page,
+        'stories': page.object_list,
     }
     return render(request, 'code.html', context)
 
@@ -282,14 +459,57 @@ def saga_page(request, saga):
 
 
 @require_safe
+def search(request):
+    query = request.GET.get('q', '').strip()
+    code = request.GET.get('code', '')
+    slant = request.GET.get('slant', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        raise Http404('Invalid page.')
+
+    results = []
+    has_next = False
+    if query:
+        backend = get_search_backend()
+        story_ids = backend.search(query,
+                                   codes=[code] if code else (),
+                                   slant=slant or None,
+                                   offset=(page - 1) * RESULTS_PER_PAGE,
+                                   limit=RESULTS_PER_PAGE + 1)
+        has_next = len(story_ids) > RESULTS_PER_PAGE
+        story_ids = story_ids[:RESULTS_PER_PAGE]
+        stories = Story.display_objects \
+            .only('slug', 'title', 'slant_id', 'published_on', 'updated_on') \
+            .in_bulk(story_ids)
+        snippets = backend.snippets(query, story_ids)
+        results = [(stories[pk], snippets.get(pk)) for pk in story_ids if pk in stories]
+
+    def page_query(number):
+        return {'q': query, 'code': code, 'slant': slant, 'page': number}
+
+    context = {
+        'page_title': 'Search',
+        'query': query,
+        'code': code,
+        'slant': slant,
+        'codes': Code.objects.all(),
+        'results': results,
+        'prev_query': page_query(page - 1) if page > 1 else None,
+        'next_query': page_query(page + 1) if has_next else None,
+    }
+    return render(request, 'search.html', context)
+
+
+@require_safe
+@condition(etag_func=story_etag, last_modified_func=story_last_modified)
 def story_page(request, story, saga=None):
     story = get_object_or_404(Story.display_objects, slug=story)
     installments = story.current_installments
     sagas = None
 
     if saga:
-        qs = Saga.display_objects \
-            .annotate(current_index=Saga.current_index_sq(story))
+        qs = Saga.display_objects.navigating(story)
         saga = get_object_or_404(qs, slug=saga)
     else:
         sagas = story.sagas.only('slug', 'name').all()
@@ -312,29 +532,32 @@ def story_page(request, story, saga=None):
             {'cls': 'wc', 'name': 'Length'},
             {'cls': 'cdate', 'name': 'Published'},
         ]
-        # TODO: authors
-        if next(filter(lambda inst: inst.date_updated, installments), None):
+        if any(inst.date_updated for inst in installments):
             context['headers'].append({'cls': 'mdate', 'name': 'Updated'})
+        story_authors = {a['name'] for a in story.author_dicts}
+        if any({a['name'] for a in inst.author_dicts} - story_authors
+               for inst in installments):
+            context['headers'].insert(0, {'cls': 'authors', 'name': 'Author'})
         context['installments'] = installments
 
-    try:
+    if request.user.is_authenticated:
+        user_lists, story_lists = List.memberships(request.user)
         context.update({
-            'user_lists': request.user.lists.all(),
-            'story_lists': story.user_lists(request.user),
+            'user_lists': user_lists,
+            'story_lists': story_lists.get(story.pk, []),
         })
-    except AttributeError:
-        pass
 
     return render(request, 'title.html', context)
 
 
 @require_safe
 @login_required
+@condition(etag_func=installment_etag)
 def installment_page(request, story, ordinal, saga=None):
-    qs = Story.objects.only('slug', 'title')
+    qs = Story.display_objects.only('slug', 'title')
     story = get_object_or_404(qs, slug=story)
-    inst = story.current_installments \
-        .filter(ordinal=ordinal) \
+    inst = story.installments \
+        .filter(is_current=True, ordinal=ordinal) \
         .annotate(story_title=F('story__title'),
                   prev=Installment.prev_sq(),
                   next=Installment.next_sq()) \
@@ -346,8 +569,7 @@ def installment_page(request, story, ordinal, saga=None):
         title = title + ' ({:d} of {:d})'.format(ordinal, installment_count)
 
     if saga:
-        qs = Saga.display_objects \
-            .annotate(current_index=Saga.current_index_sq(story))
+        qs = Saga.display_objects.navigating(story)
         saga = get_object_or_404(qs, slug=saga)
 
     context = {
@@ -361,9 +583,29 @@ def installment_page(request, story, ordinal, saga=None):
         'next': inst.next,
         'installment_count': installment_count,
     }
+    # the body comes from installment_body
     return render(request, 'installment.html', context)
 
 
+@require_safe
+@login_required
+@vary_on_headers('Accept-Encoding')
+@condition(etag_func=installment_body_etag)
+def installment_body(request, story, ordinal):
+    """Just the stored HTML of an installment, as precompressed at write
+    time when the reader accepts one of its variants. Loaded by the
+    installment page; see _serve_file for how the bytes are sent."""
+    variant = _body_variant(request, story, ordinal)
+    if variant is None:
+        raise Http404('No such installment.')
+    name, coding, _ = variant
+    response = _serve_file(request, name, quote_etag(installment_body_etag(request, story, ordinal)))
+    response['Content-Type'] = 'text/html; charset=utf-8'
+    if coding:
+        response['Content-Encoding'] = coding
+    return response
+
+
 @require_safe
 @login_required
 def list_index(request):
@@ -378,13 +620,21 @@ def list_index(request):
 @login_required
 def list_page(request, coll):
     user_list = get_object_or_404(List, slug=coll, user=request.user)
-    stories = Story.display_objects \
-        .filter(list_entries__list=user_list) \
-        .only('slug', 'title', 'slant_id') \
-        .iterator()
+    stories = Story.display_objects.only('slug', 'title', 'sort_title', 'slant_id', 'published_on')
+    if user_list.auto_sort:
+        page = _story_page(request, stories.filter(list_entries__list=user_list))
+        stories = page.object_list
+    else:
+        # in the reader's order: one range of the (list, ordinal) index,
+        # then the stories on it by pk
+        entries = user_list.entries.only('object_id', 'ordinal')
+        page = _keyset_page(request, entries, ('ordinal', 'pk'))
+        by_pk = stories.in_bulk([entry.object_id for entry in page])
+        stories = [by_pk[entry.object_id] for entry in page if entry.object_id in by_pk]
     context = {
         'page_title': user_list.name,
         'list': user_list,
+        'page': page,
         'stories': stories,
     }
     return render(request, 'list.html', context)
@@ -393,16 +643,96 @@ def list_page(request, coll):
 @require_http_methods(['PUT', 'DELETE'])
 @login_required
 def list_toggle(request, coll, story):
-    try:
-        user_list = List.objects.get(slug=coll, user=request.user)
-        story = Story.objects.filter(slug=story).only('pk').get()
-        if request.method == 'PUT':
-            story.list_entries.create(list=user_list)
-        else:
-            story.list_entries.filter(list=user_list).delete()
-        return HttpResponse(status=204)
-    except (List.DoesNotExist, Story.DoesNotExist, IntegrityError):
+    list_id = List.objects.filter(slug=coll, user=request.user).values_list('pk', flat=True).first()
+    story_id = Story.objects.filter(slug=story).values_list('pk', flat=True).first()
+    if list_id is None or story_id is None:
         return HttpResponse(status=304)
+    edit = ListEntry.add if request.method == 'PUT' else ListEntry.remove
+    edit(request.user, [list_id], [story_id])
+    return HttpResponse(status=204)
+
+
+LIST_OPS = ('add', 'remove', 'move', 'place')
+
+
+def _parse_list_ops(body):
+    """Turn a batch into `(op, list_slugs, story_slugs, after)` steps, `op`
+    being add, remove or place; a move is a remove from one list and an add
+    to another. Only a place has an `after`, the story to put the others
+    behind, or None for the top."""
+    def slugs(value):
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError('Expected a list of slugs.')
+        return value
+
+    steps = []
+    for op in json.loads(body)['ops']:
+        if op['op'] not in LIST_OPS:
+            raise ValueError('Unknown op: {}'.format(op['op']))
+        if op['op'] == 'place':
+            after = op.get('after')
+            steps.append(('place', slugs([op['list']]), slugs([op['story']]),
+                          after if after is None else slugs([after])[0]))
+            continue
+        stories = slugs(op['stories'])
+        if op['op'] == 'move':
+            steps.append(('remove', slugs([op['from']]), stories, None))
+            steps.append(('add', slugs([op['to']]), stories, None))
+        else:
+            steps.append((op['op'], slugs(op['lists']), stories, None))
+    return steps
+
+
+@require_POST
+@login_required
+def list_batch(request):
+    """Apply a batch of edits to the reader's lists, in order and all at
+    once, e.g.::
+
+        {"ops": [{"op": "add", "lists": ["..."], "stories": ["..."]},
+                 {"op": "remove", "lists": ["..."], "stories": ["..."]},
+                 {"op": "move", "from": "...", "to": "...", "stories": ["..."]},
+                 {"op": "place", "list": "...", "story": "...", "after": "..." or null}]}
+
+    Stories are added to the end of a list; place moves one within a list
+    that isn't auto sorted, after another or to the top. Respond with the
+    lists each of the stories is on afterwards, by slug, and any slugs
+    that matched nothing.
+    """
+    try:
+        steps = _parse_list_ops(request.body)
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'error': 'Bad batch: {}'.format(e)}, status=400)
+
+    list_slugs = {slug for _, lists, _, _ in steps for slug in lists}
+    story_slugs = {slug for _, _, stories, after in steps for slug in stories + [after] if slug}
+    list_ids = dict(request.user.lists.filter(slug__in=list_slugs).values_list('slug', 'pk'))
+    story_ids = dict(Story.objects.filter(slug__in=story_slugs).values_list('slug', 'pk'))
+
+    with transaction.atomic():
+        for op, lists, stories, after in steps:
+            lists = [list_ids[slug] for slug in lists if slug in list_ids]
+            stories = [story_ids[slug] for slug in stories if slug in story_ids]
+            if op == 'place':
+                if lists and stories and (after is None or after in story_ids):
+                    ListEntry.place(request.user, lists[0], stories[0], story_ids.get(after))
+            else:
+                edit = ListEntry.add if op == 'add' else ListEntry.remove
+                edit(request.user, lists, stories)
+
+    story_lists = {pk: [] for pk in story_ids.values()}
+    rows = ListEntry.objects \
+        .filter(list__user=request.user,
+                content_type=ContentType.objects.get_for_model(Story),
+                object_id__in=story_lists.keys()) \
+        .order_by('-list__priority', 'list__name') \
+        .values_list('object_id', 'list__slug')
+    for story_id, list_slug in rows:
+        story_lists[story_id].append(list_slug)
+    return JsonResponse({
+        'stories': {slug: story_lists[pk] for slug, pk in story_ids.items()},
+        'missing': sorted((list_slugs - list_ids.keys()) | (story_slugs - story_ids.keys())),
+    })
 
 
 @require_http_methods(['GET', 'HEAD', 'POST'])
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/dev/ref/settings/
 
 import re
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / ...
@@ -126,6 +127,20 @@ else:
     }
 
 
+# Caching
+# https://docs.djangoproject.com/en/dev/topics/cache/
+# Version stamps in library.cache must be visible to every process serving
+# requests, or a change only reaches the one that saved it. LocMemCache is
+# per process, so don't use it outside of a single-process runserver.
+
+CACHES = {
+    'default': {
+        'BACKEND':  os.getenv('CACHE_BACKEND',  'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'storkive-cache')),
+    },
+}
+
+
 # Authentication
 
 LOGIN_URL = 'login'
@@ -234,3 +249,13 @@ STATIC_ROOT = BASE_DIR / 'static'
 # Customization
 
 STORKIVE_NAME = 'Storkive Digital Library'
+
+
+# File transfers
+# Set SENDFILE_HEADER to have the front server send installment bodies from
+# local disk: X-Sendfile (Apache, lighttpd, uWSGI routing) gets the path,
+# X-Accel-Redirect (nginx) an internal location from SENDFILE_LOCATIONS,
+# which maps local directories to them. See library.views._serve_file.
+
+SENDFILE_HEADER = None
+SENDFILE_LOCATIONS = {}
@@ -45,8 +45,48 @@ INSTALLED_APPS = [
 ]
 
 
+# Caching
+# https://docs.djangoproject.com/en/dev/topics/cache/
+# Shared by the uWSGI workers; see settings.common.
+
+CACHES = {
+    'default': {
+        'BACKEND':  os.getenv('CACHE_BACKEND',  'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/var/tmp/storkive-cache'),
+    },
+}
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/dev/howto/static-files/
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.getenv('MEDIA_ROOT', '/var/www/storkive/media/')
+
+
+# Media
+# With MEDIA_STORAGE set (e.g. storages.backends.gcloud.GoogleCloudStorage),
+# installment blobs are read through a local disk cache shared by the uWSGI
+# workers; see library.storage.LocalCacheStorage. `manage.py cull_media_cache`
+# keeps it within MAX_SIZE, run every few minutes (see the Dockerfile).
+
+if os.getenv('MEDIA_STORAGE'):
+    DEFAULT_FILE_STORAGE = 'library.storage.LocalCacheStorage'
+    MEDIA_CACHE = {
+        'BACKEND': os.getenv('MEDIA_STORAGE'),
+        'LOCATION': os.getenv('MEDIA_CACHE_LOCATION', '/var/tmp/storkive-media'),
+        'MAX_SIZE': int(os.getenv('MEDIA_CACHE_MAX_SIZE', 2 * 1024 ** 3)),
+    }
+
+
+# File transfers
+# With nginx, the internal locations for X-Accel-Redirect have to pass on
+# Content-Encoding themselves, e.g. add_header Content-Encoding
+# $upstream_http_content_encoding; see settings.common.
+
+SENDFILE_HEADER = os.getenv('SENDFILE_HEADER')
+SENDFILE_LOCATIONS = {
+    MEDIA_ROOT: '/_media/',
+}
+if os.getenv('MEDIA_STORAGE'):
+    SENDFILE_LOCATIONS[MEDIA_CACHE['LOCATION']] = '/_media-cache/'